@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Times every stage of a conversion, on the songs in midi_files/ and on
+# synthetic songs of growing size, and writes the results as JSON.
+#
+#     python benchmark.py -sizes 1000 10000 100000 1000000 -output bench.json
+#
+# The stages are timed one after the other, each on the finished output
+# of the one before, so the numbers don't include each other:
+#
+#     parse_mido        mido.MidiFile reading the whole file
+#     parse_midiparser  lib/midiparser.py decoding every track
+#     merge             merging the tracks into one stream (lib/stream.py)
+#     voices            tempo map, voice allocation and chord durations
+#     moves_<engine>    frequencies, feed rates and distances
+#     write             formatting the moves as Gcode
+#     convert           the whole of lib/converter.convert(), for reference
+#
+# Between the stages the events are kept in columnar timelines
+# (lib/timeline.py), which keeps ten million events within a few
+# hundred megabytes. mido needs a Python object per event, so it is
+# left out above -midolimit events and the result says so.
+
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from importlib import metadata
+
+import mido
+
+import lib.midiparser as midiparser
+from lib.converter import convert
+from lib.gcodewriter import GCodeWriter
+from lib.machines import axes_dict, rate_dict
+from lib.moves import ChordTimeline, engines
+from lib.stream import merge_tracks, chords
+from lib.synthmidi import synthetic_midi
+from lib.timeline import Timeline
+from lib.voices import VoiceAllocator
+
+machine = 'multicam_custom'
+ppu = [200.0, 200.0, 200.0]
+block_size = 65536
+
+
+class Stage:
+    # Wall and CPU time of one stage, possibly accumulated over several
+    # timed sections
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    def __enter__(self):
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall += time.perf_counter() - self.wall_start
+        self.cpu += time.process_time() - self.cpu_start
+
+    def result(self, items):
+        return {
+            'wall': self.wall,
+            'cpu': self.cpu,
+            'items': items,
+            'rate': items / self.wall if self.wall > 0 else None,
+        }
+
+
+def available_engines():
+    names = ['python']
+    try:
+        import numpy
+        names.append('numpy')
+    except ImportError:
+        pass
+    return names
+
+
+def block(timeline, start, end):
+    # Rows start to end of a ChordTimeline
+    part = ChordTimeline()
+    part.tick = timeline.tick[start:end]
+    part.duration = timeline.duration[start:end]
+    part.notes = tuple(column[start:end] for column in timeline.notes)
+    return part
+
+
+def bench_file(path, args):
+    stages = {}
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    # lib/midiparser.py decodes straight from the mapped file
+    with midiparser.File(path) as midi:
+        num_tracks = len(midi.track_chunks)
+        ticks_per_beat = midi.division
+
+        stage = Stage()
+        with stage:
+            tracks = [Timeline(ticks_per_beat, num_tracks).fill(events) for events in midi.track_events()]
+        events = sum(len(track.table) + len(track.tempo) for track in tracks)
+        stages['parse_midiparser'] = stage.result(events)
+
+    if events <= args.midolimit:
+        stage = Stage()
+        with stage:
+            parsed = mido.MidiFile(file=io.BytesIO(data))
+        stages['parse_mido'] = stage.result(sum(len(track) for track in parsed.tracks))
+        del parsed
+    else:
+        stages['parse_mido'] = {'skipped': 'more than %d events' % args.midolimit}
+
+    stage = Stage()
+    with stage:
+        merged = Timeline(ticks_per_beat, num_tracks).fill(merge_tracks(track.events() for track in tracks))
+    stages['merge'] = stage.result(events)
+    del tracks
+
+    stage = Stage()
+    timeline = ChordTimeline()
+    with stage:
+        for tick, duration, notes_xyz in chords(merged.events(), axes_dict.get('XYZ'), ticks_per_beat, None, VoiceAllocator()):
+            timeline.append(tick, duration, notes_xyz)
+    stages['voices'] = stage.result(events)
+    del merged
+
+    # The moves are computed and written a block at a time, so that
+    # only one block of them is ever held as Python floats
+    feedrate_factor = rate_dict.get('seconds')[2]
+    for name in available_engines():
+        stage = Stage()
+        write = Stage()
+        with open(os.devnull, 'w') as devnull:
+            writer = GCodeWriter(devnull, ppu)
+            x = y = z = 0.0
+            for start in range(0, len(timeline), block_size):
+                part = block(timeline, start, start + block_size)
+                with stage:
+                    moves = engines[name](part, ppu, (0, 0, 0), feedrate_factor)
+                if name != 'python':
+                    continue
+                with write:
+                    distance = moves.distance
+                    for k in range(len(moves)):
+                        if distance[0][k] + distance[1][k] + distance[2][k] > 0.0:
+                            x += distance[0][k]
+                            y += distance[1][k]
+                            z += distance[2][k]
+                            writer.move(x, y, z, moves.combined_feedrate[k])
+                        elif part.duration[k] > 0:
+                            writer.dwell(part.duration[k])
+                    writer.flush()
+        stages['moves_' + name] = stage.result(len(timeline))
+        if name == 'python':
+            stages['write'] = write.result(writer.lines)
+
+    if events <= args.midolimit:
+        stage = Stage()
+        lines = 0
+        with stage:
+            options = {'safemin': [-1e12] * 3, 'safemax': [1e12] * 3}
+            for line in convert(data, machine, options):
+                lines += 1
+        stages['convert'] = stage.result(events)
+    else:
+        stages['convert'] = {'skipped': 'more than %d events' % args.midolimit}
+
+    return {
+        'bytes': len(data),
+        'tracks': num_tracks,
+        'events': events,
+        'chords': len(timeline),
+        'stages': stages,
+    }
+
+
+def best_of(path, args):
+    # The fastest of args.repeat runs, stage by stage
+    best = None
+    for run in range(args.repeat):
+        result = bench_file(path, args)
+        if best is None:
+            best = result
+            continue
+        for name, stage in result['stages'].items():
+            if 'wall' in stage and stage['wall'] < best['stages'][name]['wall']:
+                best['stages'][name] = stage
+    return best
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Times each stage of the MIDI to Gcode conversion and writes the results as JSON.')
+    parser.formatter_class = argparse.ArgumentDefaultsHelpFormatter
+
+    parser.add_argument(
+        '-files', '--files',
+        nargs   = '*',
+        default = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'midi_files', '*.mid'))),
+        help    = 'MIDI files to benchmark'
+    )
+
+    parser.add_argument(
+        '-sizes', '--sizes',
+        nargs   = '*',
+        type    = int,
+        default = [1000, 10000, 100000, 1000000],
+        help    = 'number of note events of each synthetic song, e.g. "1000 10000000"'
+    )
+
+    parser.add_argument(
+        '-tracks', '--tracks',
+        type    = int,
+        default = 16,
+        help    = 'number of tracks of the synthetic songs'
+    )
+
+    parser.add_argument(
+        '-chord', '--chord',
+        type    = int,
+        default = 4,
+        help    = 'notes per chord in the synthetic songs'
+    )
+
+    parser.add_argument(
+        '-tempoevery', '--tempoevery',
+        type    = int,
+        default = 16,
+        help    = 'chords between tempo changes in the synthetic songs (0 for a single tempo)'
+    )
+
+    parser.add_argument(
+        '-seed', '--seed',
+        type    = int,
+        default = 0,
+        help    = 'random seed of the synthetic songs'
+    )
+
+    parser.add_argument(
+        '-repeat', '--repeat',
+        type    = int,
+        default = 1,
+        help    = 'run everything this many times and keep the fastest time of each stage'
+    )
+
+    parser.add_argument(
+        '-midolimit', '--midolimit',
+        type    = int,
+        default = 2000000,
+        help    = 'skip the mido stages for songs with more events than this'
+    )
+
+    parser.add_argument(
+        '-output', '--output',
+        help    = 'write the JSON results to this file instead of the terminal'
+    )
+
+    return parser
+
+
+def main(argv):
+    args = build_parser().parse_args(argv[1:])
+
+    results = []
+    for path in args.files:
+        print("Benchmarking %s" % path, file=sys.stderr)
+        result = best_of(path, args)
+        result['source'] = os.path.basename(path)
+        results.append(result)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            print("Benchmarking %d synthetic events" % size, file=sys.stderr)
+            path = os.path.join(directory, 'synthetic_%d.mid' % size)
+            with open(path, 'wb') as f:
+                f.write(synthetic_midi(size, args.tracks, args.chord, args.tempoevery, seed=args.seed))
+            result = best_of(path, args)
+            result['source'] = 'synthetic'
+            result['size'] = size
+            results.append(result)
+            os.remove(path)
+
+    report = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'engines': available_engines(),
+        'mido': metadata.version('mido'),
+        'synthetic': {
+            'tracks': args.tracks,
+            'chord': args.chord,
+            'tempoevery': args.tempoevery,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+        print()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,95 @@
+# Converts many MIDI files, for one or more machines, on a pool of
+# worker processes.
+#
+# Every (input, machine) pair is one job writing one Gcode file. The
+# workers never print, each job comes back as a record with its status
+# and timing, and the records are reported by the calling process in
+# the order the jobs finish.
+
+import glob
+import os.path
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .cache import ConversionCache, convert_cached
+from .converter import convert, resolve_options
+from .gcodewriter import GCodeWriter
+
+
+def find_inputs(source):
+    # A directory (all .mid/.midi files in it) or a glob pattern
+    if os.path.isdir(source):
+        names = [name for name in os.listdir(source)
+                 if os.path.splitext(name)[1].lower() in ('.mid', '.midi')]
+        return sorted(os.path.join(source, name) for name in names)
+    return sorted(glob.glob(source))
+
+
+def batch_jobs(inputs, machines, outdir):
+    # (input, machine, output) for every input and machine. With a single
+    # machine the output is named after the input only, otherwise the
+    # machine name is added.
+    jobs = []
+    for infile in inputs:
+        stem = os.path.splitext(os.path.basename(infile))[0]
+        for machine in machines:
+            if len(machines) == 1:
+                name = stem + ".gcode"
+            else:
+                name = "%s_%s.gcode" % (stem, machine)
+            jobs.append((infile, machine, os.path.join(outdir, name)))
+    return jobs
+
+
+def convert_job(infile, machine, outfile, options, cache_dir=None, cache_size=None):
+    # Runs in a worker: converts one file and returns its record. With a
+    # cache_dir, earlier conversions of the same file and settings are
+    # reused (see lib/cache.py).
+    record = {
+        'input': infile,
+        'machine': machine,
+        'output': outfile,
+        'status': 'ok',
+        'error': None,
+        'lines': 0,
+        'cached': False,
+        'wall': 0.0,
+        'cpu': 0.0,
+    }
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        if os.path.getsize(infile) == 0:
+            raise ValueError("Input file %s is empty" % os.path.basename(infile))
+        resolved = resolve_options(machine, options)
+        with open(outfile, 'w') as f:
+            writer = GCodeWriter(f, resolved.ppu, resolved.precision)
+            if cache_dir:
+                cache = ConversionCache(cache_dir, cache_size)
+                writer.write_lines(convert_cached(cache, infile, machine, resolved))
+                record['cached'] = cache.hits > 0
+            else:
+                writer.write_lines(convert(infile, machine, resolved))
+            writer.flush()
+        record['lines'] = writer.lines
+    except Exception as e:
+        record['status'] = 'failed'
+        record['error'] = "%s: %s" % (type(e).__name__, e)
+        if os.path.exists(outfile):
+            os.remove(outfile)
+    record['wall'] = time.perf_counter() - wall
+    record['cpu'] = time.process_time() - cpu
+    return record
+
+
+def run_batch(jobs, options=None, workers=None, cache_dir=None, cache_size=None):
+    # Yields the record of every job as it finishes. At most workers
+    # processes run at once (default: one per CPU).
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(jobs)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(convert_job, infile, machine, outfile, options, cache_dir, cache_size)
+                   for infile, machine, outfile in jobs]
+        for future in as_completed(futures):
+            yield future.result()
@@ -0,0 +1,185 @@
+# On-disk cache of finished conversions.
+#
+# An entry is keyed by the SHA-256 of the MIDI bytes together with
+# every setting that changes the output: the machine profile, the
+# resolved ppu and safe envelope, axes, transpose, positions, units,
+# feed rate scheme, channels, precision, comments and the prefix/postfix
+# contents (see output_settings below). A hit returns the stored Gcode
+# without parsing anything. Entries are plain files whose modification
+# time is bumped on every hit, and the least recently used ones are
+# removed once the cache grows past its size limit.
+#
+# Hit and miss counters are kept in stats.json. Parallel batch workers
+# can lose an update to them now and then, the entries themselves are
+# always written atomically.
+
+import hashlib
+import json
+import os
+
+from .converter import convert, resolve_options, source_name
+from .machines import machines_dict
+
+# Bump when a change to the converter alters the Gcode it produces, so
+# old entries stop matching
+cache_version = 3
+
+default_max_size = 256*1024*1024
+
+
+def output_settings(machine, options):
+    # Everything in the resolved options that ends up in the output
+    return {
+        'version': cache_version,
+        'name': options.name,
+        'machine': machines_dict[machine],
+        'ppu': list(options.ppu),
+        'safemin': list(options.safemin),
+        'safemax': list(options.safemax),
+        'axes': options.axes,
+        'transpose': [int(t) for t in options.transpose],
+        'positions': options.positions,
+        'units': options.units,
+        'feedrate': options.feedrate,
+        'channels': sorted(set(options.channels)),
+        'precision': options.precision,
+        'comments': options.comments,
+        'compact': options.compact,
+        'modal': options.modal,
+        'prefix': options.prefix,
+        'postfix': options.postfix,
+    }
+
+
+def read_source(midi_source):
+    # The MIDI bytes of a filename, bytes or binary file object
+    if isinstance(midi_source, (str, os.PathLike)):
+        with open(midi_source, 'rb') as f:
+            return f.read()
+    if isinstance(midi_source, (bytes, bytearray, memoryview)):
+        return bytes(midi_source)
+    return midi_source.read()
+
+
+class ConversionCache:
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = default_max_size if max_size is None else max_size
+        os.makedirs(directory, exist_ok=True)
+
+        # Lookups made through this instance, the totals of every run
+        # are in stats()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, midi_bytes, machine, options):
+        digest = hashlib.sha256(midi_bytes)
+        digest.update(json.dumps(output_settings(machine, options), sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.gcode')
+
+    def get(self, key):
+        # The cached Gcode text, or None
+        path = self.path(key)
+        try:
+            with open(path) as f:
+                text = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            self.count('misses')
+            return None
+        os.utime(path)
+        self.hits += 1
+        self.count('hits')
+        return text
+
+    def put(self, key, text):
+        path = self.path(key)
+        temp = "%s.%d.tmp" % (path, os.getpid())
+        with open(temp, 'w') as f:
+            f.write(text)
+        os.replace(temp, path)
+        self.evict()
+
+    def entries(self):
+        # (mtime, size, path) of every entry, least recently used first
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.gcode'):
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        entries = self.entries()
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, path in entries:
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+            self.count('evictions')
+
+    def load_counters(self):
+        try:
+            with open(os.path.join(self.directory, 'stats.json')) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def count(self, counter):
+        counters = self.load_counters()
+        counters[counter] = counters.get(counter, 0) + 1
+        path = os.path.join(self.directory, 'stats.json')
+        temp = "%s.%d.tmp" % (path, os.getpid())
+        with open(temp, 'w') as f:
+            json.dump(counters, f)
+        os.replace(temp, path)
+
+    def stats(self):
+        entries = self.entries()
+        stats = {
+            'directory': self.directory,
+            'entries': len(entries),
+            'size': sum(entry[1] for entry in entries),
+            'max_size': self.max_size,
+        }
+        stats.update(self.load_counters())
+        return stats
+
+    def clear(self):
+        for mtime, size, path in self.entries():
+            os.remove(path)
+
+
+def convert_cached(cache, midi_source, machine='multicam_custom', options=None, log=None, profiler=None):
+    # Same as converter.convert(), but answered from the cache when the
+    # MIDI bytes and settings were converted before. A fresh conversion
+    # is only stored once it has completed.
+    options = resolve_options(machine, options)
+    if options.name is None:
+        options.name = source_name(midi_source)
+    midi_bytes = read_source(midi_source)
+    key = cache.key(midi_bytes, machine, options)
+
+    text = cache.get(key)
+    if text is not None:
+        if log is not None:
+            log("Gcode taken from the cache:\n    %s" % cache.path(key))
+        yield from text.splitlines(keepends=True)
+        return
+
+    lines = []
+    for line in convert(midi_bytes, machine, options, log, profiler):
+        lines.append(line)
+        yield line
+    cache.put(key, "".join(lines))
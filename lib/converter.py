@@ -0,0 +1,425 @@
+# Conversion of a MIDI file into G-code, usable from other programs.
+#
+#     from lib.converter import convert
+#     for line in convert('song.mid', 'cupcake', {'axes': 'XY'}):
+#         ...
+#
+# convert() is a generator of G-code lines, produced while the MIDI
+# file is being read. The options are the long names of the command
+# line arguments of mid2cnc.py (see option_defaults below), and
+# whatever is left out comes from the machine profile. Nothing is
+# printed unless a print-like log function is passed in.
+
+import argparse
+import os.path
+
+from .machines import machines_dict, units_dict, rate_dict, axes_dict
+from .moves import compute_blocks, engines, max_block_sizes
+from .stream import merge_tracks, held_by_tick, chords
+from .parsers import parse, logged_events
+from .voices import VoiceAllocator
+from .gcodewriter import GCodeWriter
+from .timeline import load_timeline
+from .profiler import no_profiler
+from .envelope import EnvelopeError, Folder, fold_engines
+
+# Settings that change the output, with the defaults used when an
+# option is not given. ppu, safemin and safemax default to the machine
+# profile, prefix and postfix are lists of Gcode lines. name is the
+# input name written in the header, by default the MIDI file name.
+# parser and sidecar only change how the notes are read (see
+# lib/parsers.py and lib/timeline.py). positions is 'reverse' to turn
+# an axis around before a move would cross the edge of the envelope, or
+# 'fold' to bounce off the edges (see lib/envelope.py). modal leaves
+# out the words the controller still has in effect (see
+# lib/gcodewriter.py), None takes the default of the machine profile.
+option_defaults = {
+    'channels': list(range(16)),
+    'units': 'metric',
+    'ppu': None,
+    'safemin': None,
+    'safemax': None,
+    'prefix': None,
+    'postfix': None,
+    'axes': 'XYZ',
+    'feedrate': 'seconds',
+    'transpose': (0, 0, 0),
+    'positions': 'reverse',
+    'precision': None,
+    'engine': 'python',
+    'comments': True,
+    'compact': True,
+    'modal': None,
+    'name': None,
+    'parser': 'auto',
+    'sidecar': False,
+    'verbose': False,
+}
+
+
+def reached_limit(current, distance, direction, min, max):
+    # Returns true if the proposed movement will exceed the
+    # safe working limits of the machine but the movement is
+    # allowable in the reverse direction
+    #
+    # Returns false if the movement is allowable in the
+    # current direction
+    # 
+    # Raises EnvelopeError if the movement is not possible in either direction
+
+    if ( ( (current + (distance * direction)) < max ) and 
+         ( (current + (distance * direction)) > min ) ):
+        # Movement in the current direction is within safe limits,
+        return False
+
+    elif ( ( (current + (distance * direction)) >= max ) and 
+           ( (current - (distance * direction)) >  min ) ):
+        # Movement in the current direction violates maximum safe
+        # value, but would be safe if the direction is reversed
+        return True
+
+    elif ( ( (current + (distance * direction)) <= min ) and 
+           ( (current - (distance * direction)) <  max ) ):
+        # Movement in the current direction violates minimum safe
+        # value, but would be safe if the direction is reversed
+        return True
+
+    else:
+        # Movement in *either* direction violates the safe working
+        # envelope, so abort.
+        raise EnvelopeError("The current movement cannot be completed within the safe working envelope of your machine.")
+
+
+class Turner:
+    # Keeps where every axis is and which way it is going from one block
+    # of moves to the next, for positions 'reverse'
+    def __init__(self, safemin, safemax):
+        self.safemin = safemin
+        self.safemax = safemax
+        self.position = [0.0, 0.0, 0.0]
+        self.direction = [1.0, 1.0, 1.0]
+
+    def moves(self, ticks, distance):
+        # The points of every move of a block, as fold_moves() gives
+        # them: None for rests, otherwise a list with the one (x, y, z)
+        # the move ends at. ticks are those of the moves, for the error.
+        points = []
+        position = self.position
+        direction = self.direction
+        for k in range(len(distance[0])):
+            d = [distance[0][k], distance[1][k], distance[2][k]]
+            if d[0] + d[1] + d[2] > 0.0:
+                for j in range(3):
+                    # Turn around BEFORE crossing the limits of the
+                    # safe working envelope
+                    try:
+                        if reached_limit(position[j], d[j], direction[j], self.safemin[j], self.safemax[j]):
+                            direction[j] = direction[j] * -1
+                    except EnvelopeError:
+                        raise EnvelopeError("The %s axis can't move %.3f either way from %.3f at tick %d, within its safe envelope [%.3f, %.3f]" % (
+                            'XYZ'[j], d[j], position[j], ticks[k], self.safemin[j], self.safemax[j]))
+                    position[j] = (position[j] + (d[j] * direction[j]))
+                points.append([tuple(position)])
+            else:
+                points.append(None)
+        return points
+
+
+def check_envelope(safemin, safemax, blocks):
+    # Raises EnvelopeError listing every move longer than the envelope,
+    # which neither positions setting can play
+    width = [safemax[j] - safemin[j] for j in range(3)]
+    too_long = []
+    for timeline, moves in blocks:
+        for j in range(3):
+            for k, d in enumerate(moves.distance[j]):
+                if d > width[j]:
+                    too_long.append("    %s axis, %.3f long at tick %d (the envelope is %.3f wide)" % (
+                        'XYZ'[j], d, timeline.tick[k], width[j]))
+    if too_long:
+        raise EnvelopeError("%d moves are longer than the safe working envelope of your machine:\n%s" % (
+            len(too_long), "\n".join(too_long[:10] + (["    ..."] if len(too_long) > 10 else []))))
+
+
+def read_lines(source):
+    # Prefix/postfix Gcode given as a filename or as an iterable of lines
+    if source is None:
+        return None
+    if isinstance(source, (str, os.PathLike)):
+        with open(source) as f:
+            return f.readlines()
+    return list(source)
+
+
+def resolve_options(machine, options=None):
+    # Returns a Namespace with every option in option_defaults, taking
+    # the given options (a dict or Namespace) first and filling in the
+    # scaling and safe envelope from the machine profile
+    if machine not in machines_dict:
+        raise ValueError("Unknown machine '%s', choose from: %s" % (machine, ', '.join(sorted(machines_dict))))
+    if options is None:
+        options = {}
+    elif isinstance(options, argparse.Namespace):
+        options = vars(options)
+    unknown = set(options) - set(option_defaults)
+    if unknown:
+        raise TypeError("Unknown conversion options: %s" % ', '.join(sorted(unknown)))
+
+    resolved = argparse.Namespace(**option_defaults)
+    for name, value in options.items():
+        if value is not None:
+            setattr(resolved, name, value)
+
+    # Get the chosen measurement scheme and the machine definition from the
+    # dictionaries in lib/machines.py
+    #
+    scheme   =    units_dict.get( resolved.units   )
+    settings = machines_dict.get( machine )
+
+    # Check defaults and scaling of inputs
+    #
+    if resolved.ppu == None:
+        # No manual setting of the axis scaling
+        # 'scheme':'units', 'abbreviation', scale_to_mm]
+        resolved.ppu    = [ 0, 0, 0 ]
+        resolved.ppu[0] = ( settings[1] * scheme[2] )
+        resolved.ppu[1] = ( settings[2] * scheme[2] )
+        resolved.ppu[2] = ( settings[3] * scheme[2] )
+
+    if resolved.safemin == None:
+        # No manual setting of the minimum safe edges
+        # 'machine':[units, xppu, yppu, zppu, xmin, ymin, zmin, xmax, ymax, zmax, axes, modal]
+        resolved.safemin    = [ 0, 0, 0 ]
+        resolved.safemin[0] = ( settings[4] / scheme[2] )
+        resolved.safemin[1] = ( settings[5] / scheme[2] )
+        resolved.safemin[2] = ( settings[6] / scheme[2] )
+
+    if resolved.safemax == None:
+        # No manual setting of the maximum safe edges
+        resolved.safemax    = [ 0, 0, 0 ]
+        resolved.safemax[0] = ( settings[7] / scheme[2] )
+        resolved.safemax[1] = ( settings[8] / scheme[2] )
+        resolved.safemax[2] = ( settings[9] / scheme[2] )
+
+    if resolved.modal == None:
+        # Only machines whose controller keeps the modal state
+        resolved.modal = settings[11]
+
+    resolved.prefix = read_lines(resolved.prefix)
+    resolved.postfix = read_lines(resolved.postfix)
+    return resolved
+
+
+def source_name(midi_source):
+    name = getattr(midi_source, 'filename', None) or getattr(midi_source, 'name', None)
+    if isinstance(midi_source, (str, os.PathLike)):
+        name = midi_source
+    return os.path.basename(name) if isinstance(name, (str, os.PathLike)) else 'MIDI data'
+
+
+def quiet(*args):
+    pass
+
+
+def sidecar_events(midi_bytes, parser='auto'):
+    # Everything a timeline sidecar holds: the merged events of all
+    # channels, parsed quietly
+    parsed = parse(midi_bytes, resolve_options('multicam_custom', {'parser': parser}), quiet, set())
+    return parsed.ticks_per_beat, len(parsed.tracks), merge_tracks(parsed.tracks)
+
+
+def convert(midi_source, machine='multicam_custom', options=None, log=None, profiler=None):
+    # Yields the Gcode lines for midi_source (see lib/parsers.py) played on
+    # the given machine, see the top of this file for the options. Pass
+    # a lib.profiler.Profiler to time each stage of the conversion.
+    if profiler is None:
+        return convert_lines(midi_source, machine, options, log, no_profiler)
+    return profiler.stage('gcode', convert_lines(midi_source, machine, options, log, profiler))
+
+
+def convert_stream(events, machine='multicam_custom', options=None, log=None, ticks_per_beat=480):
+    # Yields the Gcode lines for a live stream of events in time order
+    # (see lib/livemidi.py), each move as soon as the event that ends it
+    # comes in. Since the song isn't known ahead, the positions can only
+    # be 'reverse'.
+    options = resolve_options(machine, options)
+    if log is None:
+        log = quiet
+    if options.positions != 'reverse':
+        raise ValueError("A MIDI stream can only be played with -positions reverse")
+    options.compact = False
+    all_channels = set()
+    # Events at the same tick may arrive in any order, they are played
+    # in the order of the file conversion (note-offs before note-ons)
+    events = held_by_tick(logged_events(events, 0, all_channels, options, log))
+    yield from event_lines(events, ticks_per_beat, options.name or 'MIDI stream', options, log, no_profiler, all_channels, block_size=1, ahead=False)
+
+
+def convert_lines(midi_source, machine, options, log, profiler):
+    options = resolve_options(machine, options)
+    if log is None:
+        log = quiet
+
+    name = options.name or source_name(midi_source)
+    log("\nMIDI file:\n    %s" % name)
+
+    all_channels=set()
+    if options.sidecar and isinstance(midi_source, (str, os.PathLike)):
+        with profiler.timed('parse'):
+            timeline = load_timeline(midi_source, lambda data: sidecar_events(data, options.parser), log)
+        ticks_per_beat = timeline.ticks_per_beat
+        log("Number of tracks:\n    %d" % timeline.num_tracks)
+        log("Timing division:\n    %d" % ticks_per_beat)
+
+        for track_num, channels in enumerate(timeline.track_channels(options.channels)):
+            if len(channels) > 0:
+                msg=', ' . join(['%2d' % ch for ch in sorted(channels)])
+                log('Processed track %d, containing channels numbered: [%s ]' % (track_num, msg))
+                all_channels.update(channels)
+        events = profiler.stage('events', timeline.events(options.channels))
+    else:
+        with profiler.timed('parse'):
+            midi = parse(midi_source, options, log, all_channels)
+        ticks_per_beat = midi.ticks_per_beat
+        if options.verbose:
+            log("MIDI parser:\n    %s" % midi.parser)
+        if midi.charset is not None:
+            log("MIDI charset:\n    %s" % midi.charset)
+        log("Number of tracks:\n    %d" % len(midi.tracks))
+        log("Timing division:\n    %d" % ticks_per_beat)
+
+        tracks=[profiler.stage('events', track) for track in midi.tracks]
+
+        # We don't care which channel/voice is which, but we do care about having all the notes in order.
+        # Every track is already in time order, so merge them as they are read, instead of collecting the
+        # entire file's notes and sorting them, and feed the chords straight into the output.
+        events = profiler.stage('merge', merge_tracks(tracks))
+
+    yield from event_lines(events, ticks_per_beat, name, options, log, profiler, all_channels)
+
+
+def event_lines(events, ticks_per_beat, name, options, log, profiler, all_channels, block_size=256, ahead=True):
+    # The Gcode lines for a stream of events in time order. options must
+    # be resolved already. all_channels is the set of channels the events
+    # were taken from, for the summary at the end. The moves are worked
+    # out in blocks growing from block_size chords to the largest the
+    # engine is best at (see lib/moves.py), a block_size of 1 keeps every
+    # block to a single chord. See block_lines() for ahead.
+    feedrate_factor = rate_dict.get(options.feedrate)[2]
+
+    # Issue that next is that the length of the note isn't calculated from ON to OFF,
+    # just from last time any note went on/off happened.
+    # The first note will not work, since it's duration here will be "time since zero-time"
+    # Duration should always look ahead to the turn-off message for the note
+    # A list of "ON" notes should be kept, and track/channel should determin what axis it should
+    # be played on. If a channel/track has multiple notes, user should be able to set
+    # the "critical" notes to be played.
+    # After running trough the entire song, the axis should be evaluated for MIN and MAX feedrate
+    # since VERY low feedrates might need an octave transposing up, likewise for very high transpose down.
+    # Possible options are to input a range of feedrates that the axis "plays best", and the
+    # program can try and transpose all axis up or down by just one semitone.
+    # Any song will be "OK" if ALL axis are transposed semitonal, and still OK if just one axis is transposed
+    # a full octave.
+    voices = VoiceAllocator()
+    chord_stream = profiler.stage('voices', chords(events, axes_dict.get(options.axes), ticks_per_beat, log if options.verbose else None, voices))
+
+    # Here is where we need smart per-axis feed conversions
+    # to enable use of X/Y *and* Z on a Makerbot
+    #
+    # freq/feed/distance[0] = X; [1] = Y; [2] = Z;
+    #
+    blocks = profiler.stage('moves', compute_blocks(chord_stream, engines[options.engine], options.ppu, options.transpose, feedrate_factor,
+                                                   block_size, max_block_sizes[options.engine] if block_size > 1 else 1))
+    yield from block_lines(blocks, name, options, log, all_channels, voices, ahead)
+
+
+def block_lines(blocks, name, options, log, all_channels, voices, ahead=True):
+    # The Gcode lines for the (ChordTimeline, Moves) blocks of a song,
+    # voices is the VoiceAllocator that made the chords, for its counters.
+    # With ahead, the positions of the whole song are worked out before
+    # the first line goes out, so that a move that can't be made within
+    # the envelope is reported before anything is written. A live stream
+    # can't wait for that and stops at such a move instead.
+    scheme = units_dict.get(options.units)
+
+    if options.positions == 'fold':
+        positions = Folder(options.safemin, options.safemax)
+        engine = fold_engines[options.engine]
+        block_points = lambda timeline, moves: engine(positions, moves.distance)
+    else:
+        positions = Turner(options.safemin, options.safemax)
+        block_points = lambda timeline, moves: positions.moves(timeline.tick, moves.distance)
+
+    if ahead:
+        blocks = list(blocks)
+        check_envelope(options.safemin, options.safemax, blocks)
+        points = [block_points(timeline, moves) for timeline, moves in blocks]
+
+    # Start the output to file...
+    writer = GCodeWriter(None, options.ppu, options.precision, compact=options.compact, modal=options.modal)
+    writer.header(name, options.units, options.comments, log)
+
+    # Handle the prefix Gcode, if present
+    writer.include(options.prefix)
+    yield from writer.drain()
+
+    for b, (timeline, moves) in enumerate(blocks):
+        block = points[b] if ahead else block_points(timeline, moves)
+
+        for k in range(len(moves)):
+            freq_xyz = [moves.freq[0][k], moves.freq[1][k], moves.freq[2][k]]
+            feed_xyz = [moves.feed[0][k], moves.feed[1][k], moves.feed[2][k]]
+            distance_xyz = [moves.distance[0][k], moves.distance[1][k], moves.distance[2][k]]
+            duration = timeline.duration[k]
+
+            # Now that axes can be addressed in any order, need to make sure
+            # that all of them are silent before declaring a rest is due.
+            if distance_xyz[0] + distance_xyz[1] + distance_xyz[2] > 0.0: 
+                # At least one axis is playing, so process the note into
+                # movements
+                #
+                combined_feedrate = moves.combined_feedrate[k]
+            
+                if options.verbose:
+                    log("Chord: [%7.3f, %7.3f, %7.3f] in Hz for %5.2f seconds at timestamp %i" % (freq_xyz[0], freq_xyz[1], freq_xyz[2], duration, timeline.tick[k]))
+                    log(" Feed: [%7.3f, %7.3f, %7.3f] XYZ %s/min and %8.2f combined" % (feed_xyz[0], feed_xyz[1], feed_xyz[2], scheme[1], combined_feedrate ))
+                    log("Moves: [%7.3f, %7.3f, %7.3f] XYZ relative %s" % (distance_xyz[0], distance_xyz[1], distance_xyz[2], scheme[0] ))
+
+                # With fold, a move that hits an edge comes as several
+                # points, it is split where it bounces off
+                for x, y, z in block[k]:
+                    line = writer.move(x, y, z, combined_feedrate)
+                    if options.verbose:
+                        log(line)
+
+            else:
+                if duration > 0:
+                    # All axes are silent for the length of this chord.
+                    #
+                    # Pauses need to be handeled differently.
+                    # A solution would be to get the most quiet and most sensitive axis
+                    # and set it to the lowest feedrate possible for that machine
+                    # and let it travel a distance that results in the "pause" time being satisfied
+                    # with a very quiet movement of the most silent axis.
+
+                    # Handle 'rests' in addition to notes.
+                    # How standard is this pause gcode, anyway?
+                    line = writer.dwell(duration)
+                    if options.verbose:
+                        log("Pause for %.2f seconds" % duration)
+                        log(line)
+
+        yield from writer.drain()
+
+    # List all channels encountered
+    if len(all_channels) > 0:
+        msg=', ' . join(['%2d' % ch for ch in sorted(all_channels)])
+        log('The file as a whole contains channels numbered: [%s ]' % msg)
+
+    if voices.unvoiced > 0:
+        log("Notes left unplayed because all axes were busy:\n    %d in %d chords" % (voices.unvoiced, voices.overfull_chords))
+
+    # Handle the postfix Gcode, if present (after whatever the writer
+    # still holds back)
+    writer.include(options.postfix)
+    yield from writer.drain()
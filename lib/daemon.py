@@ -0,0 +1,312 @@
+# A long running conversion service on a Unix domain socket, so that
+# converting a song costs a conversion and not the start of a Python
+# process, its imports and the argument parsing.
+#
+#     python mid2cnc.py -serve /tmp/mid2cnc.sock -jobs 4 -queue 16
+#
+#     from lib.daemon import remote_convert, remote_request
+#     with open('song.gcode', 'w') as f:
+#         for text in remote_convert('/tmp/mid2cnc.sock', midi_bytes, 'cupcake', {'axes': 'XY'}):
+#             f.write(text)
+#     print(remote_request('/tmp/mid2cnc.sock', 'stats'))
+#
+# Both ways, everything goes in frames: a kind byte, the length of the
+# payload as 4 bytes (big endian) and the payload.
+#
+#     R  request, JSON: {"request": "convert", "machine": ..., "options": {...}}
+#        or {"request": "health"} or {"request": "stats"}
+#     M  the MIDI file of a convert request, right after its R frame
+#     G  a piece of the G-code, as it is being converted
+#     D  done, JSON with the line count and timing of the conversion, or
+#        the answer to health and stats
+#     E  error, JSON: {"error": message, "type": ...}
+#
+# The options are those of lib/converter.py, with prefix and postfix as
+# lists of lines (the daemon reads no files on anybody's behalf).
+#
+# Conversions run in a pool of worker processes, which the connection
+# is handed to, so the G-code goes straight from the worker to the
+# client. At most queue conversions wait for a free worker, beyond that
+# a request is turned down with a "busy" error right away rather than
+# left waiting. Health and stats are answered by the daemon itself,
+# however busy the workers are.
+
+import collections
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .converter import convert, resolve_options
+from .gcodewriter import GCodeWriter
+
+frame_header = struct.Struct('>cI')
+max_frame = 64 * 1024 * 1024
+request_timeout = 10.0
+
+
+class DaemonError(Exception):
+    pass
+
+
+def send_frame(sock, kind, payload):
+    sock.sendall(frame_header.pack(kind, len(payload)) + payload)
+
+
+def send_json(sock, kind, value):
+    send_frame(sock, kind, json.dumps(value).encode('utf-8'))
+
+
+def receive_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), 1048576))
+        if not chunk:
+            raise DaemonError("Connection closed in the middle of a frame")
+        data += chunk
+    return bytes(data)
+
+
+def receive_frame(sock):
+    kind, size = frame_header.unpack(receive_exactly(sock, frame_header.size))
+    if size > max_frame:
+        raise DaemonError("Frame of %d bytes is too large" % size)
+    return kind, receive_exactly(sock, size)
+
+
+class FrameWriter:
+    # A file-like object for GCodeWriter, sending what it writes as G
+    # frames
+    def __init__(self, sock):
+        self.sock = sock
+
+    def write(self, text):
+        send_frame(self.sock, b'G', text.encode('ascii'))
+
+
+def warm_up():
+    # Makes the pool start its worker processes before the first request
+    return os.getpid()
+
+
+def convert_job(sock, machine, options, midi):
+    # Runs in a worker process: converts and streams the G-code to sock
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        resolved = resolve_options(machine, options)
+        writer = GCodeWriter(FrameWriter(sock), resolved.ppu, resolved.precision)
+        writer.write_lines(convert(midi, machine, resolved))
+        writer.flush()
+        result = {
+            'lines': writer.lines,
+            'wall': time.perf_counter() - wall,
+            'cpu': time.process_time() - cpu,
+        }
+        send_json(sock, b'D', result)
+        return True
+    except Exception as e:
+        try:
+            send_json(sock, b'E', {'error': str(e) or type(e).__name__, 'type': type(e).__name__})
+        except OSError:
+            pass
+        return False
+    finally:
+        sock.close()
+
+
+def check_options(machine, options):
+    # Turns bad settings down before they take up a worker
+    if not isinstance(options, dict):
+        raise TypeError("options must be a JSON object")
+    for name in ('prefix', 'postfix'):
+        if isinstance(options.get(name), str):
+            raise TypeError("%s must be a list of lines" % name)
+    resolve_options(machine, options)
+
+
+class ConversionDaemon:
+    def __init__(self, path, workers=None, queue=16, log=None):
+        self.path = path
+        self.workers = workers or os.cpu_count() or 1
+        self.queue = queue
+        self.log = log or quiet
+        self.lock = threading.Lock()
+        self.pending = 0            # conversions running or waiting for a worker
+        self.counts = collections.Counter()
+        self.latencies = collections.deque(maxlen=1000)
+        self.started = time.time()
+        self.listener = None
+        self.pool = None
+
+    def listen(self):
+        if os.path.exists(self.path):
+            # Left over from a daemon that is gone, unless one answers
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                probe.close()
+                raise DaemonError("A daemon is already listening on %s" % self.path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(self.path)
+            finally:
+                probe.close()
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        # Only the user running the daemon may connect to it
+        os.chmod(self.path, 0o600)
+        self.listener.listen(self.workers + self.queue)
+
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        for future in [self.pool.submit(warm_up) for _ in range(self.workers)]:
+            future.result()
+        self.log("Listening on:\n    %s" % self.path)
+        self.log("Workers / queue:\n    %d / %d" % (self.workers, self.queue))
+
+    def serve_forever(self):
+        if self.listener is None:
+            self.listen()
+        try:
+            while True:
+                try:
+                    conn, _ = self.listener.accept()
+                except OSError:
+                    # The listener was closed by shutdown()
+                    return
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+    def health(self):
+        with self.lock:
+            return {
+                'status': 'ok',
+                'workers': self.workers,
+                'busy': min(self.pending, self.workers),
+                'queued': max(0, self.pending - self.workers),
+                'queue': self.queue,
+            }
+
+    def stats(self):
+        stats = self.health()
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats.update(self.counts)
+        stats['uptime'] = time.time() - self.started
+        if latencies:
+            stats['latency_p50'] = latencies[len(latencies) // 2]
+            stats['latency_p99'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        return stats
+
+    def handle(self, conn):
+        received = time.perf_counter()
+        handed_over = False
+        try:
+            conn.settimeout(request_timeout)
+            kind, payload = receive_frame(conn)
+            if kind != b'R':
+                raise DaemonError("Expected a request frame")
+            request = json.loads(payload)
+            name = request.get('request')
+            with self.lock:
+                self.counts['requests'] += 1
+
+            if name == 'health':
+                send_json(conn, b'D', self.health())
+            elif name == 'stats':
+                send_json(conn, b'D', self.stats())
+            elif name == 'convert':
+                kind, midi = receive_frame(conn)
+                if kind != b'M':
+                    raise DaemonError("Expected the MIDI file after a convert request")
+                machine = request.get('machine', 'multicam_custom')
+                options = request.get('options') or {}
+                check_options(machine, options)
+                with self.lock:
+                    busy = self.pending >= self.workers + self.queue
+                    if not busy:
+                        self.pending += 1
+                if busy:
+                    with self.lock:
+                        self.counts['rejected'] += 1
+                    send_json(conn, b'E', {'error': 'busy', 'type': 'DaemonError'})
+                    return
+                conn.settimeout(None)
+                future = self.pool.submit(convert_job, conn, machine, options, midi)
+                handed_over = True
+                future.add_done_callback(lambda future: self.finished(future, conn, received))
+            else:
+                raise DaemonError("Unknown request %r" % name)
+        except Exception as e:
+            with self.lock:
+                self.counts['errors'] += 1
+            try:
+                send_json(conn, b'E', {'error': str(e) or type(e).__name__, 'type': type(e).__name__})
+            except OSError:
+                pass
+        finally:
+            if not handed_over:
+                conn.close()
+
+    def finished(self, future, conn, received):
+        # The worker has its own copy of the connection, this one can go
+        conn.close()
+        ok = future.exception() is None and future.result()
+        with self.lock:
+            self.pending -= 1
+            self.counts['converted' if ok else 'failed'] += 1
+            self.latencies.append(time.perf_counter() - received)
+
+
+def connect(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    return sock
+
+
+def remote_convert(path, midi, machine='multicam_custom', options=None, result=None):
+    # Yields the G-code text from the daemon at path as it comes in.
+    # midi is the bytes of the MIDI file. The D frame of the daemon is
+    # put into result (a dict), if given.
+    with connect(path) as sock:
+        send_json(sock, b'R', {'request': 'convert', 'machine': machine, 'options': options or {}})
+        send_frame(sock, b'M', midi)
+        while True:
+            kind, payload = receive_frame(sock)
+            if kind == b'G':
+                yield payload.decode('ascii')
+            elif kind == b'D':
+                if result is not None:
+                    result.update(json.loads(payload))
+                return
+            elif kind == b'E':
+                raise DaemonError(json.loads(payload)['error'])
+            else:
+                raise DaemonError("Unexpected frame %r" % kind)
+
+
+def remote_request(path, name):
+    # The answer of the daemon at path to a health or stats request
+    with connect(path) as sock:
+        send_json(sock, b'R', {'request': name})
+        kind, payload = receive_frame(sock)
+        if kind == b'E':
+            raise DaemonError(json.loads(payload)['error'])
+        return json.loads(payload)
+
+
+def quiet(*args):
+    pass
@@ -0,0 +1,128 @@
+# Positions of the axes inside the safe envelope, worked out from the
+# total distance each axis has travelled.
+#
+# An axis that bounces back and forth between safemin and safemax is at
+# a position that only depends on how far it has travelled so far: fold
+# the travelled distance into the envelope like a triangle wave with a
+# period of twice the envelope width. The travel is just the running
+# sum of the move distances, so the position of every move follows
+# directly from a prefix sum, and any block of moves can be worked out
+# knowing nothing but the travel at its start.
+#
+# A move that hits a wall is split there into two (or more) moves at
+# the same feed rate, so its total length, and with it the length and
+# pitch of the note, stays the same. A move longer than the envelope
+# would have to bounce more than once within a single note, those are
+# reported by check_envelope() in lib/converter.py before anything is
+# written.
+
+import math
+
+
+class EnvelopeError(Exception):
+    pass
+
+
+def fold(travel, width):
+    # Offset from the lower edge after travelling this far from it,
+    # starting upwards, bouncing off both edges
+    if width <= 0:
+        return 0.0
+    offset = math.fmod(travel, 2*width)
+    return offset if offset <= width else 2*width - offset
+
+
+def bounces(start, distance, width):
+    # Where within a move (as a fraction of it) the axis hits a wall
+    if distance <= 0.0 or width <= 0:
+        return []
+    fractions = []
+    wall = (math.floor(start / width) + 1) * width
+    while wall < start + distance:
+        fractions.append((wall - start) / distance)
+        wall += width
+    return fractions
+
+
+class Folder:
+    # Keeps the distance each axis has travelled, from one block of
+    # moves to the next. The axes start at the origin, moving upwards.
+    def __init__(self, safemin, safemax, start=(0.0, 0.0, 0.0)):
+        self.low = list(safemin)
+        self.width = [safemax[j] - safemin[j] for j in range(3)]
+        for j in range(3):
+            if not safemin[j] <= start[j] <= safemax[j]:
+                raise EnvelopeError("The %s axis starts at %g, outside its safe envelope [%g, %g]" % (
+                    'XYZ'[j], start[j], safemin[j], safemax[j]))
+        self.travel = [start[j] - safemin[j] for j in range(3)]
+
+    def position(self, travel):
+        return tuple(self.low[j] + fold(travel[j], self.width[j]) for j in range(3))
+
+    def split(self, start, distance):
+        # The points a move from start travel goes through, ending with
+        # where it stops
+        fractions = sorted(t for j in range(3) for t in bounces(start[j], distance[j], self.width[j]))
+        points = [self.position([start[j] + t * distance[j] for j in range(3)]) for t in fractions]
+        points.append(self.position([start[j] + distance[j] for j in range(3)]))
+        return points
+
+
+def fold_moves(folder, distance):
+    # The points of every move of a block (None for rests, where nothing
+    # moves), as a list with one list of (x, y, z) per move
+    points = []
+    for k in range(len(distance[0])):
+        d = [distance[0][k], distance[1][k], distance[2][k]]
+        start = folder.travel
+        folder.travel = [start[j] + d[j] for j in range(3)]
+        if d[0] + d[1] + d[2] > 0.0:
+            points.append(folder.split(start, d))
+        else:
+            points.append(None)
+    return points
+
+
+def fold_moves_numpy(folder, distance):
+    # Same as fold_moves(), with the prefix sums and the folding of the
+    # move ends done for the whole block at once. Only moves that hit a
+    # wall go through Folder.split(). cumsum adds in the same order as
+    # fold_moves() does and fmod is exact, so the numbers are the same.
+    import numpy as np
+
+    travel = []
+    ends = []
+    hits = np.zeros(len(distance[0]), dtype=bool)
+    for j in range(3):
+        d = np.asarray(distance[j], dtype=np.float64)
+        end = np.cumsum(np.concatenate(([folder.travel[j]], d)))
+        start, end = end[:-1], end[1:]
+        width = folder.width[j]
+        if width > 0:
+            offset = np.fmod(end, 2*width)
+            offset = np.where(offset <= width, offset, 2*width - offset)
+            hits |= (d > 0.0) & ((np.floor(start / width) + 1) * width < end)
+        else:
+            offset = np.zeros(len(end))
+        travel.append(start)
+        ends.append((folder.low[j] + offset).tolist())
+        folder_end = end[-1] if len(end) else folder.travel[j]
+        folder.travel[j] = float(folder_end)
+
+    moving = (np.asarray(distance[0]) + np.asarray(distance[1]) + np.asarray(distance[2])) > 0.0
+    points = []
+    for k, (x, y, z) in enumerate(zip(*ends)):
+        if not moving[k]:
+            points.append(None)
+        elif hits[k]:
+            start = [float(travel[j][k]) for j in range(3)]
+            points.append(folder.split(start, [distance[0][k], distance[1][k], distance[2][k]]))
+        else:
+            points.append([(x, y, z)])
+    return points
+
+
+fold_engines = {
+    'python': fold_moves,
+    'numpy': fold_moves_numpy,
+}
@@ -0,0 +1,104 @@
+# Reads G-code back the way a controller does, keeping track of the
+# modal state (motion mode, position, feed rate and absolute or
+# incremental positioning), so that every line can be turned into what
+# the machine does with it: a move of some length and duration, a dwell,
+# or nothing that takes time.
+#
+# Only what mid2cnc.py and the usual prefix/postfix files use is
+# understood: G0, G1, G4, G90, G91 and G92. Everything else is accepted
+# and ignored, G20 and G21 included, since positions and feed rates are
+# always in the same units and the durations come out the same.
+#
+# feedrate_factor is the one from lib/machines.py rate_dict that the
+# F words were written with: 60 when F is in units per minute, as most
+# controllers (and GRBL) take it, 1 when it is in units per second.
+# dwell_factor is the number of seconds in a unit of the P word of G4:
+# 1 for GRBL and LinuxCNC, 0.001 for controllers that take milliseconds
+# (Marlin), and what mid2cnc.py writes is always in seconds.
+
+import math
+import re
+
+word_pattern = re.compile(r'([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+comment_pattern = re.compile(r'\([^)]*\)|;.*')
+
+
+def strip_comment(line):
+    # The line without comments and surrounding white space
+    return comment_pattern.sub('', line).strip()
+
+
+def words(line):
+    # [(letter, value), ...] of a line, comments left out
+    return [(letter, float(value)) for letter, value in word_pattern.findall(strip_comment(line).upper())]
+
+
+class ModalState:
+    def __init__(self, feedrate_factor=60.0, rapid_rate=2000.0, dwell_factor=1.0):
+        self.feedrate_factor = feedrate_factor
+        self.dwell_factor = dwell_factor
+        self.rapid_rate = rapid_rate    # feed rate of G0 moves, in the same units as F
+        self.motion = None
+        self.position = [0.0, 0.0, 0.0]
+        self.feed = None
+        self.incremental = False
+
+    def peek(self, line):
+        # What execute() would return, leaving the state as it is
+        saved = (self.motion, list(self.position), self.feed, self.incremental)
+        try:
+            return self.execute(line)
+        finally:
+            self.motion, self.position, self.feed, self.incremental = saved
+
+    def execute(self, line):
+        # Applies a line to the state. Returns ('move', distance,
+        # seconds), ('dwell', seconds) or None.
+        motion = None
+        dwell = False
+        set_origin = False
+        target = {}
+        p = None
+        for letter, value in words(line):
+            if letter == 'G':
+                code = int(value) if value == int(value) else value
+                if code in (0, 1):
+                    motion = code
+                elif code == 4:
+                    dwell = True
+                elif code == 90:
+                    self.incremental = False
+                elif code == 91:
+                    self.incremental = True
+                elif code == 92:
+                    set_origin = True
+            elif letter in 'XYZ':
+                target['XYZ'.index(letter)] = value
+            elif letter == 'F':
+                self.feed = value
+            elif letter == 'P':
+                p = value
+
+        if dwell:
+            return ('dwell', (p or 0.0) * self.dwell_factor)
+        if set_origin:
+            # The current position gets the given coordinates, nothing moves
+            for j, value in target.items():
+                self.position[j] = value
+            return None
+        if motion is not None:
+            self.motion = motion
+        if not target or self.motion is None:
+            return None
+
+        end = list(self.position)
+        for j, value in target.items():
+            end[j] = end[j] + value if self.incremental else value
+        distance = math.sqrt(sum((end[j] - self.position[j])**2 for j in range(3)))
+        self.position = end
+        rate = self.rapid_rate if self.motion == 0 else self.feed
+        if distance == 0.0:
+            return ('move', 0.0, 0.0)
+        if not rate:
+            raise ValueError("Move without a feed rate: %s" % line.strip())
+        return ('move', distance, distance / rate * self.feedrate_factor)
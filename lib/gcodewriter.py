@@ -0,0 +1,217 @@
+# Formats and buffers the G-code output.
+#
+# Lines are collected in memory and handed to the output file in large
+# blocks, so a long song costs a handful of write calls rather than
+# one per line. Coordinates are written with only as many decimals as
+# the machine can resolve: one step on an axis is 1/ppu units, so
+# ceil(log10(ppu)) decimals are enough to address every step. The feed
+# rate gets one decimal more than the finest axis, which keeps its
+# relative error (and so the pitch error) well below a cent.
+#
+# With compact set, the moves and rests are held back one at a time so
+# that they can be tidied up before they are written: moves that end up
+# where the last one did (at the precision written) are dropped, and so
+# are rests that round to zero; back to back rests become one rest, and
+# a move that carries on in the same direction at the same feed rate as
+# the one before is merged into it. The machine travels the same path at
+# the same speeds either way, so it sounds the same, but the program is
+# smaller and the controller has fewer moves to plan.
+#
+# With modal set, the moves lean on the modal state of the controller:
+# G01 is only written when the motion mode isn't G01 already, and the
+# X, Y, Z and F words only when they differ from the ones last written.
+# Not every controller keeps that state (Marlin wants a G word on every
+# line), so the machine profiles say whether to use it by default.
+
+import math
+
+
+def axis_decimals(ppu):
+    return max(1, int(math.ceil(math.log10(ppu)))) if ppu > 0 else 10
+
+
+def same_direction(start, middle, end):
+    # Whether going from start to middle and on to end is one straight
+    # line, without turning back
+    a = [middle[j] - start[j] for j in range(3)]
+    b = [end[j] - middle[j] for j in range(3)]
+    dot = a[0]*b[0] + a[1]*b[1] + a[2]*b[2]
+    if dot <= 0.0:
+        return False
+    cross = (a[1]*b[2] - a[2]*b[1], a[2]*b[0] - a[0]*b[2], a[0]*b[1] - a[1]*b[0])
+    cross = cross[0]**2 + cross[1]**2 + cross[2]**2
+    # Parallel to within rounding errors
+    return cross <= 1e-18 * (a[0]**2 + a[1]**2 + a[2]**2) * (b[0]**2 + b[1]**2 + b[2]**2)
+
+
+class GCodeWriter:
+    def __init__(self, outfile, ppu, decimals=None, buffer_size=65536, compact=False, modal=False):
+        # decimals overrides the precision derived from ppu for all axes.
+        # With outfile None nothing is written, the lines are collected
+        # until taken with drain(). A compact writer needs settle() at the
+        # end, to write the move or rest it is still holding back.
+        self.outfile = outfile
+        self.buffer = []
+        self.buffered = 0
+        self.buffer_size = buffer_size
+        self.lines = 0
+
+        self.compact = compact
+        self.pending = None         # ('move', start, end, feed) or ('dwell', seconds)
+        self.position = (0.0, 0.0, 0.0)
+
+        self.modal = modal
+        self.forget_modal()
+
+        if decimals is None:
+            self.decimals = [axis_decimals(p) for p in ppu]
+            self.feed_decimals = max(self.decimals) + 1
+        else:
+            self.decimals = [decimals, decimals, decimals]
+            self.feed_decimals = decimals
+        self.move_format = "G01 X%%.%df Y%%.%df Z%%.%df F%%.%df\n" % (
+            self.decimals[0], self.decimals[1], self.decimals[2], self.feed_decimals)
+        self.word_formats = ["X%%.%df" % self.decimals[0], "Y%%.%df" % self.decimals[1],
+                             "Z%%.%df" % self.decimals[2], "F%%.%df" % self.feed_decimals]
+
+    def write(self, line):
+        self.buffer.append(line)
+        self.buffered += len(line)
+        self.lines += 1
+        if self.buffered >= self.buffer_size and self.outfile is not None:
+            self.flush()
+
+    def write_lines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def header(self, input_name, units, comments=True, log=print):
+        # It would be nice to add some metadata here, such as who/what generated the output, what the input file was,
+        # and important playback parameters (such as steps/in assumed and machine envelope).
+        # Unfortunately G-code comments are not 100% standardized...
+        if comments:
+            self.write("( Input file was " + input_name + " )\n")
+
+        # Code for everyone
+        if units == 'imperial':
+            self.write("G20 (Imperial Hegemony Forevah!)\n")
+        elif units == 'metric':
+            self.write("G21 (Metric FTW)\n")
+        else:
+            log("\nWARNING: Gcode metric/imperial setting undefined!\n")
+
+        self.write("G90 (Absolute posiitioning)\n")
+        self.write("G92 X0 Y0 Z0 (set origin to current position)\n")
+        self.write("G94 (set feed to mm/min)\n")
+        self.write("G0 X0 Y0 Z0 F2000.0 (Pointless move to origin to reset feed rate to a sane value)\n")
+        self.forget_modal()
+
+    def include(self, lines):
+        # Copy a prefix/postfix Gcode file (or any iterable of lines)
+        self.settle()
+        if lines is None:
+            return
+        # Nothing is known about where the included code leaves the
+        # machine, so don't compare the next move with the last one
+        self.position = None
+        self.forget_modal()
+        for line in lines:
+            if not line.endswith("\n"):
+                line += "\n"
+            self.write(line)
+
+    def move(self, x, y, z, feed):
+        line = self.move_format % (x, y, z, feed)
+        if not self.compact:
+            self.write_move(line, x, y, z, feed)
+            return line
+
+        end = (x, y, z)
+        start = self.position
+        self.position = end
+        if start is not None and self.same_point(start, end):
+            return line
+        pending = self.pending
+        if pending is not None and pending[0] == 'move' and pending[1] is not None and \
+                self.same_feed(pending[3], feed) and same_direction(pending[1], pending[2], end):
+            self.pending = ('move', pending[1], end, pending[3])
+            return line
+        self.settle()
+        self.pending = ('move', start, end, feed)
+        return line
+
+    def forget_modal(self):
+        # After code the writer didn't write itself, the motion mode and
+        # the words in effect are unknown
+        self.motion = None
+        self.words = [None, None, None, None]
+
+    def write_move(self, line, x, y, z, feed):
+        # Writes a G01 move, line if already formatted. A modal move only
+        # gets the words that changed, and nothing at all if no axis moves.
+        if not self.modal:
+            self.write(line or self.move_format % (x, y, z, feed))
+            return
+        words = self.words
+        formats = self.word_formats
+        line = [] if self.motion == 'G01' else ['G01']
+        moves = False
+        for j, value in enumerate((x, y, z, feed)):
+            word = formats[j] % value
+            if word != words[j]:
+                if j < 3:
+                    moves = True
+                elif not moves:
+                    # A feed rate change on its own goes nowhere
+                    return
+                words[j] = word
+                line.append(word)
+        if not moves:
+            return
+        self.motion = 'G01'
+        self.write(" ".join(line) + "\n")
+
+    def dwell(self, seconds):
+        line = "G04 P%0.4f\n" % seconds
+        if not self.compact:
+            self.write(line)
+            return line
+
+        if self.pending is not None and self.pending[0] == 'dwell':
+            self.pending = ('dwell', self.pending[1] + seconds)
+            return line
+        self.settle()
+        self.pending = ('dwell', seconds)
+        return line
+
+    def same_point(self, a, b):
+        # Whether a and b are written as the same coordinates
+        return all(round(a[j], self.decimals[j]) == round(b[j], self.decimals[j]) for j in range(3))
+
+    def same_feed(self, a, b):
+        return round(a, self.feed_decimals) == round(b, self.feed_decimals)
+
+    def settle(self):
+        # Writes the move or rest held back by a compact writer
+        pending = self.pending
+        self.pending = None
+        if pending is None:
+            return
+        if pending[0] == 'move':
+            x, y, z = pending[2]
+            self.write_move(None, x, y, z, pending[3])
+        elif round(pending[1], 4) > 0:
+            self.write("G04 P%0.4f\n" % pending[1])
+
+    def drain(self):
+        # Takes the collected lines out of the buffer
+        lines = self.buffer
+        self.buffer = []
+        self.buffered = 0
+        return lines
+
+    def flush(self):
+        if self.buffer:
+            self.outfile.write("".join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
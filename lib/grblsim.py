@@ -0,0 +1,208 @@
+# A GRBL-like controller on a pseudo-terminal, to stream to without a
+# machine.
+#
+#     with GrblSimulator() as controller:
+#         stream_to(controller.port, lines)
+#         print(controller.stats())
+#
+# It behaves the way GRBL does as far as streaming goes: incoming
+# characters go into a receive buffer of rx_buffer bytes (a ring
+# buffer, so it holds one character less than that), a line is
+# answered with "ok" once it has left that buffer, and a motion line
+# can only leave it when there is room in the planner, which holds
+# planner_blocks moves. The moves are then "run" in real time (divided
+# by speed, to benchmark faster than the song plays), using their
+# lengths and feed rates (lib/gcodereader.py). A dwell waits for the
+# planner to run empty, and is answered once it is over. A pty answers
+# within microseconds, latency holds every answer back for that many
+# seconds, to see what the round trip over a USB serial link does.
+#
+# The simulator counts what a real controller would suffer from:
+# characters received beyond a full receive buffer (which GRBL would
+# lose) and the times the planner ran empty while the song still went
+# on, with how long it stood still for. A move that is not queued in
+# time is a gap in the music.
+
+import os
+import select
+import threading
+import time
+import tty
+
+from .gcodereader import ModalState, strip_comment
+
+greeting = b"\r\nGrbl 1.1h ['$' for help]\r\n"
+
+
+class GrblSimulator:
+    def __init__(self, rx_buffer=128, planner_blocks=16, speed=1.0, feedrate_factor=60.0, latency=0.0):
+        self.rx_buffer = rx_buffer
+        self.planner_blocks = planner_blocks
+        self.speed = speed
+        self.latency = latency
+        self.replies = []           # (when, text) of the answers on their way
+        self.state = ModalState(feedrate_factor)
+
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+        self.rx = bytearray()
+        self.planner = []           # durations of the queued moves, the first one running
+        self.block_end = None       # when the running move is over
+        self.dwell_end = None       # when the dwell being waited on is over
+        self.idle_since = None      # when the planner last ran empty, None before the first move
+
+        self.received = 0
+        self.lines = 0
+        self.moves = 0
+        self.dwells = 0
+        self.overflows = 0
+        self.starved = 0
+        self.starved_time = 0.0
+        self.motion_time = 0.0
+
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        # The greeting waits in the pty until the sender opens the port
+        os.write(self.master, greeting)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self):
+        return {
+            'lines': self.lines,
+            'bytes': self.received,
+            'moves': self.moves,
+            'dwells': self.dwells,
+            'overflows': self.overflows,
+            'starved': self.starved,
+            'starved_time': self.starved_time,
+            'motion_time': self.motion_time,
+        }
+
+    def reply(self, text):
+        if self.latency > 0.0:
+            self.replies.append((time.monotonic() + self.latency, text))
+        else:
+            os.write(self.master, text)
+
+    def deliver(self, now):
+        # Sends the delayed answers that are due
+        while self.replies and self.replies[0][0] <= now:
+            os.write(self.master, self.replies.pop(0)[1])
+
+    def run(self):
+        while not self.stopping.is_set():
+            now = time.monotonic()
+            self.advance(now)
+            self.process(now)
+            self.deliver(now)
+
+            timeout = 0.05
+            if self.replies:
+                timeout = min(timeout, max(0.0, self.replies[0][0] - now))
+            if self.planner:
+                timeout = min(timeout, max(0.0, self.block_end - now))
+            if self.dwell_end is not None:
+                timeout = min(timeout, max(0.0, self.dwell_end - now))
+            readable, _, _ = select.select([self.master], [], [], timeout)
+            if readable:
+                try:
+                    data = os.read(self.master, 4096)
+                except OSError:
+                    # Nobody has the port open right now
+                    time.sleep(timeout)
+                    continue
+                self.received += len(data)
+                room = self.rx_buffer - 1 - len(self.rx)
+                if len(data) > room:
+                    # A real controller drops what doesn't fit
+                    self.overflows += len(data) - room
+                    data = data[:max(0, room)]
+                self.rx += data
+
+    def advance(self, now):
+        # Runs the planner up to now
+        while self.planner and self.block_end <= now:
+            self.planner.pop(0)
+            if self.planner:
+                self.block_end += self.planner[0]
+            else:
+                self.idle_since = self.block_end
+        if self.dwell_end is not None and self.dwell_end <= now:
+            self.idle_since = self.dwell_end
+            self.dwell_end = None
+            self.reply(b"ok\r\n")
+
+    def process(self, now):
+        # Takes the complete lines out of the receive buffer for as long
+        # as the planner can take them
+        while self.dwell_end is None:
+            end = self.rx.find(b"\n")
+            if end < 0:
+                return
+            line = self.rx[:end].decode('ascii', 'replace').strip()
+            text = strip_comment(line)
+            if text.startswith('$') or text.startswith('?'):
+                # Settings and status reports don't concern streaming
+                del self.rx[:end + 1]
+                self.reply(b"ok\r\n")
+                continue
+
+            try:
+                action = self.state.peek(text) if text else None
+            except ValueError:
+                # GRBL's "undefined feed rate"
+                del self.rx[:end + 1]
+                self.lines += 1
+                self.reply(b"error:22\r\n")
+                continue
+            if action is not None and action[0] == 'move' and action[2] > 0.0 and \
+                    len(self.planner) >= self.planner_blocks:
+                return
+            if action is not None and action[0] == 'dwell' and self.planner:
+                return
+
+            del self.rx[:end + 1]
+            self.lines += 1
+            action = self.state.execute(text) if text else None
+            if action is None or action[0] == 'move' and action[2] <= 0.0:
+                self.reply(b"ok\r\n")
+            elif action[0] == 'move':
+                self.queue(now, action[2] / self.speed)
+                self.reply(b"ok\r\n")
+            else:
+                self.dwells += 1
+                self.dwell_end = now + action[1] / self.speed
+
+    def queue(self, now, duration):
+        self.moves += 1
+        self.motion_time += duration * self.speed
+        if not self.planner:
+            if self.idle_since is not None and now > self.idle_since:
+                self.starved += 1
+                self.starved_time += (now - self.idle_since) * self.speed
+            self.block_end = now + duration
+        self.planner.append(duration)
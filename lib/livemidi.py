@@ -0,0 +1,130 @@
+# Reads MIDI events as they come in on a pipe, e.g. from a sequencer.
+#
+# The stream is made of the same events as a track of a Standard MIDI
+# File, without the file and chunk headers around them: a delta time in
+# ticks (a variable length number), then a channel message (running
+# status allowed), a meta event (tempo changes are used, end of track
+# ends the stream) or a system exclusive message. Recording one is
+# simply keeping the bytes, and the body of the track of a format 0 file
+# plays back the same way:
+#
+#     python mid2cnc.py -stream < song.track
+#     mkfifo /tmp/midi; python mid2cnc.py -stream /tmp/midi -port /dev/ttyACM0
+#
+# The bytes are taken from the file descriptor as soon as the pipe has
+# any, never waiting for a buffer to fill up, and every event comes out
+# as soon as its last byte is in. arrival is the time the bytes of the
+# last event came in, so whoever makes something of that event can tell
+# how long it took.
+
+import os
+import time
+
+from .midiparser import voice, meta
+from .stream import TEMPO, NOTE_OFF, NOTE_ON
+
+
+class LiveMidiError(Exception):
+    pass
+
+
+# Number of data bytes of each kind of channel message
+data_sizes = {
+    voice.NoteOff: 2,
+    voice.NoteOn: 2,
+    voice.PolyphonicKeyPressure: 2,
+    voice.ControllerChange: 2,
+    voice.ProgramChange: 1,
+    voice.ChannelPressure: 1,
+    voice.PitchBend: 2,
+}
+
+
+class LiveMidiReader:
+    def __init__(self, fd, channels=None, read_size=4096):
+        # fd is a file descriptor (or anything with fileno()), channels
+        # the set of channels to keep the notes of (all if None)
+        self.source = fd
+        self.fd = fd if isinstance(fd, int) else fd.fileno()
+        self.channels = channels
+        self.read_size = read_size
+        self.data = b''
+        self.offset = 0
+        self.arrival = None
+        self.events = 0
+        self.bytes = 0
+
+    def byte(self):
+        # The next byte, waiting for the pipe if it has none yet
+        if self.offset == len(self.data):
+            self.data = os.read(self.fd, self.read_size)
+            self.offset = 0
+            if not self.data:
+                raise EOFError
+            self.arrival = time.perf_counter()
+            self.bytes += len(self.data)
+        value = self.data[self.offset]
+        self.offset += 1
+        return value
+
+    def variable_length(self):
+        value = 0
+        while True:
+            byte = self.byte()
+            value = (value << 7) | (byte & 0x7F)
+            if not byte & 0x80:
+                return value
+
+    def __iter__(self):
+        # (tick, kind, value, velocity, channel, track) like the tracks of
+        # lib/parsers.py, track is always 0
+        tick = 0
+        status = None
+        channels = self.channels
+        while True:
+            try:
+                tick += self.variable_length()
+                first = self.byte()
+            except EOFError:
+                return
+
+            try:
+                if first == meta.FileMetaEvent:
+                    kind = self.byte()
+                    data = bytes(self.byte() for _ in range(self.variable_length()))
+                    if kind == meta.EndTrack:
+                        return
+                    if kind == meta.SetTempo and len(data) == 3:
+                        self.events += 1
+                        yield tick, TEMPO, int.from_bytes(data, byteorder='big'), 0, 0, 0
+                    continue
+                if first in (meta.SystemExclusive, meta.SystemExclusivePacket):
+                    for _ in range(self.variable_length()):
+                        self.byte()
+                    status = None
+                    continue
+                if first > meta.SystemExclusive:
+                    # Real time and system common messages don't belong
+                    # in a track, and carry nothing to play
+                    continue
+
+                if first & 0x80:
+                    status = first
+                    data = [self.byte() for _ in range(data_sizes.get(status & 0xF0, 0))]
+                elif status is None:
+                    raise LiveMidiError("Data byte 0x%02X without a status byte" % first)
+                else:
+                    # Running status, the first byte is data already
+                    data = [first] + [self.byte() for _ in range(data_sizes[status & 0xF0] - 1)]
+            except EOFError:
+                raise LiveMidiError("The stream ended in the middle of an event")
+
+            message = status & 0xF0
+            if message not in (voice.NoteOn, voice.NoteOff):
+                continue
+            channel = status & 0x0F
+            if channels is not None and channel not in channels:
+                continue
+            self.events += 1
+            kind = NOTE_ON if message == voice.NoteOn and data[1] > 0 else NOTE_OFF
+            yield tick, kind, data[0], data[1], channel, 0
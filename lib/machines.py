@@ -0,0 +1,94 @@
+# Machine, unit and axis definitions shared by the converter and the
+# command line.
+
+# Specifications for some machines (Need verification!)
+#
+machines_dict = dict( {
+        'cupcake':[
+            'metric',                # Units scheme
+            11.767, 11.767, 320.000, # Pulses per unit for X, Y, Z axes
+            -20.000, -20.000, 0.000, # Safe envelope minimum for X, Y, Z
+            20.000, 20.000, 10.000,  # Safe envelope maximum for X, Y, Z
+            'XYZ',                   # Default axes and the order for playing
+            False                    # Modal Gcode by default (see -modal), if the controller keeps it
+        ],      
+
+        'thingomatic':[
+            'metric',
+            47.069852, 47.069852, 200.0,
+            -20.000, -20.000, 0.000,
+            20.000, 20.000, 10.000,
+            'XYZ',
+            False
+        ],
+
+        'shapercube':[
+            'metric',
+            10.0, 10.0, 320.0,
+            0.000, 0.000, 0.000,
+            10.000, 10.000, 10.000,
+            'XYZ',
+            False
+        ],
+
+        'ultimaker':[
+            'metric',
+            47.069852, 47.069852, 160.0,
+            0.000, 0.000, 0.000,
+            10.000, 10.000, 10.000,
+            'XYZ',
+            False
+        ],
+
+        'multicam_custom':[
+            'metric',
+            228.0, 228.0, 393.700775,
+            0.000, 0.000, 0.000,
+            120.000, 120.000, 20.000,
+            'ZYX',
+            False
+        ],
+
+        'custom':[
+            'metric',
+            10.0, 10.0, 10.0,
+            0.000, 0.000, 0.000,
+            10.000, 10.000, 10.000,
+            'X',
+            False
+        ]
+    })
+
+# Specifications for the systems of units we know about
+#
+units_dict = dict( {
+        # 'scheme':'units', 'abbreviation', scale_to_mm]
+        'metric':[
+            'millimetre', 'mm', 1.0
+        ],
+        'imperial':[
+            'inch', 'in', 25.4
+        ]
+    })
+# Specifications for the systems of units we know about
+#
+rate_dict = dict( {
+        # 'scheme':'units', 'abbreviation', feed_rate_factor]
+        'minutes':[
+            'minute', 'm', 60.0
+        ],
+        'seconds':[
+            'second', 's', 1.0
+        ]
+    })
+
+# A way to specify any mix of axes in the order you want to voice them
+#
+axes_dict = dict( {
+          'X':[0],       'Y':[1],       'Z':[2],
+         'XY':[0,1],    'YX':[1,0],    'XZ':[0,2],
+         'ZX':[2,0],    'YZ':[1,2],    'ZY':[2,1],
+        'XYZ':[0,1,2], 'XZY':[0,2,1],
+        'YXZ':[1,0,2], 'YZX':[1,2,0],
+        'ZXY':[2,0,1], 'ZYX':[2,1,0]
+    })
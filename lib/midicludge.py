@@ -1,6 +1,6 @@
 import midi
 from collections import namedtuple
-from constants import *
+from .constants import *
 
 NoteDetails = namedtuple('NoteDetails',['note_no','velocity'])
 TempoDetails = namedtuple('TempoDetails',['tempo'])
@@ -20,7 +20,6 @@ class Event:
     if isinstance(self.event,midi.NoteEvent):
       self.detail = NoteDetails(note_no=self.event.get_pitch(),velocity=self.event.get_velocity())
     elif isinstance(self.event,midi.SetTempoEvent):
-      print("??????",self.type, meta.SetTempo)
       self.detail = TempoDetails(tempo=self.event.get_mpqn())
     elif isinstance(self.event,midi.MetaEventWithText):
       self.detail = MetaDetails(text=self.event.text)
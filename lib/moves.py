@@ -0,0 +1,143 @@
+# Turns the chords of a song into per-axis frequencies, feed rates and
+# travel distances.
+#
+# The chords are collected into a ChordTimeline, then converted a block
+# at a time, either by the plain Python engine or, when NumPy is
+# installed, by the NumPy engine which works on whole columns at once.
+# Both give the same numbers: note frequencies come from the same
+# lookup table (NumPy's own power function can be one ulp off libm's),
+# and everything after that uses the same IEEE operations in the same
+# order, so the results are bit-for-bit identical.
+
+from array import array
+import math
+
+
+class ChordTimeline:
+    # One row per chord change: the tick at which the chord ends (when
+    # the next note event happens), its duration in seconds and the
+    # note sounding on each of the X, Y and Z axes (-1 if silent).
+    def __init__(self):
+        self.tick = array('I')
+        self.duration = array('d')
+        self.notes = (array('i'), array('i'), array('i'))
+
+    def __len__(self):
+        return len(self.tick)
+
+    def append(self, tick, duration, notes_xyz):
+        self.tick.append(tick)
+        self.duration.append(duration)
+        for j in range(3):
+            self.notes[j].append(notes_xyz[j])
+
+
+class Moves:
+    # Result of an engine: freq, feed and distance are per-axis columns
+    # [X, Y, Z] of plain Python floats, combined_feedrate is one column.
+    def __init__(self, freq, feed, distance, combined_feedrate):
+        self.freq = freq
+        self.feed = feed
+        self.distance = distance
+        self.combined_feedrate = combined_feedrate
+
+    def __len__(self):
+        return len(self.combined_feedrate)
+
+
+def note_frequency(note, transpose):
+    # MIDI note 69     = A4(440Hz)
+    # 2 to the power (69-69) / 12 * 440 = A4 440Hz
+    # 2 to the power (64-69) / 12 * 440 = E4 329.627Hz
+    #
+    return pow(2.0, (note-69 + int(transpose))/12.0)*440.0
+
+
+def frequency_table(transpose):
+    # Frequency of every MIDI note number on an axis with this transpose
+    return [note_frequency(note, transpose) for note in range(128)]
+
+
+def compute_moves(timeline, ppu, transpose, feedrate_factor):
+    n = len(timeline)
+    freq = ([0.0]*n, [0.0]*n, [0.0]*n)
+    feed = ([0.0]*n, [0.0]*n, [0.0]*n)
+    distance = ([0.0]*n, [0.0]*n, [0.0]*n)
+    combined_feedrate = [0.0]*n
+
+    for j in range(3):
+        table = frequency_table(transpose[j])
+        for k, note in enumerate(timeline.notes[j]):
+            if note < 0:
+                continue
+            freq[j][k] = table[note]
+            # Feed rate is expressed in feedrate_factor times
+            # scaling factor is required.
+            feed[j][k] = ( freq[j][k] * feedrate_factor ) / ppu[j]
+            # Get the actual relative distance travelled per axis in mm
+            distance[j][k] = ( feed[j][k] * timeline.duration[k] ) / feedrate_factor
+
+    for k in range(n):
+        combined_feedrate[k] = math.sqrt(feed[0][k]**2 + feed[1][k]**2 + feed[2][k]**2)
+
+    return Moves(freq, feed, distance, combined_feedrate)
+
+
+def compute_moves_numpy(timeline, ppu, transpose, feedrate_factor):
+    import numpy as np
+
+    duration = np.frombuffer(timeline.duration, dtype=np.float64)
+    freq = []
+    feed = []
+    distance = []
+    for j in range(3):
+        notes = np.frombuffer(timeline.notes[j], dtype=np.intc)
+        # Silent axes (-1) pick up the 0.0 appended to the table
+        table = np.array(frequency_table(transpose[j]) + [0.0])
+        freq_j = table[notes]
+        feed_j = ( freq_j * feedrate_factor ) / ppu[j]
+        distance_j = ( feed_j * duration ) / feedrate_factor
+        freq.append(freq_j)
+        feed.append(feed_j)
+        distance.append(distance_j)
+
+    combined_feedrate = np.sqrt(feed[0]**2 + feed[1]**2 + feed[2]**2)
+
+    return Moves(
+        tuple(column.tolist() for column in freq),
+        tuple(column.tolist() for column in feed),
+        tuple(column.tolist() for column in distance),
+        combined_feedrate.tolist())
+
+
+engines = {
+    'python': compute_moves,
+    'numpy': compute_moves_numpy,
+}
+
+# Largest block of chords each engine is given at once. NumPy only pays
+# off on long columns, the Python engine gains nothing from them.
+max_block_sizes = {
+    'python': 256,
+    'numpy': 65536,
+}
+
+
+def compute_blocks(chords, engine, ppu, transpose, feedrate_factor, block_size=256, max_block_size=None):
+    # Collects the (tick, duration, notes_xyz) chord stream into
+    # timelines and yields each together with its moves, so the output
+    # can start before the song is fully read. The first block is
+    # block_size chords, every next one twice as long as the one before,
+    # up to max_block_size (default: block_size), so the first lines come
+    # out quickly and a long song still goes through in long blocks.
+    if max_block_size is None:
+        max_block_size = block_size
+    timeline = ChordTimeline()
+    for tick, duration, notes_xyz in chords:
+        timeline.append(tick, duration, notes_xyz)
+        if len(timeline) == block_size:
+            yield timeline, engine(timeline, ppu, transpose, feedrate_factor)
+            timeline = ChordTimeline()
+            block_size = min(block_size * 2, max_block_size)
+    if len(timeline):
+        yield timeline, engine(timeline, ppu, transpose, feedrate_factor)
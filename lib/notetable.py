@@ -0,0 +1,45 @@
+# Columnar storage for the note events of a MIDI file.
+#
+# Instead of one Python object (or list) per note on/off, every field
+# lives in its own typed array, so an event costs ten bytes in total.
+# lib/midiparser.py decodes every track into blocks of these, which the
+# pipeline reads the events off (stream.table_events()), and
+# lib/timeline.py keeps the notes of a whole song in one, mapped
+# straight from its sidecar file.
+
+from array import array
+
+
+class NoteTable:
+    # Column type codes, in the order used by append()
+    columns = (
+        ('tick', 'I'),       # absolute time in MIDI ticks
+        ('on', 'B'),         # 1 = note on, 0 = note off
+        ('note', 'B'),       # MIDI note number
+        ('velocity', 'B'),
+        ('channel', 'B'),
+        ('track', 'H'),      # index of the track the event came from
+    )
+
+    def __init__(self):
+        for name, typecode in self.columns:
+            setattr(self, name, array(typecode))
+        # (tick, microseconds per beat) of the set tempo events, which
+        # are few enough for a list
+        self.tempos = []
+
+    def __len__(self):
+        return len(self.tick)
+
+    def append(self, tick, on, note, velocity, channel, track):
+        self.tick.append(tick)
+        self.on.append(on)
+        self.note.append(note)
+        self.velocity.append(velocity)
+        self.channel.append(channel)
+        self.track.append(track)
+
+    def column_appends(self):
+        # The append methods of the columns, in the order of append(),
+        # for a decoder to fill them without going through append()
+        return [getattr(self, name).append for name, typecode in self.columns]
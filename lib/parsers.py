@@ -0,0 +1,455 @@
+# The MIDI parsers a conversion can read its notes with.
+#
+# Every parser turns a MIDI file into one event iterator per track, in
+# the stream format of lib/stream.py, so the rest of the conversion
+# doesn't care which one was used:
+#
+#     mido        mido.MidiFile, which handles about anything
+#     midiparser  lib/midiparser.py, decoding straight from the file
+#                 bytes, several times faster than mido
+#     midicludge  python-midi through lib/midicludge.py, if installed
+#     auto        midiparser, but should it reject the file, whichever
+#                 of the others can read it
+#
+# Every parser but mido hands out the events while it reads the tracks.
+# So that a file midiparser goes wrong on halfway through a track still
+# goes to the next parser, auto first has midiparser walk every track
+# without keeping anything, which takes a fraction of the conversion.
+# -parser midiparser skips that walk, and stops the conversion wherever
+# the file goes wrong.
+#
+# Whatever a parser can't read is raised as a ParseError from parse(),
+# also when it only shows halfway through the tracks.
+#
+# check_parity() runs a file through all of them and compares the note
+# timelines they give.
+#
+# mido takes longer to import than most files take to convert with
+# midiparser, so it is only imported once something is parsed with it.
+
+import argparse
+import importlib.util
+import io
+import os.path
+import sys
+
+from . import midiparser
+from .stream import TEMPO, NOTE_OFF, NOTE_ON, merge_tracks
+
+
+class ParseError(Exception):
+    pass
+
+
+class ParsedMidi:
+    # What a parser gives back: the timing division, one event iterator
+    # per track and, if the parser knows it, the character set
+    def __init__(self, parser, ticks_per_beat, tracks, charset=None):
+        self.parser = parser
+        self.ticks_per_beat = ticks_per_beat
+        self.tracks = tracks
+        self.charset = charset
+
+
+def midi_bytes(midi_source):
+    # The bytes of a filename, bytes or binary file object
+    if isinstance(midi_source, (str, os.PathLike)):
+        with open(midi_source, 'rb') as f:
+            return f.read()
+    if isinstance(midi_source, (bytes, bytearray, memoryview)):
+        return bytes(midi_source)
+    return midi_source.read()
+
+
+def is_mido_file(midi_source):
+    # Without mido imported, nothing can be a mido.MidiFile yet
+    mido = sys.modules.get('mido')
+    return mido is not None and isinstance(midi_source, mido.MidiFile)
+
+
+def read_midi(midi_source):
+    # Accepts a filename, the bytes of a MIDI file, a binary file
+    # object or an already parsed mido.MidiFile
+    import mido
+
+    if isinstance(midi_source, mido.MidiFile):
+        return midi_source
+    if isinstance(midi_source, (str, os.PathLike)):
+        return mido.MidiFile(midi_source)
+    if isinstance(midi_source, (bytes, bytearray, memoryview)):
+        return mido.MidiFile(file=io.BytesIO(midi_source))
+    return mido.MidiFile(file=midi_source)
+
+
+
+def track_events(track, track_num, all_channels, options, log):
+    # Yields the tempo and note events of one mido track, in the stream
+    # format of lib/stream.py, and adds the channels it plays on to
+    # all_channels once the track is finished
+    import mido
+
+    track: mido.MidiTrack
+    absolute_time = 0
+    channels=set()
+    for event in track:
+        event: mido.Message
+        #Events return delta-time apparantly (Time since last event)
+        #Adding these should give absolute times
+        absolute_time += event.time
+        if event is mido.messages.BaseMessage:
+            log("Basemessage")
+        if event is mido.Message:
+            log("Message")
+        if event is mido.MetaMessage:
+            log("MetaMessage")
+        if event is mido.UnknownMetaMessage:
+            log("UnknownMetaMessage")
+        if event.is_meta and event.type == "set_tempo":
+            yield (absolute_time, TEMPO, event.tempo, 0, 0, track_num)
+            if options.verbose:
+                log("Tempo change: " + str(event.tempo))
+        if event.is_meta and event.type == "time_signature":
+            if options.verbose:
+                log(f"Time Signature: {event.numerator}/{event.denominator}")
+                log(f"Notated 32nd notes pr. beat: {event.notated_32nd_notes_per_beat}")
+                log(f"Clocks pr. click: {event.clocks_per_click}")
+        if event.is_meta and event.type == "key_signature":
+            if options.verbose:
+                log(f"Key Signature: {event.key}")
+        if ((event.type == "control_change") and (event.channel in options.channels)):
+            if event.control >= 32 and \
+                 event.control <= 63: pass # ===[ LSB Controller for 0-31 ]===
+                                           # Same as 0 to 32 below, but value is little-endian, not big as usual
+            elif event.control == 0: pass  # ===[ Bank Select ]===
+                                           # Allows user to switch bank for patch selection.
+                                           # Program change used with Bank Select.
+                                           # MIDI can access 16,384 patches per MIDI channel.
+            elif event.control == 1: pass  # ===[ Modulation Wheel ]===
+                                           # Generally this CC controls a vibrato
+                                           # effect (pitch, loudness, brighness).
+                                           # What is modulated is based on the patch.
+            elif event.control == 2: pass  # ===[ Breath Controller ]===
+                                           # Oftentimes associated with aftertouch 
+                                           # messages. It was originally intended for use with a breath
+                                           # MIDI controller in which blowing harder produced higher MIDI
+                                           # control values. It can be used for modulation as well.
+            elif event.control == 3: pass  # !=== Undefined ===!
+            elif event.control == 4: pass  # ===[ Foot Pedal ]===
+                                           # Often used with aftertouch messages.
+                                           # It can send a continuous stream of values based on how the pedal is used.
+            elif event.control == 5: pass  # ===[ Portamento Time ]===
+                                           # Controls portamento rate to slide
+                                           # between 2 notes played subsequently.
+            elif event.control == 6: pass  # ===[ Data Entry ]===
+                                           # Controls Value for NRPN or RPN parameters.
+            elif event.control == 7: pass  # ===[ Volume ]===
+                                           # Controls the volume of the channel.
+            elif event.control == 8: pass  # ===[ Balance ]===
+                                           # Controls the left and right balance, generally
+                                           # for _stereo_ patches. A value of 64 equals the center.
+            elif event.control == 9: pass  # !=== Undefined ===!
+            elif event.control == 10: pass # ===[ Pan ]===
+                                           # Controls the left and right balance, generally
+                                           # for _mono_ patches. A value of 64 equals the center.
+            elif event.control == 11: pass # ===[ Expression ]===
+                                           # Expression is a percentage of volume (CC7).
+            elif event.control == 12: pass # ===[ Effect Controller 1 ]===
+                                           # Usually used to control a parameter of an effect within
+                                           # the synth or workstation.
+            elif event.control == 13: pass # ===[ Effect Controller 2 ]===
+                                           # Usually used to control a parameter of an effect within
+                                           # the synth or workstation.
+
+            # 14-15 undefined, 15-19 General purpose, 20-31 undefined
+
+            elif event.control == 64: pass # ===[ Damper/sustain Pedal on/off ]===
+                                           # Value of ≤63 is off, and ≥64 is on
+                                           # On/off switch that controls sustain pedal. Nearly
+                                           # every synth will react to CC 64. (See also Sostenuto CC 66)
+            elif event.control == 65: pass # ===[ Portamento on/off ]===
+                                           # On/off switch (Value of ≤63 is off, and ≥64 is on)
+                                           # Portamento is a slide from one note to another,
+                                           # especially in instruments such as the violin.
+            elif event.control == 66: pass # ===[ Sostenuto Pedal on/off ]===
+                                           # On/off switch – Like the Sustain controller (CC 64),
+                                           # However, it only holds notes that were “On” when the
+                                           # pedal was pressed. People use it to “hold” chords”
+                                           # and play melodies over the held chord.
+            elif event.control == 67: pass # ===[ Soft Pedal on/off ]===
+                                           # On/off switch
+                                           # Lowers the volume of notes played.
+            elif event.control == 68: pass # ===[ Legato FootSwitch ]===
+                                           # Turns Legato effect between 2 subsequent notes on or off.
+            elif event.control == 69: pass # ===[ Hold 2 ]===
+                                           # Another way to “hold notes” (see MIDI CC 64 and
+                                           # MIDI CC 66). However notes fade out according to their
+                                           # release parameter rather than when the pedal is released.
+            elif event.control == 70: pass # ===[ Sound Controller 1 ]===
+                                           # Usually controls the way a sound is produced.
+                                           # Default = Sound Variation.
+            elif event.control == 71: pass # ===[ Sound Controller 2 ]===
+                                           # Allows shaping the Voltage Controlled Filter (VCF).
+                                           # Default = Resonance also (Timbre or Harmonics)
+            elif event.control == 72: pass # ===[ Sound Controller 3 ]===
+                                           # Controls release time of the Voltage controlled
+                                           # Amplifier (VCA). Default = Release Time.
+            elif event.control == 73: pass # ===[ Sound Controller 4 ]===
+                                           # Controls the “Attack’ of a sound. The attack is
+                                           # the amount of time it takes for the sound to reach maximum amplitude.
+            elif event.control == 74: pass # ===[ Sound Controller 5 ]===
+                                           # Controls VCFs cutoff frequency of the filter.
+            elif event.control >= 75 and \
+                 event.control <= 79: pass # ===[ Sound Controller 6 to 10 ]===
+                                           # Generic – Some manufacturers may use to further shave their sounds.
+
+            # 80-83 Is generic controls
+
+            elif event.control == 84: pass # ===[ Portamento CC Control ]===
+                                           # Controls the amount of Portamento.
+            # 85-90 undefined
+
+            elif event.control == 91: pass # ===[ Effects Depth: Reverb ]===
+                                           # Usually controls reverb send amount
+            elif event.control == 92: pass # ===[ Effects Depth: Tremolo ]===
+                                           # Usually controls tremolo amount
+            elif event.control == 93: pass # ===[ Effects Depth: Chorus ]===
+                                           # Usually controls chorus amount
+            elif event.control == 94: pass # ===[ Effects Depth: Celeste (Detune) ]===
+                                           # Usually controls detune amount
+            elif event.control == 95: pass # ===[ Effects Depth: Phaser ]===
+                                           # Usually controls phaser amount
+
+            # 96-101 Non defined parameter adjustments
+            # 102-119 undefined
+
+            # 120-127 is channel "mode" messages. No values are used except for CC 122 and 126
+            elif event.control == 120: pass # ===[ All Sound Off ]===
+                                            # Mutes all sound. It does so regardless of release
+                                            # time or sustain. (See MIDI CC 123)
+            elif event.control == 121: pass # ===[ Reset All Controllers ]===
+                                            # It will reset all controllers to their default.
+            elif event.control == 122: pass # ===[ Local on/off Switch ]===
+                                            # Turns internal connection of a MIDI keyboard or
+                                            # workstation, etc. on or off. If you use a computer, you
+                                            # will most likely want local control off to avoid notes
+                                            # being played twice. Once locally and twice when
+                                            # the note is sent back from the computer to your keyboard.
+                                            # 0 = off , 127 = on
+            elif event.control == 123: pass # ===[ All Notes Off ]===
+                                            # Mutes all sounding notes. Release time will still be
+                                            # maintained, and notes held by sustain will not turn
+                                            # off until sustain pedal is depressed.
+            elif event.control == 124: pass # ===[ Omni Mode Off ]===
+                                            # Sets to “Omni Off” mode.
+            elif event.control == 125: pass # ===[ Omni Mode On ]===
+                                            # Sets to “Omni On” mode.
+            elif event.control == 126: pass # ===[ Mono Mode ]===
+                                            # Sets device mode to Monophonic. The value equals the
+                                            # number of channels, or 0 if the number of channels
+                                            # equals the number of voices in the receiver.
+            elif event.control == 127: pass # ===[ Poly Mode ]===
+                                            # Sets device mode to Polyphonic.
+            
+        if ((event.type == "note_on") and (event.channel in options.channels)): # filter undesired instruments
+
+            if event.channel not in channels:
+                channels.add(event.channel)
+
+            # NB: looks like some use "note on (vel 0)" as equivalent to note off, so check for vel=0 here and treat it as a note-off.
+            # Comment: note_on (vel 0) is indeed used as note_off, but it is to keep the status flag set to running, thus
+            # making the MIDI communication more efficient
+
+            if event.velocity > 0:
+                if options.verbose:
+                    log("Note on  (time, channel, note, velocity) : %6i %6i %6i %6i" % (absolute_time, event.channel, event.note, event.velocity) )
+                yield (absolute_time, NOTE_ON, event.note, event.velocity, event.channel, track_num)
+            else:
+                if options.verbose:
+                    log("Note off (time, channel, note, velocity) : %6i %6i %6i %6i" % (absolute_time, event.channel, event.note, event.velocity) )
+                yield (absolute_time, NOTE_OFF, event.note, event.velocity, event.channel, track_num)
+        if (event.type == "note_off") and (event.channel in options.channels):
+
+            if event.channel not in channels:
+                channels.add(event.channel)
+
+            if options.verbose:
+                log("Note off (time, channel, note, velocity) : %6i %6i %6i %6i" % (absolute_time, event.channel, event.note, event.velocity) )
+            yield (absolute_time, NOTE_OFF, event.note, event.velocity, event.channel, track_num)
+
+    # Finished with this track
+    if len(channels) > 0:
+        msg=', ' . join(['%2d' % ch for ch in sorted(channels)])
+        log('Processed track %d, containing channels numbered: [%s ]' % (track_num, msg))
+        all_channels.update(channels)
+
+
+def logged_events(events, track_num, all_channels, options, log):
+    # The same logging track_events() does for mido, for the events of
+    # the other parsers
+    channels=set()
+    for event in events:
+        absolute_time, kind, value, velocity, channel, track = event
+        if kind == TEMPO:
+            if options.verbose:
+                log("Tempo change: " + str(value))
+        else:
+            channels.add(channel)
+            if options.verbose:
+                log("Note %s (time, channel, note, velocity) : %6i %6i %6i %6i" % ('on ' if kind == NOTE_ON else 'off', absolute_time, channel, value, velocity))
+        yield event
+
+    # Finished with this track
+    if len(channels) > 0:
+        msg=', ' . join(['%2d' % ch for ch in sorted(channels)])
+        log('Processed track %d, containing channels numbered: [%s ]' % (track_num, msg))
+        all_channels.update(channels)
+
+
+def parse_mido(midi_source, options, log, all_channels):
+    midi = read_midi(midi_source)
+    tracks=[track_events(track, track_num, all_channels, options, log) for track_num, track in enumerate(midi.tracks)]
+    return ParsedMidi('mido', midi.ticks_per_beat, tracks, midi.charset)
+
+
+def file_or_bytes(midi_source):
+    # A filename as it is, for midiparser.File to memory map it, anything
+    # else as the bytes of the file
+    if isinstance(midi_source, (str, os.PathLike)):
+        return midi_source
+    return midi_bytes(midi_source)
+
+
+def parse_midiparser(midi_source, options, log, all_channels, check=False):
+    midi = midiparser.File(file_or_bytes(midi_source))
+    if check:
+        try:
+            midi.check()
+        except Exception:
+            midi.close()
+            raise
+    tracks = midi.track_events(set(options.channels))
+    tracks=[logged_events(events, track_num, all_channels, options, log) for track_num, events in enumerate(tracks)]
+    return ParsedMidi('midiparser', midi.division, tracks)
+
+
+def cludge_events(track, track_num, channels):
+    # Events of one lib/midicludge.py track
+    for event in track.events:
+        if event.type == midiparser.meta.SetTempo:
+            yield event.absolute, TEMPO, event.detail.tempo, 0, 0, track_num
+        elif event.type in (midiparser.voice.NoteOn, midiparser.voice.NoteOff):
+            if event.channel in channels:
+                note, velocity = event.detail
+                on = NOTE_ON if event.type == midiparser.voice.NoteOn and velocity > 0 else NOTE_OFF
+                yield event.absolute, on, note, velocity, event.channel, track_num
+
+
+def parse_midicludge(midi_source, options, log, all_channels):
+    from . import midicludge
+    midi = midicludge.File(io.BytesIO(midi_bytes(midi_source)))
+    channels = set(options.channels)
+    tracks=[logged_events(cludge_events(track, track_num, channels), track_num, all_channels, options, log)
+            for track_num, track in enumerate(midi.tracks)]
+    return ParsedMidi('midicludge', midi.division, tracks)
+
+
+def parse_auto(midi_source, options, log, all_channels):
+    if is_mido_file(midi_source):
+        return parse_mido(midi_source, options, log, all_channels)
+    source = file_or_bytes(midi_source)
+    for parser in auto_order:
+        if not available(parser):
+            continue
+        try:
+            if parser == 'midiparser':
+                return parse_midiparser(source, options, log, all_channels, check=True)
+            return parsers[parser](source, options, log, all_channels)
+        except Exception as e:
+            log("The %s parser can't read this file (%s: %s), trying the next one" % (parser, type(e).__name__, e))
+    # None of the fallbacks could read it, show mido's complaint
+    return parse_mido(source, options, log, all_channels)
+
+
+parsers = {
+    'mido': parse_mido,
+    'midiparser': parse_midiparser,
+    'midicludge': parse_midicludge,
+    'auto': parse_auto,
+}
+
+# The order auto tries them in, fastest first
+auto_order = ['midiparser', 'mido', 'midicludge']
+
+
+def available(parser):
+    # midicludge needs python-midi, the others always work
+    if parser == 'midicludge':
+        return importlib.util.find_spec('midi') is not None
+    return parser in parsers
+
+
+def quiet(*args):
+    pass
+
+
+def error_text(e):
+    return "%s: %s" % (type(e).__name__, e) if str(e) else type(e).__name__
+
+
+def raising_parse_errors(events):
+    try:
+        yield from events
+    except Exception as e:
+        raise ParseError(error_text(e)) from e
+
+
+def parse(midi_source, options, log, all_channels):
+    # Parses midi_source with the parser chosen in options.parser, see
+    # the top of this file
+    if not available(options.parser):
+        raise ValueError("The %s parser is not available, choose from: %s" % (
+            options.parser, ', '.join(name for name in parsers if available(name))))
+    try:
+        parsed = parsers[options.parser](midi_source, options, log, all_channels)
+    except Exception as e:
+        raise ParseError(error_text(e)) from e
+    parsed.tracks = [raising_parse_errors(track) for track in parsed.tracks]
+    return parsed
+
+
+def check_parity(midi_source, channels=None):
+    # Parses midi_source with every parser and compares the merged event
+    # streams with mido's. Returns a dict with, for every parser, its
+    # status ('ok', 'different', 'failed' or 'unavailable'), the number
+    # of events and, if different, the index of the first event that
+    # differs together with both versions of it.
+    if channels is None:
+        channels = list(range(16))
+    options = argparse.Namespace(channels=channels, verbose=False)
+    data = midi_bytes(midi_source)
+
+    timelines = {}
+    results = {}
+    for parser in ['mido'] + [name for name in auto_order if name != 'mido']:
+        if not available(parser):
+            results[parser] = {'status': 'unavailable'}
+            continue
+        try:
+            parsed = parsers[parser](data, options, quiet, set())
+            timelines[parser] = list(merge_tracks(parsed.tracks))
+        except Exception as e:
+            results[parser] = {'status': 'failed', 'error': "%s: %s" % (type(e).__name__, e)}
+            continue
+        results[parser] = {'status': 'ok', 'events': len(timelines[parser])}
+
+    reference = timelines.get('mido')
+    for parser, timeline in timelines.items():
+        if reference is None or timeline == reference:
+            continue
+        index = next((i for i, (a, b) in enumerate(zip(reference, timeline)) if a != b),
+                     min(len(reference), len(timeline)))
+        results[parser]['status'] = 'different'
+        results[parser]['first_difference'] = index
+        results[parser]['mido'] = reference[index] if index < len(reference) else None
+        results[parser][parser] = timeline[index] if index < len(timeline) else None
+    return results
@@ -0,0 +1,165 @@
+# How long the G-code takes to play, compared with the MIDI file.
+#
+# The G-code is read back the way the controller reads it (see
+# lib/gcodereader.py), giving every move and dwell its duration: the
+# length of the move over its feed rate, and the P word of the dwell.
+# The MIDI file goes through the converter's own pipeline up to the
+# moves, giving every chord its start time and length from the tempo
+# map. Where the two disagree, the machine plays out of time.
+#
+# Neither side is compared line by line: reversing and folding split
+# moves, and the compact writer drops and merges them. Instead both
+# sides are cut into runs of the same feed rate (or of rest), which
+# survive all of that, and the runs are matched up in order. Runs that
+# one side has and the other hasn't (a move that rounded to nothing, a
+# rest too short to write) are skipped over, and their time shows up
+# as drift in the runs after them. The drift of a run is how much later
+# it starts in the G-code than in the MIDI file, counted from the start
+# of the first run, so a prefix that homes the machine doesn't count.
+#
+#     report = drift('song.mid', 'cupcake', {'axes': 'XY'})
+#     for bar in report['bars']:
+#         print(bar['bar'], bar['drift'])
+#
+# Bars are beats_per_bar beats long, the time signature in the MIDI file
+# isn't read.
+
+from .converter import convert, resolve_options, quiet
+from .gcodereader import ModalState
+from .gcodewriter import GCodeWriter
+from .machines import rate_dict, axes_dict
+from .moves import compute_blocks, engines, max_block_sizes
+from .parsers import parse
+from .stream import merge_tracks, chords
+
+REST = 'rest'
+RAPID = 'rapid'
+
+
+def runs(items):
+    # Joins consecutive [signature, start, duration, tick] items of the
+    # same signature
+    joined = []
+    for item in items:
+        if joined and joined[-1][0] == item[0]:
+            joined[-1][2] += item[2]
+        else:
+            joined.append(list(item))
+    return joined
+
+
+def gcode_items(lines, feedrate_factor, feed_decimals, dwell_factor=1.0):
+    # [signature, start, duration, None] of every line that takes time
+    state = ModalState(feedrate_factor, dwell_factor=dwell_factor)
+    execute = state.execute
+    time = 0.0
+    for line in lines:
+        action = execute(line)
+        if action is None:
+            continue
+        if action[0] == 'move':
+            seconds = action[2]
+            signature = RAPID if state.motion == 0 else round(state.feed, feed_decimals)
+        else:
+            seconds = action[1]
+            signature = REST
+        if seconds > 0.0:
+            yield [signature, time, seconds, None]
+            time += seconds
+
+
+def song_items(midi, options, feed_decimals):
+    # [signature, start, duration, start tick] of every chord of the
+    # parsed song, the way convert() turns it into moves and rests
+    feedrate_factor = rate_dict.get(options.feedrate)[2]
+    chord_stream = chords(merge_tracks(midi.tracks), axes_dict.get(options.axes), midi.ticks_per_beat)
+    time = 0.0
+    tick = 0
+    for timeline, moves in compute_blocks(chord_stream, engines[options.engine], options.ppu, options.transpose, feedrate_factor,
+                                          max_block_size=max_block_sizes[options.engine]):
+        distance = moves.distance
+        for k in range(len(moves)):
+            duration = timeline.duration[k]
+            if distance[0][k] + distance[1][k] + distance[2][k] > 0.0:
+                signature = round(moves.combined_feedrate[k], feed_decimals)
+            else:
+                signature = REST
+            if duration > 0.0:
+                yield [signature, time, duration, tick]
+            time += duration
+            tick = timeline.tick[k]
+
+
+def align(expected, played, window=16):
+    # (expected index, played index) of the runs that match. Where the
+    # signatures differ, skip the fewest runs on either side that gets
+    # them matching again, looking no further than window runs ahead.
+    i = j = 0
+    while i < len(expected) and j < len(played):
+        if expected[i][0] == played[j][0]:
+            yield i, j
+            i += 1
+            j += 1
+            continue
+        skip = None
+        for total in range(1, window):
+            for di in range(total + 1):
+                dj = total - di
+                if i + di < len(expected) and j + dj < len(played) and \
+                        expected[i + di][0] == played[j + dj][0]:
+                    skip = (di, dj)
+                    break
+            if skip is not None:
+                break
+        if skip is None:
+            skip = (1, 1)
+        i += skip[0]
+        j += skip[1]
+
+
+def drift(midi_source, machine='multicam_custom', options=None, lines=None, beats_per_bar=4, dwell_factor=1.0):
+    # Compares the playing time of lines (an iterable of G-code lines,
+    # e.g. an open file) with midi_source. Without lines, the G-code is
+    # converted from midi_source in memory with the same options.
+    options = resolve_options(machine, options)
+    feedrate_factor = rate_dict.get(options.feedrate)[2]
+    feed_decimals = GCodeWriter(None, options.ppu, options.precision).feed_decimals
+    if lines is None:
+        lines = convert(midi_source, machine, options)
+
+    midi = parse(midi_source, options, quiet, set())
+    expected = runs(song_items(midi, options, feed_decimals))
+    played = runs(gcode_items(lines, feedrate_factor, feed_decimals, dwell_factor))
+    bar_ticks = midi.ticks_per_beat * beats_per_bar
+
+    bars = []
+    matched = 0
+    offset = None
+    worst = 0.0
+    for i, j in align(expected, played):
+        if offset is None:
+            offset = played[j][1] - expected[i][1]
+        late = played[j][1] - offset - expected[i][1]
+        bar = expected[i][3] // bar_ticks + 1
+        if not bars or bars[-1]['bar'] != bar:
+            bars.append({'bar': bar, 'time': expected[i][1], 'drift': late, 'max_drift': late})
+        bars[-1]['drift'] = late
+        if abs(late) > abs(bars[-1]['max_drift']):
+            bars[-1]['max_drift'] = late
+        if abs(late) > abs(worst):
+            worst = late
+        matched += 1
+
+    midi_length = expected[-1][1] + expected[-1][2] if expected else 0.0
+    gcode_length = played[-1][1] + played[-1][2] - (offset or 0.0) if played else 0.0
+    return {
+        'bars': bars,
+        'max_drift': worst,
+        'final_drift': gcode_length - midi_length,
+        'midi_length': midi_length,
+        'gcode_length': gcode_length,
+        'offset': offset or 0.0,
+        'runs': len(expected),
+        'gcode_runs': len(played),
+        'matched': matched,
+    }
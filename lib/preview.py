@@ -0,0 +1,116 @@
+# Renders G-code as the sound the steppers would make, into a WAV file.
+#
+# A stepper sings at its step frequency: the speed of its axis times
+# the pulses per unit. So every move becomes, for each axis that moves,
+# a square wave at |distance| / duration * ppu for the duration of the
+# move, and every dwell becomes silence. The lines are read back the way
+# the controller reads them (lib/gcodereader.py), so the preview plays
+# what the machine would play, reversing, folding and rounding included.
+#
+#     lines = convert('song.mid', 'cupcake')
+#     durations, freq = segments(lines, ppu)
+#     write_wav('song.wav', durations, freq)
+#
+# The samples are worked out with NumPy about a second at a time:
+# the frequency of every sample is the frequency of its move repeated,
+# the phase is the running sum of those, and the wave follows from the
+# phase. The phase carries on from one move to the next, so there are
+# no clicks where the pitch changes.
+
+import wave
+from array import array
+
+from .gcodereader import ModalState
+
+sample_rate = 44100
+amplitude = 0.25        # of each axis, so three axes at once can't clip
+
+
+def segments(lines, ppu, feedrate_factor=60.0, dwell_factor=1.0):
+    # The duration of every move and dwell, and the step frequency of
+    # each axis during it (0 for a still axis), as arrays
+    state = ModalState(feedrate_factor, dwell_factor=dwell_factor)
+    execute = state.execute
+    durations = array('d')
+    freq = (array('d'), array('d'), array('d'))
+    for line in lines:
+        start = state.position
+        action = execute(line)
+        if action is None:
+            continue
+        if action[0] == 'dwell':
+            seconds = action[1]
+            if seconds > 0.0:
+                durations.append(seconds)
+                for j in range(3):
+                    freq[j].append(0.0)
+            continue
+        seconds = action[2]
+        if seconds <= 0.0:
+            continue
+        end = state.position
+        durations.append(seconds)
+        for j in range(3):
+            freq[j].append(abs(end[j] - start[j]) / seconds * ppu[j])
+    return durations, freq
+
+
+def render(durations, freq, rate=sample_rate, block=65536):
+    # Yields the samples as blocks of 16 bit integers, of about block
+    # samples (more if a single move is longer)
+    import numpy as np
+
+    durations = np.frombuffer(durations, dtype=np.float64) if isinstance(durations, array) else np.asarray(durations, dtype=np.float64)
+    freq = [np.asarray(column, dtype=np.float64) for column in freq]
+    # Sample boundaries from the running time, so rounding to whole
+    # samples never adds up over the song
+    bounds = np.rint(np.concatenate(([0.0], np.cumsum(durations))) * rate).astype(np.int64)
+    counts = np.diff(bounds)
+    level = int(amplitude * 32767)
+    phase = [0.0, 0.0, 0.0]     # in half cycles
+    first = 0
+    while first < len(durations):
+        last = max(first + 1, int(np.searchsorted(bounds, bounds[first] + block, 'right')) - 1)
+        size = int(bounds[last] - bounds[first])
+        if size == 0:
+            first = last
+            continue
+        samples = np.zeros(size, dtype=np.int64)
+        for j in range(3):
+            f = np.repeat(freq[j][first:last], counts[first:last])
+            if not f.any():
+                continue
+            half_cycles = np.cumsum(f)
+            half_cycles *= 2.0 / rate
+            half_cycles += phase[j]
+            phase[j] = float(half_cycles[-1]) % 2.0
+            # A square wave, high in the even half cycles and low in the
+            # odd ones, silent where the axis stands still
+            wave = level - (2 * level) * (half_cycles.astype(np.int64) & 1)
+            wave[f == 0.0] = 0
+            samples += wave
+        yield samples.astype('<i2')
+        first = last
+
+
+def write_wav(path, durations, freq, rate=sample_rate):
+    # Writes a mono 16 bit WAV file, returns its length in seconds
+    frames = 0
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        for samples in render(durations, freq, rate):
+            f.writeframes(samples.tobytes())
+            frames += len(samples)
+    return frames / float(rate)
+
+
+def frequency_range(freq):
+    # (lowest, highest) step frequency of each axis while it moves, None
+    # for an axis that never does
+    ranges = []
+    for column in freq:
+        moving = [f for f in column if f > 0.0]
+        ranges.append((min(moving), max(moving)) if moving else None)
+    return ranges
@@ -0,0 +1,116 @@
+# Wall time, CPU time and item counts for each stage of a conversion.
+#
+# The conversion is a chain of generators, so the stages don't run one
+# after the other but take turns item by item. A stage is timed from
+# the moment something asks it for its next item until it hands that
+# item over, and whatever part of that time is spent waiting on the
+# stage it reads from is taken off again. So every stage is charged
+# only for its own work, and the stage times add up to the total.
+#
+#     profiler = Profiler()
+#     for line in convert('song.mid', 'cupcake', profiler=profiler):
+#         ...
+#     print(profiler.report())
+#
+# Without a profiler, convert() uses no_profiler, which leaves the
+# generators as they are and costs nothing per item.
+
+import contextlib
+import time
+
+
+class Profiler:
+    def __init__(self):
+        self.stages = {}      # name: [wall, cpu, items]
+        self.stack = []       # (name, wall, cpu) of the stages running now
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+
+    def enter(self, name):
+        self.stages.setdefault(name, [0.0, 0.0, 0])
+        self.stack.append((name, time.perf_counter(), time.process_time()))
+
+    def leave(self, items=0):
+        name, wall, cpu = self.stack.pop()
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        stats = self.stages[name]
+        stats[0] += wall
+        stats[1] += cpu
+        stats[2] += items
+        if self.stack:
+            # The stage that called this one was waiting all along
+            parent = self.stages[self.stack[-1][0]]
+            parent[0] -= wall
+            parent[1] -= cpu
+
+    def stage(self, name, iterable):
+        # Passes the items of iterable through, timing each of them as
+        # part of stage name. Same bookkeeping as enter() and leave(),
+        # written out since it runs for every single item.
+        stats = self.stages.setdefault(name, [0.0, 0.0, 0])
+        stack = self.stack
+        stages = self.stages
+        wall_clock = time.perf_counter
+        cpu_clock = time.process_time
+        iterator = iter(iterable)
+        while True:
+            frame = (name, wall_clock(), cpu_clock())
+            stack.append(frame)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.leave()
+                return
+            except BaseException:
+                self.leave()
+                raise
+            stack.pop()
+            wall = wall_clock() - frame[1]
+            cpu = cpu_clock() - frame[2]
+            stats[0] += wall
+            stats[1] += cpu
+            stats[2] += 1
+            if stack:
+                parent = stages[stack[-1][0]]
+                parent[0] -= wall
+                parent[1] -= cpu
+            yield item
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        # Times the body of a with statement as part of stage name
+        self.enter(name)
+        try:
+            yield
+        finally:
+            self.leave()
+
+    def count(self, name, items):
+        self.stages.setdefault(name, [0.0, 0.0, 0])[2] += items
+
+    def report(self):
+        # A dict for json.dump(). items is what the stage handed on:
+        # events, chords, blocks of moves or Gcode lines.
+        return {
+            'stages': {name: {'wall': wall, 'cpu': cpu, 'items': items}
+                       for name, (wall, cpu, items) in self.stages.items()},
+            'total': {
+                'wall': time.perf_counter() - self.wall,
+                'cpu': time.process_time() - self.cpu,
+            },
+        }
+
+
+class NoProfiler:
+    def stage(self, name, iterable):
+        return iterable
+
+    def timed(self, name):
+        return contextlib.nullcontext()
+
+    def count(self, name, items):
+        pass
+
+
+no_profiler = NoProfiler()
@@ -0,0 +1,194 @@
+# Streams G-code to a GRBL-style controller over a serial port.
+#
+# Sending a line and waiting for its "ok" before sending the next one
+# leaves the controller idle for a whole round trip after every line,
+# which is long enough to hear between short notes. Instead this keeps
+# count of the characters that have been sent but not yet answered:
+# every "ok" (or "error") answers the oldest line still outstanding, and
+# a new line goes out as soon as it fits in what is left of the
+# controller's receive buffer. So the buffer stays full and the planner
+# always has the next moves at hand.
+#
+#     sender = GrblSender('/dev/ttyACM0')
+#     stats = sender.stream(convert('song.mid', 'multicam_custom'))
+#
+# Comments and blank lines are left out before sending, they only take
+# up buffer space. The statistics count the underruns, the times all
+# sent lines had been answered while there were lines left to send:
+# the controller had nothing more to work on, because the lines weren't
+# produced in time. A dwell (G4) runs the planner empty on purpose and
+# is only answered once it is over, so a drain right after one is
+# counted apart, as dwell_drains, and not as an underrun.
+
+import collections
+import os
+import select
+import termios
+import time
+import tty
+
+from .gcodereader import strip_comment, words
+
+
+class SenderError(Exception):
+    pass
+
+
+def open_port(port, baud=115200):
+    # A raw, blocking file descriptor for the serial device
+    fd = os.open(port, os.O_RDWR | os.O_NOCTTY)
+    try:
+        # TCSANOW, so that whatever the controller already sent (its
+        # greeting) isn't thrown away
+        tty.setraw(fd, termios.TCSANOW)
+        speed = getattr(termios, 'B%d' % baud, None)
+        if speed is None:
+            raise SenderError("Unsupported baud rate %d" % baud)
+        attributes = termios.tcgetattr(fd)
+        attributes[4] = attributes[5] = speed
+        termios.tcsetattr(fd, termios.TCSANOW, attributes)
+    except (termios.error, SenderError):
+        os.close(fd)
+        raise
+    return fd
+
+
+class GrblSender:
+    def __init__(self, port, baud=115200, rx_buffer=128, timeout=30.0, log=None):
+        # rx_buffer is the size of the controller's receive buffer (128
+        # bytes for GRBL on an Arduino). It is a ring buffer, which holds
+        # one character less than its size, so at most rx_buffer - 1
+        # characters are left unanswered. timeout is how long to wait for
+        # an answer before giving up, it has to cover the longest dwell.
+        self.fd = open_port(port, baud)
+        self.rx_buffer = rx_buffer
+        self.timeout = timeout
+        self.log = log or quiet
+        self.received = bytearray()
+        self.greeting = None
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, data):
+        while data:
+            data = data[os.write(self.fd, data):]
+
+    def read_line(self, timeout):
+        # The next line from the controller, None after timeout seconds
+        deadline = time.monotonic() + timeout
+        while True:
+            end = self.received.find(b"\n")
+            if end >= 0:
+                line = self.received[:end].decode('ascii', 'replace').strip()
+                del self.received[:end + 1]
+                return line
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return None
+            readable, _, _ = select.select([self.fd], [], [], left)
+            if readable:
+                data = os.read(self.fd, 4096)
+                if not data:
+                    raise SenderError("The controller closed the connection")
+                self.received += data
+
+    def wait_for_greeting(self, timeout=2.0):
+        # GRBL introduces itself when it starts, a controller that was
+        # already running stays quiet, which is fine too
+        deadline = time.monotonic() + timeout
+        while True:
+            line = self.read_line(max(0.0, deadline - time.monotonic()))
+            if line is None:
+                return None
+            if line.startswith('Grbl'):
+                self.greeting = line
+                self.log("Controller:\n    %s" % line)
+                return line
+
+    def stream(self, lines):
+        # Sends the lines, keeping the receive buffer as full as it
+        # can be, and waits until all of them are answered
+        pending = collections.deque()   # (length, time sent, dwell) of the unanswered lines
+        in_buffer = 0
+        after_dwell = False             # whether the last line answered was a dwell
+        stats = {
+            'lines': 0,
+            'bytes': 0,
+            'errors': 0,
+            'underruns': 0,
+            'dwell_drains': 0,
+            'latency_max': 0.0,
+            'latency_total': 0.0,
+        }
+        started = time.perf_counter()
+
+        def answer(timeout):
+            nonlocal in_buffer, after_dwell
+            line = self.read_line(timeout)
+            if line is None:
+                raise SenderError("No answer from the controller within %g seconds" % self.timeout)
+            if line.startswith('ok') or line.startswith('error'):
+                length, sent, after_dwell = pending.popleft()
+                in_buffer -= length
+                latency = time.perf_counter() - sent
+                stats['latency_total'] += latency
+                stats['latency_max'] = max(stats['latency_max'], latency)
+                if line.startswith('error'):
+                    stats['errors'] += 1
+                    self.log("Controller reported %s" % line)
+            elif line.startswith('ALARM'):
+                raise SenderError("Controller raised %s" % line)
+            elif line:
+                # Messages and status reports, nothing to count
+                self.log("Controller: %s" % line)
+
+        for line in lines:
+            line = strip_comment(line)
+            if not line:
+                continue
+            data = (line + "\n").encode('ascii')
+            if len(data) >= self.rx_buffer:
+                raise SenderError("Line longer than the receive buffer: %s" % line)
+            while in_buffer + len(data) >= self.rx_buffer:
+                answer(self.timeout)
+            # Take in whatever answers have come in meanwhile, so that the
+            # buffer count is up to date
+            while self.received.find(b"\n") >= 0 or select.select([self.fd], [], [], 0)[0]:
+                if not pending:
+                    break
+                answer(self.timeout)
+            if not pending and stats['lines']:
+                stats['dwell_drains' if after_dwell else 'underruns'] += 1
+            self.write(data)
+            pending.append((len(data), time.perf_counter(), ('G', 4.0) in words(line)))
+            in_buffer += len(data)
+            stats['lines'] += 1
+            stats['bytes'] += len(data)
+
+        while pending:
+            answer(self.timeout)
+
+        stats['time'] = time.perf_counter() - started
+        stats['latency_mean'] = stats['latency_total'] / stats['lines'] if stats['lines'] else 0.0
+        del stats['latency_total']
+        return stats
+
+
+def stream_to(port, lines, baud=115200, rx_buffer=128, timeout=30.0, log=None):
+    # Opens port, streams lines and returns the statistics
+    with GrblSender(port, baud, rx_buffer, timeout, log) as sender:
+        sender.wait_for_greeting()
+        return sender.stream(lines)
+
+
+def quiet(*args):
+    pass
@@ -0,0 +1,101 @@
+# A song kept in memory, to convert it again and again with different
+# settings while tuning them.
+#
+#     session = Session('song.mid')
+#     for line in session.convert('cupcake', {'transpose': (12, 0, 0)}):
+#         ...
+#
+# The MIDI file is read once, into a Timeline of the notes of all
+# channels and the tempo changes (lib/timeline.py). Every conversion
+# starts from there and only redoes what its settings change:
+#
+#     channels            picks the notes out of the timeline again
+#     axes                the chords (voice allocation and durations)
+#     ppu, transpose,     the moves (frequencies, feed rates and
+#     feedrate, engine    distances)
+#
+# and everything else (the machine envelope, positions, precision,
+# compact, modal, prefix and postfix) only changes how the moves are
+# written. The chords and the moves of the last few settings are kept,
+# so going back to an earlier setting costs nothing but the writing.
+
+import time
+
+from .converter import block_lines, resolve_options, sidecar_events, source_name, quiet
+from .machines import rate_dict, axes_dict
+from .moves import ChordTimeline, compute_blocks, engines, max_block_sizes
+from .parsers import midi_bytes
+from .profiler import no_profiler
+from .stream import chords
+from .timeline import Timeline, load_timeline
+from .voices import VoiceAllocator
+
+
+class Session:
+    def __init__(self, midi_source, parser='auto', sidecar=False, log=None, keep=8):
+        # keep is the number of chord and move results to hold on to
+        if log is None:
+            log = quiet
+        self.name = source_name(midi_source)
+        started = time.perf_counter()
+        if sidecar and isinstance(midi_source, str):
+            self.timeline = load_timeline(midi_source, lambda data: sidecar_events(data, parser), log)
+        else:
+            ticks_per_beat, num_tracks, events = sidecar_events(midi_bytes(midi_source), parser)
+            self.timeline = Timeline(ticks_per_beat, num_tracks).fill(events)
+        self.load_time = time.perf_counter() - started
+        self.keep = keep
+        self.chords = {}    # (channels, axes): (ChordTimeline, VoiceAllocator)
+        self.moves = {}     # (channels, axes, ppu, transpose, feedrate, engine): blocks
+        self.computed = {'chords': 0, 'moves': 0}
+
+    def remember(self, cache, key, value):
+        cache[key] = value
+        while len(cache) > self.keep:
+            # Dicts keep their order, the first key is the oldest
+            del cache[next(iter(cache))]
+        return value
+
+    def chord_timeline(self, channels, axes, log, profiler):
+        key = (channels, axes)
+        if key in self.chords:
+            # Move it to the end, as the one used last
+            return self.remember(self.chords, key, self.chords.pop(key))
+        self.computed['chords'] += 1
+        voices = VoiceAllocator()
+        timeline = ChordTimeline()
+        with profiler.timed('voices'):
+            for tick, duration, notes_xyz in chords(self.timeline.events(channels), axes_dict.get(axes),
+                                                    self.timeline.ticks_per_beat, log, voices):
+                timeline.append(tick, duration, notes_xyz)
+        return self.remember(self.chords, key, (timeline, voices))
+
+    def blocks(self, options, log=quiet, profiler=no_profiler):
+        # The (ChordTimeline, Moves) blocks of the song with these
+        # resolved options, and the VoiceAllocator of its chords
+        channels = tuple(sorted(set(options.channels)))
+        timeline, voices = self.chord_timeline(channels, options.axes, log if options.verbose else None, profiler)
+        key = (channels, options.axes, tuple(options.ppu), tuple(options.transpose), options.feedrate, options.engine)
+        if key in self.moves:
+            return self.remember(self.moves, key, self.moves.pop(key)), voices
+        self.computed['moves'] += 1
+        rows = zip(timeline.tick, timeline.duration, zip(*timeline.notes))
+        with profiler.timed('moves'):
+            blocks = list(compute_blocks(rows, engines[options.engine], options.ppu, options.transpose,
+                                         rate_dict.get(options.feedrate)[2], max_block_size=max_block_sizes[options.engine]))
+        return self.remember(self.moves, key, blocks), voices
+
+    def convert(self, machine='multicam_custom', options=None, log=None, profiler=None):
+        # Yields the Gcode lines, like lib.converter.convert() does for
+        # the MIDI file
+        options = resolve_options(machine, options)
+        if log is None:
+            log = quiet
+        if profiler is None:
+            profiler = no_profiler
+
+        all_channels = set()
+        for channels in self.timeline.track_channels(options.channels):
+            all_channels.update(channels)
+        blocks, voices = self.blocks(options, log, profiler)
+        return profiler.stage('gcode', block_lines(blocks, options.name or self.name, options, log, all_channels, voices))
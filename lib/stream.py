@@ -0,0 +1,101 @@
+# Streaming pipeline from the events of each track to chords.
+#
+# Every track yields its events as tuples
+#
+#     (tick, kind, value, velocity, channel, track)
+#
+# where kind is TEMPO (value is the tempo in microseconds per beat),
+# NOTE_OFF or NOTE_ON (value is the note number), or TICK, which only
+# marks that the song has reached tick (see held_by_tick()). Each track is already
+# in time order, so the tracks are merged lazily with a heap instead of
+# collecting and sorting everything, and the chords come out while the
+# tracks are still being read. Memory stays bounded by the number of
+# tracks rather than the number of events. lib/midiparser.py decodes a
+# track into NoteTable blocks, and the tuples are only made as the
+# events are read off them (table_events()).
+
+import heapq
+from itertools import groupby
+from operator import itemgetter
+
+from .tempomap import TempoMap
+from .voices import VoiceAllocator
+
+TEMPO = -1
+NOTE_OFF = 0
+NOTE_ON = 1
+TICK = 2
+
+
+def sorted_by_tick(events):
+    # Events of a track are in tick order but not sorted among events
+    # sharing a tick. Sort each such run, so the merged stream has a
+    # fixed order within a tick: tempo changes first, then note-offs
+    # before note-ons, then by note and velocity.
+    for tick, group in groupby(events, key=itemgetter(0)):
+        yield from sorted(group)
+
+
+def held_by_tick(events):
+    # sorted_by_tick() for a live stream, where the end of a tick is only
+    # known once the next one starts: the events of a tick are held until
+    # then and come out sorted. A TICK event at the new tick follows them,
+    # so chords() yields the chord ending there right away instead of at
+    # the end of the new tick.
+    held = []
+    for event in events:
+        if held and event[0] != held[0][0]:
+            held.sort()
+            yield from held
+            held = []
+            yield event[0], TICK, 0, 0, 0, 0
+        held.append(event)
+    held.sort()
+    yield from held
+
+
+def merge_tracks(tracks):
+    return heapq.merge(*(sorted_by_tick(track) for track in tracks))
+
+
+def table_events(table, track=0):
+    # The rows of a NoteTable as events, with its tempo changes (of the
+    # given track) ahead of the notes at the same tick
+    notes = zip(table.tick, table.on, table.note, table.velocity, table.channel, table.track)
+    if not table.tempos:
+        return notes
+    return heapq.merge(((tick, TEMPO, tempo, 0, 0, track) for tick, tempo in table.tempos), notes)
+
+
+def chords(events, axes, ticks_per_beat, log=None, voices=None):
+    # Yields (tick, duration, notes_xyz) for every chord change in the
+    # merged event stream: the tick at which the chord ends, its length
+    # in seconds and the note for each of the X, Y and Z axes (-1 if
+    # silent). axes is the ordered list of axis indices to play on, the
+    # highest pitched notes go to the first axes. Warnings about odd
+    # note events go to log (e.g. print), if given. Pass a
+    # VoiceAllocator as voices to read its counters afterwards.
+    tempo_map = TempoMap(ticks_per_beat)
+    last_time = 0
+    if voices is None:
+        voices = VoiceAllocator()
+
+    for tick, kind, value, velocity, channel, track in events:
+        if kind == TEMPO:
+            # Only changes the length of the chords from here on, the
+            # chord sounding now keeps going
+            tempo_map.add(tick, value)
+            continue
+
+        if last_time < tick:
+            yield tick, tempo_map.duration(last_time, tick), voices.assign(axes)
+
+            # finally, set this absolute time as the new starting time
+            last_time = tick
+
+        if kind == NOTE_ON:
+            if not voices.note_on(value) and log:
+                log("Warning: tried to turn on note already on!")
+        elif kind == NOTE_OFF:
+            if not voices.note_off(value) and log:
+                log("Warning: tried to turn off note that wasn't on!")
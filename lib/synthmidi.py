@@ -0,0 +1,77 @@
+# Writes synthetic Standard MIDI Files of any size, for benchmarking.
+#
+# The songs are format 1 files with one channel per track. Every track
+# plays a steady run of chords of random notes, the first track also
+# changes the tempo at regular intervals. Note offs are written as note
+# ons with velocity 0 and every channel event after the first leaves
+# out its status byte (running status), as most sequencers do, so the
+# parsers get exercised the same way real files exercise them. The same
+# seed always gives the same file.
+
+import random
+
+from .midiparser import voice, meta
+
+
+def variable_length(value):
+    # Encodes a MIDI variable length number
+    data = bytearray([value & 0x7F])
+    value >>= 7
+    while value:
+        data.insert(0, (value & 0x7F) | 0x80)
+        value >>= 7
+    return data
+
+
+def synthetic_track(events, channel, chord, tempo_every, ticks_per_beat, rand):
+    # One MTrk chunk with about events note on/off events. tempo_every is
+    # the number of chords between tempo changes (0 for none).
+    data = bytearray()
+    status = None
+    chords = 0
+    written = 0
+    delta = 0
+    while written < events:
+        if tempo_every and chords % tempo_every == 0:
+            tempo = rand.randrange(300000, 900000)
+            data += variable_length(delta)
+            data += bytes([meta.FileMetaEvent, meta.SetTempo, 3])
+            data += tempo.to_bytes(3, byteorder='big')
+            # Meta events cancel running status
+            status = None
+            delta = 0
+
+        size = min(chord, (events - written) // 2) or 1
+        notes = rand.sample(range(36, 97), size)
+        for velocity in (rand.randrange(40, 128), 0):
+            for note in notes:
+                data += variable_length(delta)
+                if status != voice.NoteOn | channel:
+                    status = voice.NoteOn | channel
+                    data.append(status)
+                data += bytes([note, velocity])
+                delta = 0
+                written += 1
+            # Uneven lengths, so the tracks seldom change notes at
+            # the same tick
+            delta = rand.randrange(1, ticks_per_beat)
+        chords += 1
+
+    data += variable_length(0)
+    data += bytes([meta.FileMetaEvent, meta.EndTrack, 0])
+    return b'MTrk' + len(data).to_bytes(4, byteorder='big') + data
+
+
+def synthetic_midi(events, tracks=8, chord=4, tempo_every=64, ticks_per_beat=480, seed=0):
+    # The bytes of a MIDI file with about events note events in total,
+    # spread over tracks tracks of chords of up to chord notes
+    rand = random.Random(seed)
+    header = b'MThd' + (6).to_bytes(4, byteorder='big') + \
+        (1).to_bytes(2, byteorder='big') + tracks.to_bytes(2, byteorder='big') + \
+        ticks_per_beat.to_bytes(2, byteorder='big')
+    chunks = [header]
+    for track in range(tracks):
+        share = events // tracks + (1 if track < events % tracks else 0)
+        chunks.append(synthetic_track(share, track % 16, chord, tempo_every if track == 0 else 0,
+                                      ticks_per_beat, rand))
+    return b''.join(chunks)
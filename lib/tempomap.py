@@ -0,0 +1,98 @@
+# Tick to seconds conversion for songs with tempo changes.
+#
+# The map is built once from the set_tempo events of all tracks. It
+# keeps the tick of every tempo change together with the number of
+# seconds elapsed up to it, so converting a tick is a binary search
+# plus one multiplication. Within a single tempo the result is exactly
+# what mido.tick2second gives.
+
+from array import array
+from bisect import bisect_right
+
+# Microseconds per beat until the first set_tempo event (120 bpm)
+default_tempo = 500000
+
+
+class TempoMap:
+    def __init__(self, ticks_per_beat, changes=()):
+        # changes are (tick, tempo) pairs in any order. When several
+        # changes share a tick, the last one given wins.
+        self.ticks_per_beat = ticks_per_beat
+        self.tick = array('I', [0])
+        self.tempo = array('I', [default_tempo])
+        self.scale = array('d', [self.tick_scale(default_tempo)])
+        self.seconds = array('d', [0.0])
+
+        for tick, tempo in sorted(changes, key=lambda change: change[0]):
+            self.add(tick, tempo)
+
+    def add(self, tick, tempo):
+        # Append a tempo change at or after the last one, e.g. while
+        # streaming through the events of a song in time order
+        if tick < self.tick[-1]:
+            raise ValueError("Tempo change at tick %d is before the last one at tick %d" % (tick, self.tick[-1]))
+        if tick != self.tick[-1]:
+            self.seconds.append(self.seconds[-1] + (tick - self.tick[-1]) * self.scale[-1])
+            self.tick.append(tick)
+            self.tempo.append(tempo)
+            self.scale.append(0.0)
+        self.tempo[-1] = tempo
+        self.scale[-1] = self.tick_scale(tempo)
+
+    def __len__(self):
+        return len(self.tick)
+
+    def tick_scale(self, tempo):
+        # Seconds per tick, computed the same way as mido.tick2second
+        return tempo * 1e-6 / self.ticks_per_beat
+
+    def segment(self, tick):
+        # Index of the tempo in effect at this tick
+        return bisect_right(self.tick, tick) - 1
+
+    def tempo_at(self, tick):
+        return self.tempo[self.segment(tick)]
+
+    def tick2second(self, tick):
+        i = self.segment(tick)
+        return self.seconds[i] + (tick - self.tick[i]) * self.scale[i]
+
+    def duration(self, start, end):
+        # Seconds between two ticks, start <= end
+        i = self.segment(start)
+        j = self.segment(end)
+        if i == j:
+            return (end - start) * self.scale[i]
+        return (self.seconds[j] + (end - self.tick[j]) * self.scale[j]) - \
+               (self.seconds[i] + (start - self.tick[i]) * self.scale[i])
+
+    def ticks2seconds(self, ticks):
+        # Bulk tick2second() for sorted ticks, walking the map once
+        # instead of searching it for every tick
+        result = []
+        i = 0
+        last = len(self.tick) - 1
+        for tick in ticks:
+            while i < last and self.tick[i+1] <= tick:
+                i += 1
+            result.append(self.seconds[i] + (tick - self.tick[i]) * self.scale[i])
+        return result
+
+    def durations(self, start, ticks):
+        # Bulk duration() for sorted ticks: the seconds from start to the
+        # first tick, then between each pair of consecutive ticks
+        result = []
+        i = self.segment(start)
+        last = len(self.tick) - 1
+        for tick in ticks:
+            j = i
+            while j < last and self.tick[j+1] <= tick:
+                j += 1
+            if i == j:
+                result.append((tick - start) * self.scale[i])
+            else:
+                result.append((self.seconds[j] + (tick - self.tick[j]) * self.scale[j]) -
+                              (self.seconds[i] + (start - self.tick[i]) * self.scale[i]))
+            start = tick
+            i = j
+        return result
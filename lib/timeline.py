@@ -0,0 +1,205 @@
+# Sidecar files holding the merged note timeline of a MIDI file.
+#
+# Parsing is the slowest part of a conversion, and trying another
+# transpose or machine parses the same song again. The merged stream
+# (see lib/stream.py) of all channels is therefore saved next to the
+# MIDI file, as song.mid.timeline, and later runs read it back instead
+# of the MIDI file. The file is memory mapped and the columns are used
+# in place, nothing is decoded or copied when it is loaded.
+#
+# Layout: a fixed header, then one column after the other, widest type
+# first so that every column is aligned for its type:
+#
+#     header            see header_format
+#     tick      'I'     note events, in merged order
+#     tempo_tick 'I'    tempo changes, in merged order
+#     tempo     'I'     microseconds per beat
+#     track     'H'     note events
+#     channel_mask 'H'  per track, bit N set if it plays on channel N
+#     on, note, velocity, channel  'B'  note events
+#
+# The header has the format version, the byte order of the columns and
+# the SHA-256 of the MIDI file it was made from. A sidecar that doesn't
+# match all three is rebuilt.
+
+import hashlib
+import heapq
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from .notetable import NoteTable
+from .stream import TEMPO
+
+magic = b'M2CT'
+timeline_version = 1
+byteorders = {'little': 0, 'big': 1}
+
+# magic, version, byte order, source hash, ticks per beat, tracks,
+# note events, tempo changes, padding to 8 bytes
+header_format = '<4sHH32sHHII4x'
+header_size = struct.calcsize(header_format)
+
+
+class TimelineError(Exception):
+    pass
+
+
+def sidecar_path(midi_path):
+    return os.fspath(midi_path) + '.timeline'
+
+
+class Timeline:
+    def __init__(self, ticks_per_beat=0, num_tracks=0):
+        self.ticks_per_beat = ticks_per_beat
+        self.num_tracks = num_tracks
+        self.table = NoteTable()
+        self.tempo_tick = array('I')
+        self.tempo = array('I')
+        self.channel_mask = array('H', [0] * num_tracks)
+        self.map = None
+
+    def fill(self, events):
+        # Store a merged event stream
+        for tick, kind, value, velocity, channel, track in events:
+            if kind == TEMPO:
+                self.tempo_tick.append(tick)
+                self.tempo.append(value)
+            else:
+                self.table.append(tick, kind, value, velocity, channel, track)
+                self.channel_mask[track] |= 1 << channel
+        return self
+
+    def columns(self):
+        # In file order
+        table = self.table
+        return [table.tick, self.tempo_tick, self.tempo, table.track, self.channel_mask,
+                table.on, table.note, table.velocity, table.channel]
+
+    def write(self, path, digest):
+        # Written to a temporary file first, a half written sidecar is
+        # never picked up
+        temp = "%s.%d.tmp" % (path, os.getpid())
+        with open(temp, 'wb') as f:
+            f.write(struct.pack(header_format, magic, timeline_version, byteorders[sys.byteorder],
+                                digest, self.ticks_per_beat, self.num_tracks,
+                                len(self.table), len(self.tempo)))
+            for column in self.columns():
+                f.write(column)
+        os.replace(temp, path)
+
+    def read(self, path, digest=None):
+        # Maps the sidecar at path. Raises TimelineError if it is of
+        # another version or byte order, or (when digest is given) was
+        # made from another MIDI file.
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < header_size:
+                raise TimelineError("%s is truncated" % path)
+            map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        fields = struct.unpack_from(header_format, map)
+        file_magic, version, byteorder, source_digest, ticks_per_beat, num_tracks, events, tempos = fields
+        if file_magic != magic or version != timeline_version:
+            map.close()
+            raise TimelineError("%s is not a version %d timeline" % (path, timeline_version))
+        if byteorder != byteorders[sys.byteorder]:
+            map.close()
+            raise TimelineError("%s was written with another byte order" % path)
+        if digest is not None and source_digest != digest:
+            map.close()
+            raise TimelineError("%s was made from another MIDI file" % path)
+
+        counts = [events, tempos, tempos, events, num_tracks, events, events, events, events]
+        typecodes = [column.typecode for column in self.columns()]
+        if size != header_size + sum(count * array(code).itemsize for count, code in zip(counts, typecodes)):
+            map.close()
+            raise TimelineError("%s is truncated" % path)
+
+        view = memoryview(map)
+        offset = header_size
+        columns = []
+        for count, code in zip(counts, typecodes):
+            end = offset + count * array(code).itemsize
+            columns.append(view[offset:end].cast(code))
+            offset = end
+
+        table = self.table
+        (table.tick, self.tempo_tick, self.tempo, table.track, self.channel_mask,
+         table.on, table.note, table.velocity, table.channel) = columns
+        self.views = columns + [view]
+        self.map = map
+        self.ticks_per_beat = ticks_per_beat
+        self.num_tracks = num_tracks
+        return self
+
+    def close(self):
+        # The columns of a mapped timeline are gone after this
+        map = self.map
+        if map is not None:
+            self.__init__(self.ticks_per_beat, self.num_tracks)
+            for view in self.views:
+                view.release()
+            self.views = []
+            map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def track_channels(self, channels=None):
+        # The set of channels every track plays on, limited to channels
+        wanted = 0xffff
+        if channels is not None:
+            wanted = sum(1 << channel for channel in set(channels))
+        return [{channel for channel in range(16) if mask & wanted & (1 << channel)}
+                for mask in self.channel_mask]
+
+    def events(self, channels=None):
+        # The merged event stream again, optionally only the notes on the
+        # given channels
+        table = self.table
+        notes = zip(table.tick, table.on, table.note, table.velocity, table.channel, table.track)
+        if channels is not None:
+            channels = set(channels)
+            notes = (event for event in notes if event[4] in channels)
+        tempos = ((tick, TEMPO, tempo, 0, 0, 0) for tick, tempo in zip(self.tempo_tick, self.tempo))
+        return heapq.merge(tempos, notes)
+
+
+def load_timeline(midi_path, build, log=None):
+    # The Timeline of the MIDI file at midi_path, from its sidecar if
+    # that is up to date. Otherwise build(midi_bytes) is called for
+    # (ticks_per_beat, num_tracks, merged events) and the sidecar is
+    # (re)written. If it can't be written, the timeline is used from
+    # memory.
+    with open(midi_path, 'rb') as f:
+        midi_bytes = f.read()
+    digest = hashlib.sha256(midi_bytes).digest()
+    path = sidecar_path(midi_path)
+
+    if os.path.exists(path):
+        try:
+            timeline = Timeline().read(path, digest)
+            if log is not None:
+                log("Timeline read from:\n    %s" % path)
+            return timeline
+        except TimelineError as e:
+            if log is not None:
+                log("Rebuilding timeline: %s" % e)
+
+    ticks_per_beat, num_tracks, events = build(midi_bytes)
+    timeline = Timeline(ticks_per_beat, num_tracks).fill(events)
+    try:
+        timeline.write(path, digest)
+    except OSError as e:
+        if log is not None:
+            log("Could not write timeline %s: %s" % (path, e))
+        return timeline
+    if log is not None:
+        log("Timeline written to:\n    %s" % path)
+    return timeline
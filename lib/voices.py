@@ -0,0 +1,89 @@
+# Keeps track of the notes currently sounding and hands the highest
+# ones out to the axes.
+#
+# MIDI only has 128 note numbers, so the active notes are kept as the
+# bits of one integer. Turning a note on or off is a single bit
+# operation, and the top N pitches are found by peeling the highest set
+# bits off a copy of the mask, which costs O(N) no matter how many
+# notes are held down.
+
+
+class VoiceAllocator:
+    def __init__(self):
+        self.mask = 0
+        self.count = 0
+
+        # Counters for the notes that did not make it onto an axis
+        self.unvoiced = 0          # notes left out because all axes were busy
+        self.overfull_chords = 0   # chords with at least one such note
+        self.repeated_on = 0       # note on for a note already sounding
+        self.unmatched_off = 0     # note off for a note that wasn't on
+
+    def note_on(self, note):
+        # Returns False if the note was already on
+        bit = 1 << note
+        if self.mask & bit:
+            self.repeated_on += 1
+            return False
+        self.mask |= bit
+        self.count += 1
+        return True
+
+    def note_off(self, note):
+        # Returns False if the note wasn't on
+        bit = 1 << note
+        if not self.mask & bit:
+            self.unmatched_off += 1
+            return False
+        self.mask &= ~bit
+        self.count -= 1
+        return True
+
+    def top(self, n):
+        # The n highest active notes, highest first
+        notes = []
+        mask = self.mask
+        while mask and len(notes) < n:
+            note = mask.bit_length() - 1
+            notes.append(note)
+            mask ^= 1 << note
+        return notes
+
+    def assign(self, axes):
+        # Notes for the X, Y and Z axes (-1 if silent) with the highest
+        # pitched notes on the first of the given axis indices
+        notes_xyz = [-1, -1, -1]
+        for axis, note in zip(axes, self.top(len(axes))):
+            notes_xyz[axis] = note
+        if self.count > len(axes):
+            self.unvoiced += self.count - len(axes)
+            self.overfull_chords += 1
+        return notes_xyz
+
+    # The active_notes dict used to map every note to itself, keep
+    # that interface working
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, note):
+        return bool(self.mask & (1 << note))
+
+    def __iter__(self):
+        # Active notes, lowest first
+        mask = self.mask
+        while mask:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask ^= low
+
+    def __setitem__(self, note, value):
+        self.note_on(note)
+
+    def pop(self, note):
+        if not self.note_off(note):
+            raise KeyError(note)
+        return note
+
+    def values(self):
+        return list(self)
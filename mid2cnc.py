@@ -37,743 +37,988 @@ import argparse
 
 import sys
 import os.path
-import math
+import json
+import time
 
-# Import the MIDI parser code from the subdirectory './lib'
-import lib.midiparser as midiparser
-import mido
+# Only the machine profiles are needed to build the command line. The
+# rest of './lib' (and mido, NumPy and the like through it) is imported
+# by the functions below on the code path that uses it, so that -h,
+# -info or a short conversion don't wait for what they never run.
+from lib.machines import machines_dict, units_dict, rate_dict, axes_dict
 
-active_axes = 3
+suppress_comments = 0 # Set to 1 if your machine controller does not handle ( comments )
 
-# Specifications for some machines (Need verification!)
-#
-machines_dict = dict( {
-        'cupcake':[
-            'metric',                # Units scheme
-            11.767, 11.767, 320.000, # Pulses per unit for X, Y, Z axes
-            -20.000, -20.000, 0.000, # Safe envelope minimum for X, Y, Z
-            20.000, 20.000, 10.000,  # Safe envelope maximum for X, Y, Z
-            'XYZ'                    # Default axes and the order for playing
-        ],      
-
-        'thingomatic':[
-            'metric',
-            47.069852, 47.069852, 200.0,
-            -20.000, -20.000, 0.000,
-            20.000, 20.000, 10.000,
-            'XYZ'
-        ],
-
-        'shapercube':[
-            'metric',
-            10.0, 10.0, 320.0,
-            0.000, 0.000, 0.000,
-            10.000, 10.000, 10.000,
-            'XYZ'
-        ],
-
-        'ultimaker':[
-            'metric',
-            47.069852, 47.069852, 160.0,
-            0.000, 0.000, 0.000,
-            10.000, 10.000, 10.000,
-            'XYZ'
-        ],
-
-        'multicam_custom':[
-            'metric',
-            228.0, 228.0, 393.700775,
-            0.000, 0.000, 0.000,
-            120.000, 120.000, 20.000,
-            'ZYX'
-        ],
-
-        'custom':[
-            'metric',
-            10.0, 10.0, 10.0,
-            0.000, 0.000, 0.000,
-            10.000, 10.000, 10.000,
-            'X'
-        ]
-    })
-
-# Specifications for the systems of units we know about
-#
-units_dict = dict( {
-        # 'scheme':'units', 'abbreviation', scale_to_mm]
-        'metric':[
-            'millimetre', 'mm', 1.0
-        ],
-        'imperial':[
-            'inch', 'in', 25.4
-        ]
-    })
-# Specifications for the systems of units we know about
-#
-rate_dict = dict( {
-        # 'scheme':'units', 'abbreviation', feed_rate_factor]
-        'minutes':[
-            'minute', 'm', 60.0
-        ],
-        'seconds':[
-            'second', 's', 1.0
-        ]
-    })
-
-# A way to specify any mix of axes in the order you want to voice them
-#
-axes_dict = dict( {
-          'X':[0],       'Y':[1],       'Z':[2],
-         'XY':[0,1],    'YX':[1,0],    'XZ':[0,2],
-         'ZX':[2,0],    'YZ':[1,2],    'ZY':[2,1],
-        'XYZ':[0,1,2], 'XZY':[0,2,1],
-        'YXZ':[1,0,2], 'YZX':[1,2,0],
-        'ZXY':[2,0,1], 'ZYX':[2,1,0]
-    })
-
-def reached_limit(current, distance, direction, min, max):
-    # Returns true if the proposed movement will exceed the
-    # safe working limits of the machine but the movement is
-    # allowable in the reverse direction
-    #
-    # Returns false if the movement is allowable in the
-    # current direction
-    # 
-    # Aborts if the movement is not possible in either direction
-
-    if ( ( (current + (distance * direction)) < max ) and 
-         ( (current + (distance * direction)) > min ) ):
-        # Movement in the current direction is within safe limits,
-        return False
-
-    elif ( ( (current + (distance * direction)) >= max ) and 
-           ( (current - (distance * direction)) >  min ) ):
-        # Movement in the current direction violates maximum safe
-        # value, but would be safe if the direction is reversed
-        return True
-
-    elif ( ( (current + (distance * direction)) <= min ) and 
-           ( (current - (distance * direction)) <  max ) ):
-        # Movement in the current direction violates minimum safe
-        # value, but would be safe if the direction is reversed
-        return True
+# Only read when a conversion goes ahead without -infile, so that -batch,
+# -stream and the daemon run from any directory
+default_infile = './midi_files/Super_Mario_Brothers_nodrums.mid'
+
+def print_info(filename):
+    # Answer from the chunk index alone, no track gets decoded here
+    import lib.midiparser as midiparser
+
+    with midiparser.File(filename) as midi:
+        print("MIDI file:\n    %s" % os.path.basename(filename))
+        print("Format:\n    %d" % midi.format)
+        print("Number of tracks:\n    %d" % midi.num_tracks)
+        print("Timing division:\n    %d" % midi.division)
+        print("Track sizes:")
+        for number, size in enumerate(midi.track_sizes(), 1):
+            print("    Track %d: %d bytes" % (number, size))
+
+def print_parity(filename, channels):
+    # Returns 0 if all parsers agree
+    from lib.parsers import check_parity
+
+    print("MIDI file:\n    %s" % os.path.basename(filename))
+    differ = 0
+    for parser, result in check_parity(filename, channels).items():
+        if result['status'] == 'ok':
+            print("%-12s ok, %d events" % (parser, result['events']))
+        elif result['status'] == 'different':
+            differ = 1
+            print("%-12s DIFFERENT at event %d:" % (parser, result['first_difference']))
+            print("    mido: %s" % (result['mido'],))
+            print("    %s: %s" % (parser, result[parser]))
+        elif result['status'] == 'failed':
+            print("%-12s failed: %s" % (parser, result['error']))
+        else:
+            print("%-12s not installed" % parser)
+    return differ
 
-    else:
-        # Movement in *either* direction violates the safe working
-        # envelope, so abort.
-        # 
-        print("\n*** ERROR ***")
-        print("The current movement cannot be completed within the safe working envelope of")
-        print("your machine. Turn on the --verbose option to see which MIDI data caused the")
-        print("problem and adjust the MIDI file (or your safety limits if you are confident")
-        print("you can do that safely). Aborting.")
-        exit(2);
-    
 ######################################
 # Start of command line parsing code #
 ######################################
 
-parser = argparse.ArgumentParser(description='Utility to process a Standard MIDI File (*.SMF/*.mid) to "play" it on up to 3 axes of a CNC machine.')
-
-# Show the default values for each argument where available
-#
-parser.formatter_class = argparse.ArgumentDefaultsHelpFormatter
-
-input=parser.add_argument_group('Input settings')
-
-input.add_argument(
-    '-infile', '--infile',
-    default = './midi_files/Super_Mario_Brothers_nodrums.mid',
-    nargs   = '?',
-    type    = argparse.FileType('r'),
-    help    = 'the input MIDI filename'
-)
-
-input.add_argument(
-    '-channels', '--channels',
-    default = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15],
-    nargs   = '+',
-    type    = int,
-    choices = range(0,16),
-    metavar = 'N',
-    help    = 'list of MIDI channels you want to scan for event data'
-)
-
-input.add_argument(
-    '-outfile', '--outfile',
-    default = './gcode_files/output.gcode',
-    nargs   = '?',
-    type    = argparse.FileType('w'),
-    help    = 'the output Gcode filename'
-)
-
-machines = parser.add_argument_group('Machine settings')
-
-machines.add_argument(
-    '-machine', '--machine',
-    default = 'multicam_custom',
-    choices = sorted(machines_dict),
-    help    = 'sets everything up appropriately for predefined machines, or flags use of custom settings.'
-)
-
-custom = parser.add_argument_group('Customised settings')
-
-custom.add_argument(
-    '-units', '--units',
-    default = 'metric',
-    choices = sorted(units_dict),
-    help    = 'set the measurement and feed rate units to your preferred scheme.'
-)
-
-custom.add_argument(
-    '-ppu', '--ppu',
-    metavar = ('XXX.XX', 'YYY.YY', 'ZZZ.ZZ'),
-    nargs   = 3,
-    type    = float,
-    help    = 'set arbitrary pulses-per-unit (ppu) for each of the X, Y and Z axes'
-)
-
-custom.add_argument(
-    '-safemin', '--safemin',
-    metavar = ('XXX.XX', 'YYY.YY', 'ZZZ.ZZ'),
-    nargs   = 3,
-    type    = float,
-    help    = 'set minimum edge of the safe envelope for each of the X, Y and Z axes'
-)
-
-custom.add_argument(
-    '-safemax', '--safemax',
-    metavar = ('XXX.XX', 'YYY.YY', 'ZZZ.ZZ'),
-    nargs   = 3,
-    type    = float,
-    help    = 'set maximum edge of the safe envelope for each of the X, Y and Z axes'
-)
-
-custom.add_argument(
-    '-prefix', '--prefix',
-    metavar = 'PRE_FILE',
-    nargs   = '?',
-    type    = argparse.FileType('r'),
-    help    = 'A file containing Gcode to set your machine to a known state before the MIDI is played e.g. homing the axes if supported or required.'
-)
-
-custom.add_argument(
-    '-postfix', '--postfix',
-    metavar = 'POST_FILE',
-    nargs   = '?',
-    type    = argparse.FileType('r'),
-    help    = 'A file containing Gcode to return your machine to a known state after the MIDI is played e.g. homing the axes if supported or required.'
-)
-
-output=parser.add_argument_group('Output settings')
-
-output.add_argument(
-    '-axes', '--axes',
-    default = 'XYZ',
-    choices = sorted(axes_dict),
-    metavar = 'XYZ',
-    help    = 'ordered list of the axes you wish to "play" the MIDI data on. e.g. "X", "ZY", "YZX"'
-)
-
-output.add_argument(
-    '-feedrate', '--feedrate',
-    metavar = ('Nx', 'Ny', 'Nz'),
-    default = 'seconds',
-    choices = sorted(rate_dict),
-    help    = "Set weather to output feedrate in unit pr second or unit pr minute"
-)
-
-output.add_argument(
-    '-transpose', '--transpose',
-    metavar = ('Nx', 'Ny', 'Nz'),
-    default = ('0', '0', '0'),
-    nargs   = 3,
-    type    = float,
-    help    = 'Transpose each axis N notes up/down, e.g. "12 0 0" will transpose the X axis one octave up the scale.'
-)
-
-
-output.add_argument(
-    '-verbose', '--verbose',
-    default = False,
-    action  = 'store_true',
-    help    = 'print verbose output to the terminal')
-
-args = parser.parse_args()
-
-# Get the chosen measurement scheme and the machine definition from the
-# dictionaries defined above
-#
-scheme   =    units_dict.get( args.units   )
-feedrate   =   rate_dict.get( args.feedrate   )
-settings = machines_dict.get( args.machine )
-feedrate_factor = feedrate[2]
-
-# Check defaults and scaling of inputs
-#
-if args.ppu == None:
-    # No manual setting of the axis scaling
-    # 'scheme':'units', 'abbreviation', scale_to_mm]
-    args.ppu    = [ 0, 0, 0 ]
-    args.ppu[0] = ( settings[1] * scheme[2] )
-    args.ppu[1] = ( settings[2] * scheme[2] )
-    args.ppu[2] = ( settings[3] * scheme[2] )
-
-if args.safemin == None:
-    # No manual setting of the minimum safe edges
-    # 'machine':[units, xppu, yppu, zppu, xmin, ymin, zmin, xmax, ymax, zmax, axes]
-    args.safemin    = [ 0, 0, 0 ]
-    args.safemin[0] = ( settings[4] / scheme[2] )
-    args.safemin[1] = ( settings[5] / scheme[2] )
-    args.safemin[2] = ( settings[6] / scheme[2] )
-
-if args.safemax == None:
-    # No manual setting of the maximum safe edges
-    args.safemax    = [ 0, 0, 0 ]
-    args.safemax[0] = ( settings[7] / scheme[2] )
-    args.safemax[1] = ( settings[8] / scheme[2] )
-    args.safemax[2] = ( settings[9] / scheme[2] )
-
-if os.path.getsize(args.infile.name) == 0:
-    msg="Input file %s is empty! Aborting." % os.path.basename(args.infile.name)
-    raise argparse.ArgumentTypeError(msg)
-
-print("MIDI input file:\n    %s" % args.infile.name)
-print("Gcode output file:\n     %s" % args.outfile.name)
-
-# Default is Cupcake, so check the others first
-
-if args.machine == 'shapercube':
-    print("Machine type:\n    Shapercube")
-elif args.machine == 'ultimaker':
-    print("Machine type:\n    Ultimaker")
-elif args.machine == 'thingomatic':
-    print("Machine type:\n    Makerbot Thing-O-Matic")
-elif args.machine == 'custom':
-    print("Machine type:\n    Bespoke machine")
-elif args.machine == 'cupcake':
-    print("Machine type:\n    Makerbot Cupcake CNC")
-
-if args.axes != 'XYZ':
-   active_axes = len(args.axes)
-
-# Default is metric, so check the non-default case first
-print("Units and Feed rates:\n    %s and %s/minute" % ( scheme[0], scheme[1] ))
-print("Minimum safe limits [X, Y, Z]:\n    [%.3f, %.3f, %.3f]" % (args.safemin[0], args.safemin[1], args.safemin[2]))
-print("Maximum safe limits [X, Y, Z]:\n    [%.3f, %.3f, %.3f]" % (args.safemax[0], args.safemax[1], args.safemax[2]))
-
-print("Pulses per %s [X, Y, Z] axis:\n    [%.3f, %.3f, %.3f]" % (scheme[0], args.ppu[0], args.ppu[1], args.ppu[2]))
-
-if active_axes > 1:
-    print("Generate Gcode for:\n    %d axes in the order %s" % (active_axes, args.axes))
-else:
-    print("Generate Gcode for:\n    %s axis only" % args.axes)
-
-# Set up an array to allow processing inside the loop to take account of the
-# difference in feed rates required on each axis
-
-suppress_comments = 0 # Set to 1 if your machine controller does not handle ( comments )
+def build_parser():
+    parser = argparse.ArgumentParser(description='Utility to process a Standard MIDI File (*.SMF/*.mid) to "play" it on up to 3 axes of a CNC machine.')
 
-tempo=None # should be set by your MIDI...
+    # Show the default values for each argument where available
+    #
+    parser.formatter_class = argparse.ArgumentDefaultsHelpFormatter
+
+    input=parser.add_argument_group('Input settings')
+
+    input.add_argument(
+        '-infile', '--infile',
+        nargs   = '?',
+        help    = 'the input MIDI filename (%s if none is given)' % default_infile
+    )
+
+    input.add_argument(
+        '-channels', '--channels',
+        default = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15],
+        nargs   = '+',
+        type    = int,
+        choices = range(0,16),
+        metavar = 'N',
+        help    = 'list of MIDI channels you want to scan for event data'
+    )
+
+    input.add_argument(
+        '-outfile', '--outfile',
+        default = './gcode_files/output.gcode',
+        nargs   = '?',
+        help    = 'the output Gcode filename'
+    )
+
+    input.add_argument(
+        '-parser', '--parser',
+        default = 'auto',
+        # The names in lib.parsers.parsers, without importing it for -h
+        choices = ['auto', 'midicludge', 'midiparser', 'mido'],
+        help    = 'MIDI parser to read the input with. auto uses the fast lib/midiparser.py and falls back on mido (or python-midi for midicludge) for any file it cannot read to the end'
+    )
+
+    input.add_argument(
+        '-parity', '--parity',
+        default = False,
+        action  = 'store_true',
+        help    = 'check that every available MIDI parser reads the same notes from the input file, then exit'
+    )
+
+    input.add_argument(
+        '-sidecar', '--sidecar',
+        default = False,
+        action  = 'store_true',
+        help    = 'save the parsed notes next to the input as INFILE.timeline, and read them from there on later runs as long as the MIDI file is unchanged'
+    )
+
+    input.add_argument(
+        '-info', '--info',
+        default = False,
+        action  = 'store_true',
+        help    = 'only print the format, track count, division and track sizes of the input MIDI file, then exit'
+    )
+
+    input.add_argument(
+        '-tune', '--tune',
+        default = False,
+        action  = 'store_true',
+        help    = 'keep the song in memory after converting it, and read more settings to try from the terminal, one set per line (e.g. "-transpose 12 0 0 -axes XY"), converting again after each with only what they change redone'
+    )
+
+    input.add_argument(
+        '-stream', '--stream',
+        metavar = 'FIFO',
+        nargs   = '?',
+        const   = '-',
+        help    = 'instead of -infile, read MIDI events as they come in from this named pipe, or from the standard input if none is given, and write every move as soon as the note event that ends it arrives. The events are those of a MIDI file track: a delta time in ticks, then the message. Use -outfile - for the standard output'
+    )
+
+    input.add_argument(
+        '-division', '--division',
+        metavar = 'TICKS',
+        type    = int,
+        default = 480,
+        help    = 'ticks per beat of the -stream delta times'
+    )
+
+    machines = parser.add_argument_group('Machine settings')
+
+    machines.add_argument(
+        '-machine', '--machine',
+        default = 'multicam_custom',
+        choices = sorted(machines_dict),
+        help    = 'sets everything up appropriately for predefined machines, or flags use of custom settings.'
+    )
+
+    custom = parser.add_argument_group('Customised settings')
+
+    custom.add_argument(
+        '-units', '--units',
+        default = 'metric',
+        choices = sorted(units_dict),
+        help    = 'set the measurement and feed rate units to your preferred scheme.'
+    )
+
+    custom.add_argument(
+        '-ppu', '--ppu',
+        metavar = ('XXX.XX', 'YYY.YY', 'ZZZ.ZZ'),
+        nargs   = 3,
+        type    = float,
+        help    = 'set arbitrary pulses-per-unit (ppu) for each of the X, Y and Z axes'
+    )
+
+    custom.add_argument(
+        '-safemin', '--safemin',
+        metavar = ('XXX.XX', 'YYY.YY', 'ZZZ.ZZ'),
+        nargs   = 3,
+        type    = float,
+        help    = 'set minimum edge of the safe envelope for each of the X, Y and Z axes'
+    )
+
+    custom.add_argument(
+        '-safemax', '--safemax',
+        metavar = ('XXX.XX', 'YYY.YY', 'ZZZ.ZZ'),
+        nargs   = 3,
+        type    = float,
+        help    = 'set maximum edge of the safe envelope for each of the X, Y and Z axes'
+    )
+
+    custom.add_argument(
+        '-prefix', '--prefix',
+        metavar = 'PRE_FILE',
+        nargs   = '?',
+        type    = argparse.FileType('r'),
+        help    = 'A file containing Gcode to set your machine to a known state before the MIDI is played e.g. homing the axes if supported or required.'
+    )
+
+    custom.add_argument(
+        '-postfix', '--postfix',
+        metavar = 'POST_FILE',
+        nargs   = '?',
+        type    = argparse.FileType('r'),
+        help    = 'A file containing Gcode to return your machine to a known state after the MIDI is played e.g. homing the axes if supported or required.'
+    )
+
+    output=parser.add_argument_group('Output settings')
+
+    output.add_argument(
+        '-axes', '--axes',
+        default = 'XYZ',
+        choices = sorted(axes_dict),
+        metavar = 'XYZ',
+        help    = 'ordered list of the axes you wish to "play" the MIDI data on. e.g. "X", "ZY", "YZX"'
+    )
+
+    output.add_argument(
+        '-feedrate', '--feedrate',
+        default = 'seconds',
+        choices = sorted(rate_dict),
+        help    = "Set weather to output feedrate in unit pr second or unit pr minute"
+    )
+
+    output.add_argument(
+        '-transpose', '--transpose',
+        metavar = ('Nx', 'Ny', 'Nz'),
+        default = ('0', '0', '0'),
+        nargs   = 3,
+        type    = float,
+        help    = 'Transpose each axis N notes up/down, e.g. "12 0 0" will transpose the X axis one octave up the scale.'
+    )
+
+
+    output.add_argument(
+        '-positions', '--positions',
+        default = 'reverse',
+        choices = ['fold', 'reverse'],
+        help    = 'keep the axes inside the safe envelope by turning them around before a move would cross its edge, or by bouncing them off the edges (fold), which splits a move where it hits one. Either way the whole song is checked before anything is written, but for -stream, which plays a song as it comes and stops at the first move that does not fit'
+    )
+
+    output.add_argument(
+        '-precision', '--precision',
+        metavar = 'N',
+        type    = int,
+        help    = 'number of decimals for the axis positions and feed rate, instead of what the pulses-per-unit of each axis can resolve'
+    )
+
+    output.add_argument(
+        '-engine', '--engine',
+        default = 'python',
+        choices = ['numpy', 'python'],
+        help    = 'compute frequencies, feed rates and distances in plain Python, or for the whole song at once with NumPy (which must be installed)'
+    )
+
+    output.add_argument(
+        '-nocompact', '--nocompact',
+        default = False,
+        action  = 'store_true',
+        help    = 'write every move and rest as computed, instead of leaving out the ones that go nowhere and merging rests and moves that carry straight on'
+    )
+
+    output.add_argument(
+        '-modal', '--modal',
+        dest    = 'modal',
+        default = None,
+        action  = 'store_const',
+        const   = True,
+        help    = 'leave out G01 and the X, Y, Z and F words that are still in effect from the line before, for controllers that keep the modal state (default: as the machine profile says)'
+    )
+
+    output.add_argument(
+        '-nomodal', '--nomodal',
+        dest    = 'modal',
+        action  = 'store_const',
+        const   = False,
+        help    = 'write every move in full, even if the machine profile defaults to -modal'
+    )
+
+    output.add_argument(
+        '-verbose', '--verbose',
+        default = False,
+        action  = 'store_true',
+        help    = 'print verbose output to the terminal')
+
+    batch=parser.add_argument_group('Batch settings')
+
+    batch.add_argument(
+        '-batch', '--batch',
+        metavar = 'DIR_OR_GLOB',
+        help    = 'convert every MIDI file in a directory, or matching a pattern such as "midi_files/*.mid", instead of -infile'
+    )
+
+    batch.add_argument(
+        '-machines', '--machines',
+        nargs   = '+',
+        choices = sorted(machines_dict),
+        metavar = 'MACHINE',
+        help    = 'machines to convert every batch file for (default: the -machine setting)'
+    )
+
+    batch.add_argument(
+        '-outdir', '--outdir',
+        default = './gcode_files',
+        help    = 'directory for the Gcode files of a batch, named after the MIDI files (and the machine, if there are several)'
+    )
+
+    batch.add_argument(
+        '-jobs', '--jobs',
+        metavar = 'N',
+        type    = int,
+        help    = 'number of batch conversions to run in parallel, or of worker processes of the -serve daemon (default: one per CPU)'
+    )
+
+    batch.add_argument(
+        '-report', '--report',
+        metavar = 'REPORT_FILE',
+        help    = 'write the status and timing of every batch conversion to this file as JSON'
+    )
+
+    cache=parser.add_argument_group('Cache settings')
+
+    cache.add_argument(
+        '-cache', '--cache',
+        metavar = 'CACHE_DIR',
+        help    = 'keep every converted Gcode file in this directory, and reuse it when the same MIDI file is converted again with the same settings'
+    )
+
+    cache.add_argument(
+        '-cachesize', '--cachesize',
+        metavar = 'MB',
+        default = 256,
+        type    = float,
+        help    = 'size limit of the cache, the least recently used conversions are removed beyond it'
+    )
+
+    cache.add_argument(
+        '-cachestats', '--cachestats',
+        default = False,
+        action  = 'store_true',
+        help    = 'print the number of entries, size, hits and misses of the -cache directory, then exit'
+    )
+
+    profile=parser.add_argument_group('Profiling settings')
+
+    profile.add_argument(
+        '-profile', '--profile',
+        metavar = 'REPORT_FILE',
+        nargs   = '?',
+        const   = '-',
+        help    = 'record the wall time, CPU time and item count of every stage of the conversion (parsing, events, merge, voices, moves, gcode and write) and write them as JSON to this file, or to the terminal if no file is given'
+    )
+
+    profile.add_argument(
+        '-cprofile', '--cprofile',
+        metavar = 'STATS_FILE',
+        help    = 'run the conversion under cProfile and dump its statistics to this file, e.g. for "python -m pstats STATS_FILE"'
+    )
+
+    playback=parser.add_argument_group('Playback settings')
+
+    playback.add_argument(
+        '-drift', '--drift',
+        metavar = 'GCODE_FILE',
+        nargs   = '?',
+        const   = '-',
+        help    = 'work out how long every move and dwell of GCODE_FILE takes to play (converted from -infile with the same settings), or of the conversion of -infile in memory if no file is given, and report per bar how far it drifts from the timing of the MIDI file, then exit'
+    )
+
+    playback.add_argument(
+        '-beats', '--beats',
+        metavar = 'N',
+        type    = int,
+        default = 4,
+        help    = 'number of beats per bar for -drift'
+    )
+
+    playback.add_argument(
+        '-dwellunits', '--dwellunits',
+        default = 'seconds',
+        choices = ['milliseconds', 'seconds'],
+        help    = 'how the controller reads the P word of G04 for -drift: seconds (GRBL, LinuxCNC) or milliseconds (Marlin)'
+    )
+
+    playback.add_argument(
+        '-driftreport', '--driftreport',
+        metavar = 'REPORT_FILE',
+        help    = 'also write the -drift results to this file as JSON'
+    )
+
+    playback.add_argument(
+        '-preview', '--preview',
+        metavar = 'WAV_FILE',
+        help    = 'render the conversion of -infile as the sound of the steppers into this WAV file, instead of writing -outfile (needs NumPy)'
+    )
+
+    playback.add_argument(
+        '-samplerate', '--samplerate',
+        metavar = 'HZ',
+        type    = int,
+        default = 44100,
+        help    = 'sample rate of the -preview WAV file'
+    )
+
+    stream=parser.add_argument_group('Streaming settings')
+
+    stream.add_argument(
+        '-port', '--port',
+        metavar = 'DEVICE',
+        help    = 'stream the Gcode to a GRBL-style controller on this serial device while it is generated, instead of writing -outfile'
+    )
+
+    stream.add_argument(
+        '-baud', '--baud',
+        type    = int,
+        default = 115200,
+        help    = 'baud rate of the -port serial device'
+    )
+
+    stream.add_argument(
+        '-rxbuffer', '--rxbuffer',
+        metavar = 'BYTES',
+        type    = int,
+        default = 128,
+        help    = 'size of the receive buffer of the controller. The sender keeps at most one character less than this of unanswered lines in it, all that the ring buffer of GRBL holds'
+    )
+
+    stream.add_argument(
+        '-simulate', '--simulate',
+        default = False,
+        action  = 'store_true',
+        help    = 'stream to a simulated GRBL controller on a pseudo-terminal instead of -port, and report its receive buffer overflows and planner underruns'
+    )
+
+    stream.add_argument(
+        '-simspeed', '--simspeed',
+        metavar = 'FACTOR',
+        type    = float,
+        default = 1.0,
+        help    = 'let the simulated controller play this many times faster than the song, e.g. to benchmark the sender'
+    )
+
+    stream.add_argument(
+        '-simlatency', '--simlatency',
+        metavar = 'MS',
+        type    = float,
+        default = 0.0,
+        help    = 'delay every answer of the simulated controller by this many milliseconds, like a USB serial link would'
+    )
+
+    daemon=parser.add_argument_group('Daemon settings')
+
+    daemon.add_argument(
+        '-serve', '--serve',
+        metavar = 'SOCKET',
+        help    = 'run as a conversion daemon on this Unix socket, with -jobs worker processes, until interrupted'
+    )
+
+    daemon.add_argument(
+        '-queue', '--queue',
+        metavar = 'N',
+        type    = int,
+        default = 16,
+        help    = 'number of conversions that may wait for a free worker of the -serve daemon, it turns down any more as busy'
+    )
+
+    daemon.add_argument(
+        '-request', '--request',
+        metavar = 'SOCKET',
+        help    = 'have the daemon on this Unix socket convert -infile with these settings into -outfile'
+    )
+
+    daemon.add_argument(
+        '-health', '--health',
+        metavar = 'SOCKET',
+        help    = 'print the health and statistics of the daemon on this Unix socket, then exit'
+    )
+
+    return parser
+
+def print_settings(args, options):
+    scheme = units_dict.get(options.units)
+    active_axes = len(options.axes)
+
+    print("MIDI input file:\n    %s" % args.infile)
+    print("Gcode output file:\n     %s" % args.outfile)
+
+    # Default is Cupcake, so check the others first
+
+    if args.machine == 'shapercube':
+        print("Machine type:\n    Shapercube")
+    elif args.machine == 'ultimaker':
+        print("Machine type:\n    Ultimaker")
+    elif args.machine == 'thingomatic':
+        print("Machine type:\n    Makerbot Thing-O-Matic")
+    elif args.machine == 'custom':
+        print("Machine type:\n    Bespoke machine")
+    elif args.machine == 'cupcake':
+        print("Machine type:\n    Makerbot Cupcake CNC")
+
+    # Default is metric, so check the non-default case first
+    print("Units and Feed rates:\n    %s and %s/minute" % ( scheme[0], scheme[1] ))
+    print("Minimum safe limits [X, Y, Z]:\n    [%.3f, %.3f, %.3f]" % (options.safemin[0], options.safemin[1], options.safemin[2]))
+    print("Maximum safe limits [X, Y, Z]:\n    [%.3f, %.3f, %.3f]" % (options.safemax[0], options.safemax[1], options.safemax[2]))
+
+    print("Pulses per %s [X, Y, Z] axis:\n    [%.3f, %.3f, %.3f]" % (scheme[0], options.ppu[0], options.ppu[1], options.ppu[2]))
+
+    if active_axes > 1:
+        print("Generate Gcode for:\n    %d axes in the order %s" % (active_axes, options.axes))
+    else:
+        print("Generate Gcode for:\n    %s axis only" % options.axes)
+
+    if options.modal:
+        print("Modal Gcode:\n    G01, X, Y, Z and F only where they change")
+
+def cache_bytes(args):
+    return int(args.cachesize * 1024 * 1024)
+
+def print_cache_stats(args):
+    from lib.cache import ConversionCache
+
+    stats = ConversionCache(args.cache, cache_bytes(args)).stats()
+    print("Cache directory:\n    %s" % stats['directory'])
+    print("Entries:\n    %d" % stats['entries'])
+    print("Size:\n    %.1f of %.1f MB" % (stats['size'] / 1048576.0, stats['max_size'] / 1048576.0))
+    print("Hits / misses / evictions:\n    %d / %d / %d" % (stats['hits'], stats['misses'], stats['evictions']))
+
+def batch_main(args):
+    from lib.batch import find_inputs, batch_jobs, run_batch
+    from lib.converter import option_defaults, read_lines
+
+    # The same settings for every file, only the machine profile differs
+    options = {name: getattr(args, name) for name in option_defaults if hasattr(args, name)}
+    options['comments'] = suppress_comments == 0
+    options['compact'] = not args.nocompact
+    options['prefix'] = read_lines(args.prefix)
+    options['postfix'] = read_lines(args.postfix)
+
+    inputs = find_inputs(args.batch)
+    machines = args.machines or [args.machine]
+    if not inputs:
+        print("No MIDI files found for %s" % args.batch)
+        return 1
+    os.makedirs(args.outdir, exist_ok=True)
+    jobs = batch_jobs(inputs, machines, args.outdir)
+    print("Converting %d MIDI files for %d machines into %s" % (len(inputs), len(machines), args.outdir))
+
+    records = []
+    for record in run_batch(jobs, options, args.jobs, args.cache, cache_bytes(args)):
+        records.append(record)
+        if record['status'] == 'ok' and record['cached']:
+            print("cached  %8.3fs  %s (%s) -> %s" % (record['wall'], record['input'], record['machine'], record['output']))
+        elif record['status'] == 'ok':
+            print("ok      %8.3fs  %s (%s) -> %s" % (record['wall'], record['input'], record['machine'], record['output']))
+        else:
+            print("FAILED  %8.3fs  %s (%s): %s" % (record['wall'], record['input'], record['machine'], record['error']))
+
+    failed = len([record for record in records if record['status'] != 'ok'])
+    print("%d of %d conversions succeeded" % (len(records) - failed, len(records)))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(records, f, indent=4)
+
+    return 1 if failed else 0
+
+def write_profile(args, profiler):
+    report = profiler.report()
+    report['input'] = args.infile
+    report['machine'] = args.machine
+    if args.profile == '-':
+        print("Stage timings:")
+        print(json.dumps(report, indent=4))
+    else:
+        with open(args.profile, 'w') as f:
+            json.dump(report, f, indent=4)
+        print("Stage timings written to:\n    %s" % args.profile)
+
+def write_output(args, options, profiler):
+    from lib.cache import ConversionCache, convert_cached
+    from lib.converter import convert, EnvelopeError
+    from lib.gcodewriter import GCodeWriter
+    from lib.parsers import ParseError
+    from lib.profiler import no_profiler
+
+    timer = profiler or no_profiler
+    if args.cache:
+        cache = ConversionCache(args.cache, cache_bytes(args))
+        lines = convert_cached(cache, args.infile, args.machine, options, log=print, profiler=profiler)
+    else:
+        lines = convert(args.infile, args.machine, options, log=print, profiler=profiler)
+    # The Gcode goes to a temporary file that only replaces -outfile once
+    # the whole song is converted, so a conversion that stops halfway
+    # leaves the old file as it was. Devices and pipes are written to
+    # directly.
+    if os.path.exists(args.outfile) and not os.path.isfile(args.outfile):
+        path = args.outfile
+    else:
+        path = "%s.%d.tmp" % (args.outfile, os.getpid())
+    try:
+        with timer.timed('write'):
+            with open(path, 'w') as outfile:
+                writer = GCodeWriter(outfile, options.ppu, options.precision)
+                writer.write_lines(lines)
+                writer.flush()
+            if path != args.outfile:
+                os.replace(path, args.outfile)
+        timer.count('write', writer.lines)
+    except ParseError as e:
+        print("\n*** ERROR *** Cannot read %s (%s), nothing was written" % (args.infile, e))
+        return 1
+    except EnvelopeError as e:
+        # The whole song is checked before the first line comes out
+        print("\n*** ERROR ***")
+        print(e)
+        print("Adjust the MIDI file (or your safety limits if you are confident you can do")
+        print("that safely). Nothing was written.")
+        return 2
+    finally:
+        if path != args.outfile and os.path.exists(path):
+            os.remove(path)
+    return 0
+
+def print_drift(args, options):
+    from lib.playback import drift
+
+    dwell_factor = 0.001 if args.dwellunits == 'milliseconds' else 1.0
+    if args.drift == '-':
+        report = drift(args.infile, args.machine, options, beats_per_bar=args.beats, dwell_factor=dwell_factor)
+    else:
+        with open(args.drift) as f:
+            report = drift(args.infile, args.machine, options, f, args.beats, dwell_factor)
+    report['input'] = args.infile
+    report['gcode'] = None if args.drift == '-' else args.drift
+
+    print("Bar       Time      Drift   Max drift")
+    for bar in report['bars']:
+        print("%5d %8.3f s %+8.2f ms %+8.2f ms" % (bar['bar'], bar['time'], bar['drift'] * 1000.0, bar['max_drift'] * 1000.0))
+    print("MIDI / Gcode playing time:\n    %.3f / %.3f s" % (report['midi_length'], report['gcode_length']))
+    print("Drift at the end / largest drift:\n    %+.2f / %+.2f ms" % (report['final_drift'] * 1000.0, report['max_drift'] * 1000.0))
+    print("Matched runs of notes and rests:\n    %d of %d (%d in the Gcode)" % (report['matched'], report['runs'], report['gcode_runs']))
+    if args.driftreport:
+        with open(args.driftreport, 'w') as f:
+            json.dump(report, f, indent=4)
+        print("Drift report written to:\n    %s" % args.driftreport)
+    return 0
+
+def write_preview(args, options):
+    # The moves are read back from the Gcode, so the preview plays
+    # exactly what the machine would
+    from lib.converter import convert, EnvelopeError
+    from lib.preview import segments, write_wav, frequency_range
+
+    started = time.perf_counter()
+    try:
+        lines = convert(args.infile, args.machine, options, log=print)
+        durations, freq = segments(lines, options.ppu, rate_dict.get(options.feedrate)[2])
+        length = write_wav(args.preview, durations, freq, args.samplerate)
+    except EnvelopeError as e:
+        print("\n*** ERROR ***")
+        print(e)
+        print("No preview was written.")
+        return 2
+    except ImportError:
+        print("-preview needs NumPy, install it with: pip install numpy")
+        return 1
+    print("Preview written to:\n    %s" % args.preview)
+    print("Length:\n    %.3f s, rendered in %.3f s" % (length, time.perf_counter() - started))
+    for j, steps in enumerate(frequency_range(freq)):
+        if steps is not None:
+            print("%s axis step frequencies:\n    %.1f to %.1f Hz" % ('XYZ'[j], steps[0], steps[1]))
+    return 0
+
+def print_stream_stats(stats):
+    print("Streamed lines / bytes:\n    %d / %d in %.3f s" % (stats['lines'], stats['bytes'], stats['time']))
+    print("Answer latency mean / max:\n    %.2f / %.2f ms" % (stats['latency_mean'] * 1000.0, stats['latency_max'] * 1000.0))
+    print("Sender underruns:\n    %d" % stats['underruns'])
+    if stats['dwell_drains']:
+        print("Planner drained by dwells:\n    %d" % stats['dwell_drains'])
+    if stats['errors']:
+        print("Lines answered with an error:\n    %d" % stats['errors'])
+
+def stream_output(args, options, profiler, lines=None):
+    # Feeds the converter (or the given lines) straight into the sender,
+    # so the controller starts playing while the rest of the song is
+    # being converted
+    from lib.converter import convert, EnvelopeError
+    from lib.grblsim import GrblSimulator
+    from lib.parsers import ParseError
+    from lib.profiler import no_profiler
+    from lib.sender import SenderError, stream_to
+
+    feedrate_factor = rate_dict.get(options.feedrate)[2]
+    if not args.simulate and feedrate_factor != 60.0:
+        print("WARNING: GRBL reads F in units per minute, consider -feedrate minutes")
+    simulator = None
+    port = args.port
+    if args.simulate:
+        simulator = GrblSimulator(args.rxbuffer, speed=args.simspeed, feedrate_factor=feedrate_factor,
+                                  latency=args.simlatency / 1000.0).start()
+        port = simulator.port
+        print("Simulated controller on:\n    %s" % port)
+    timer = profiler or no_profiler
+    live = lines is not None
+    try:
+        with timer.timed('stream'):
+            if lines is None:
+                lines = convert(args.infile, args.machine, options, log=print, profiler=profiler)
+            stats = stream_to(port, lines, args.baud, args.rxbuffer, log=print)
+        timer.count('stream', stats['lines'])
+    except EnvelopeError as e:
+        print("\n*** ERROR ***")
+        print(e)
+        if live:
+            print("Streaming stopped, the machine has played part of the song.")
+        else:
+            print("Nothing was streamed.")
+        return 2
+    except ParseError as e:
+        print("\n*** ERROR *** Cannot read %s (%s)" % (args.infile, e))
+        print("Streaming stopped, the machine may have played part of the song.")
+        return 1
+    except (SenderError, OSError) as e:
+        print("\n*** ERROR ***")
+        print("Streaming to %s failed: %s" % (port, e))
+        return 1
+    finally:
+        if simulator is not None:
+            simulator.stop()
+    print_stream_stats(stats)
+    if simulator is not None:
+        sim = simulator.stats()
+        print("Controller receive buffer overflows:\n    %d bytes" % sim['overflows'])
+        print("Controller planner underruns:\n    %d, standing still for %.3f s of %.3f s of motion" % (
+            sim['starved'], sim['starved_time'], sim['motion_time']))
+    return 0
+
+def latency_lines(lines, reader, latencies):
+    # Passes the lines on, timing each one from the arrival of the MIDI
+    # event behind it until whoever reads the lines is done with it
+    for line in lines:
+        yield line
+        if reader.arrival is not None:
+            latencies.append(time.perf_counter() - reader.arrival)
+
+def print_latencies(latencies, log):
+    if not latencies:
+        return
+    latencies = sorted(latencies)
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000.0
+    log("Event to Gcode latency (%d lines) mean / p50 / p99 / max:\n    %.3f / %.3f / %.3f / %.3f ms" % (
+        len(latencies), sum(latencies) / len(latencies) * 1000.0, percentile(0.5), percentile(0.99), latencies[-1] * 1000.0))
+
+def stream_main(args):
+    from lib.converter import convert_stream, resolve_options, option_defaults, EnvelopeError
+    from lib.livemidi import LiveMidiReader, LiveMidiError
+
+    # With the Gcode on the standard output, the messages go elsewhere
+    if args.outfile == '-' and not (args.port or args.simulate):
+        log = lambda *text: print(*text, file=sys.stderr)
+    else:
+        log = print
+    options = resolve_options(args.machine, {name: getattr(args, name) for name in option_defaults if hasattr(args, name)})
+    options.comments = suppress_comments == 0
+    if options.positions != 'reverse':
+        log("A MIDI stream can only be played with -positions reverse")
+        return 1
+
+    source = sys.stdin.buffer if args.stream == '-' else open(args.stream, 'rb', buffering=0)
+    reader = LiveMidiReader(source, set(options.channels))
+    latencies = []
+    lines = latency_lines(convert_stream(reader, args.machine, options, log, args.division), reader, latencies)
+    try:
+        if args.port or args.simulate:
+            status = stream_output(args, options, None, lines)
+        else:
+            outfile = sys.stdout if args.outfile == '-' else open(args.outfile, 'w')
+            try:
+                for line in lines:
+                    outfile.write(line)
+                    outfile.flush()
+            finally:
+                if outfile is not sys.stdout:
+                    outfile.close()
+            status = 0
+    except LiveMidiError as e:
+        log("\n*** ERROR ***")
+        log(e)
+        status = 1
+    except EnvelopeError as e:
+        log("\n*** ERROR ***")
+        log(e)
+        log("The stream was stopped there.")
+        status = 2
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+    log("MIDI stream:\n    %d events in %d bytes" % (reader.events, reader.bytes))
+    print_latencies(latencies, log)
+    return status
+
+def tune_main(parser, args):
+    # Every line read is parsed on top of the settings before it
+    import copy
+    import shlex
+    from lib.converter import resolve_options, option_defaults, EnvelopeError
+    from lib.gcodewriter import GCodeWriter
+    from lib.session import Session
+
+    session = Session(args.infile, args.parser, args.sidecar, log=print)
+    print("MIDI file read in:\n    %.3f s" % session.load_time)
+    print('Enter more settings to convert again with, or "quit"')
+    while True:
+        options = resolve_options(args.machine, {name: getattr(args, name) for name in option_defaults if hasattr(args, name)})
+        options.comments = suppress_comments == 0
+        options.compact = not args.nocompact
+        started = time.perf_counter()
+        with open(args.outfile, 'w') as outfile:
+            writer = GCodeWriter(outfile, options.ppu, options.precision)
+            try:
+                writer.write_lines(session.convert(args.machine, options, log=print))
+            except EnvelopeError as e:
+                print("*** ERROR ***\n%s" % e)
+            writer.flush()
+        print("Wrote %d lines to %s in %.3f s" % (writer.lines, args.outfile, time.perf_counter() - started))
+
+        while True:
+            try:
+                line = input('mid2cnc> ').strip()
+            except EOFError:
+                print()
+                return 0
+            if line in ('q', 'quit', 'exit'):
+                return 0
+            try:
+                changed = parser.parse_args(shlex.split(line), namespace=copy.copy(args))
+            except SystemExit:
+                # argparse has said what is wrong already
+                continue
+            if changed.infile != args.infile:
+                print("-tune keeps the same MIDI file, start again for another one")
+                continue
+            args = changed
+            break
+
+def serve_main(args):
+    import signal
+    from lib.daemon import ConversionDaemon, DaemonError
+
+    daemon = ConversionDaemon(args.serve, args.jobs, args.queue, log=print)
+    try:
+        daemon.listen()
+    except (DaemonError, OSError) as e:
+        print("Cannot serve on %s: %s" % (args.serve, e))
+        return 1
+    # SIGTERM stops the daemon the same way as Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.shutdown()
+    return 0
+
+def print_health(args):
+    from lib.daemon import DaemonError, remote_request
+
+    try:
+        stats = remote_request(args.health, 'stats')
+    except (DaemonError, OSError) as e:
+        print("No daemon answering on %s: %s" % (args.health, e))
+        return 1
+    print("Daemon on:\n    %s, up for %.1f s" % (args.health, stats['uptime']))
+    print("Busy / queued workers:\n    %d of %d / %d of %d" % (stats['busy'], stats['workers'], stats['queued'], stats['queue']))
+    print("Converted / failed / turned down:\n    %d / %d / %d" % (
+        stats.get('converted', 0), stats.get('failed', 0), stats.get('rejected', 0)))
+    if 'latency_p50' in stats:
+        print("Conversion latency p50 / p99:\n    %.2f / %.2f ms" % (stats['latency_p50'] * 1000.0, stats['latency_p99'] * 1000.0))
+    return 0
+
+def request_main(args):
+    from lib.converter import option_defaults, read_lines
+    from lib.daemon import DaemonError, remote_convert
+
+    # The daemon gets the MIDI file and the settings, the same that
+    # would go to convert() here
+    options = {name: getattr(args, name) for name in option_defaults if hasattr(args, name)}
+    options['comments'] = suppress_comments == 0
+    options['compact'] = not args.nocompact
+    options['prefix'] = read_lines(args.prefix)
+    options['postfix'] = read_lines(args.postfix)
+    options['name'] = os.path.basename(args.infile)
+    with open(args.infile, 'rb') as f:
+        midi = f.read()
+
+    started = time.perf_counter()
+    result = {}
+    try:
+        with open(args.outfile, 'w') as outfile:
+            for text in remote_convert(args.request, midi, args.machine, options, result):
+                outfile.write(text)
+    except (DaemonError, OSError) as e:
+        print("\n*** ERROR ***")
+        print("The daemon on %s could not convert %s: %s" % (args.request, args.infile, e))
+        return 1
+    print("Wrote %d lines to %s in %.3f s (%.3f s converting)" % (
+        result['lines'], args.outfile, time.perf_counter() - started, result['wall']))
+    return 0
 
 def main(argv):
-    x=0.0
-    y=0.0
-    z=0.0
-
-    x_dir=1.0;
-    y_dir=1.0;
-    z_dir=1.0;
-
-    #midi = midiparser.File(args.infile.name)
-    midi = mido.MidiFile(args.infile.name)
-    midi.debug = True
-
-    print("\nMIDI file:\n    %s" % os.path.basename(args.infile.name))
-    print("MIDI charset:\n    %s" % midi.charset)
-    print("Number of tracks:\n    %d" % len(midi.tracks))
-    print("Timing division:\n    %d" % midi.ticks_per_beat)
-
-    noteEventList=[]
-    all_channels=set()
-    track_num = 0
-
-    for track in midi.tracks:
-        track: mido.MidiTrack
-        absolute_time = 0
-        channels=set()
-        for event in track:
-            event: mido.Message
-            #Events return delta-time apparantly (Time since last event)
-            #Adding these should give absolute times
-            absolute_time += event.time
-            if event is mido.messages.BaseMessage:
-                print("Basemessage")
-            if event is mido.Message:
-                print("Message")
-            if event is mido.MetaMessage:
-                print("MetaMessage")
-            if event is mido.UnknownMetaMessage:
-                print("UnknownMetaMessage")
-            if event.is_meta and event.type == "set_tempo":
-                tempo=event.tempo
-                if args.verbose:
-                    print("Tempo change: " + str(tempo))
-            if event.is_meta and event.type == "time_signature":
-                if args.verbose:
-                    print(f"Time Signature: {event.numerator}/{event.denominator}")
-                    print(f"Notated 32nd notes pr. beat: {event.notated_32nd_notes_per_beat}")
-                    print(f"Clocks pr. click: {event.clocks_per_click}")
-            if event.is_meta and event.type == "key_signature":
-                if args.verbose:
-                    print(f"Key Signature: {event.key}")
-            if ((event.type == "control_change") and (event.channel in args.channels)):
-                if event.control >= 32 and \
-                     event.control <= 63: pass # ===[ LSB Controller for 0-31 ]===
-                                               # Same as 0 to 32 below, but value is little-endian, not big as usual
-                elif event.control == 0: pass  # ===[ Bank Select ]===
-                                               # Allows user to switch bank for patch selection.
-                                               # Program change used with Bank Select.
-                                               # MIDI can access 16,384 patches per MIDI channel.
-                elif event.control == 1: pass  # ===[ Modulation Wheel ]===
-                                               # Generally this CC controls a vibrato
-                                               # effect (pitch, loudness, brighness).
-                                               # What is modulated is based on the patch.
-                elif event.control == 2: pass  # ===[ Breath Controller ]===
-                                               # Oftentimes associated with aftertouch 
-                                               # messages. It was originally intended for use with a breath
-                                               # MIDI controller in which blowing harder produced higher MIDI
-                                               # control values. It can be used for modulation as well.
-                elif event.control == 3: pass  # !=== Undefined ===!
-                elif event.control == 4: pass  # ===[ Foot Pedal ]===
-                                               # Often used with aftertouch messages.
-                                               # It can send a continuous stream of values based on how the pedal is used.
-                elif event.control == 5: pass  # ===[ Portamento Time ]===
-                                               # Controls portamento rate to slide
-                                               # between 2 notes played subsequently.
-                elif event.control == 6: pass  # ===[ Data Entry ]===
-                                               # Controls Value for NRPN or RPN parameters.
-                elif event.control == 7: pass  # ===[ Volume ]===
-                                               # Controls the volume of the channel.
-                elif event.control == 8: pass  # ===[ Balance ]===
-                                               # Controls the left and right balance, generally
-                                               # for _stereo_ patches. A value of 64 equals the center.
-                elif event.control == 9: pass  # !=== Undefined ===!
-                elif event.control == 10: pass # ===[ Pan ]===
-                                               # Controls the left and right balance, generally
-                                               # for _mono_ patches. A value of 64 equals the center.
-                elif event.control == 11: pass # ===[ Expression ]===
-                                               # Expression is a percentage of volume (CC7).
-                elif event.control == 12: pass # ===[ Effect Controller 1 ]===
-                                               # Usually used to control a parameter of an effect within
-                                               # the synth or workstation.
-                elif event.control == 13: pass # ===[ Effect Controller 2 ]===
-                                               # Usually used to control a parameter of an effect within
-                                               # the synth or workstation.
-
-                # 14-15 undefined, 15-19 General purpose, 20-31 undefined
-
-                elif event.control == 64: pass # ===[ Damper/sustain Pedal on/off ]===
-                                               # Value of ≤63 is off, and ≥64 is on
-                                               # On/off switch that controls sustain pedal. Nearly
-                                               # every synth will react to CC 64. (See also Sostenuto CC 66)
-                elif event.control == 65: pass # ===[ Portamento on/off ]===
-                                               # On/off switch (Value of ≤63 is off, and ≥64 is on)
-                                               # Portamento is a slide from one note to another,
-                                               # especially in instruments such as the violin.
-                elif event.control == 66: pass # ===[ Sostenuto Pedal on/off ]===
-                                               # On/off switch – Like the Sustain controller (CC 64),
-                                               # However, it only holds notes that were “On” when the
-                                               # pedal was pressed. People use it to “hold” chords”
-                                               # and play melodies over the held chord.
-                elif event.control == 67: pass # ===[ Soft Pedal on/off ]===
-                                               # On/off switch
-                                               # Lowers the volume of notes played.
-                elif event.control == 68: pass # ===[ Legato FootSwitch ]===
-                                               # Turns Legato effect between 2 subsequent notes on or off.
-                elif event.control == 69: pass # ===[ Hold 2 ]===
-                                               # Another way to “hold notes” (see MIDI CC 64 and
-                                               # MIDI CC 66). However notes fade out according to their
-                                               # release parameter rather than when the pedal is released.
-                elif event.control == 70: pass # ===[ Sound Controller 1 ]===
-                                               # Usually controls the way a sound is produced.
-                                               # Default = Sound Variation.
-                elif event.control == 71: pass # ===[ Sound Controller 2 ]===
-                                               # Allows shaping the Voltage Controlled Filter (VCF).
-                                               # Default = Resonance also (Timbre or Harmonics)
-                elif event.control == 72: pass # ===[ Sound Controller 3 ]===
-                                               # Controls release time of the Voltage controlled
-                                               # Amplifier (VCA). Default = Release Time.
-                elif event.control == 73: pass # ===[ Sound Controller 4 ]===
-                                               # Controls the “Attack’ of a sound. The attack is
-                                               # the amount of time it takes for the sound to reach maximum amplitude.
-                elif event.control == 74: pass # ===[ Sound Controller 5 ]===
-                                               # Controls VCFs cutoff frequency of the filter.
-                elif event.control >= 75 and \
-                     event.control <= 79: pass # ===[ Sound Controller 6 to 10 ]===
-                                               # Generic – Some manufacturers may use to further shave their sounds.
-
-                # 80-83 Is generic controls
-
-                elif event.control == 84: pass # ===[ Portamento CC Control ]===
-                                               # Controls the amount of Portamento.
-                # 85-90 undefined
-
-                elif event.control == 91: pass # ===[ Effects Depth: Reverb ]===
-                                               # Usually controls reverb send amount
-                elif event.control == 92: pass # ===[ Effects Depth: Tremolo ]===
-                                               # Usually controls tremolo amount
-                elif event.control == 93: pass # ===[ Effects Depth: Chorus ]===
-                                               # Usually controls chorus amount
-                elif event.control == 94: pass # ===[ Effects Depth: Celeste (Detune) ]===
-                                               # Usually controls detune amount
-                elif event.control == 95: pass # ===[ Effects Depth: Phaser ]===
-                                               # Usually controls phaser amount
-
-                # 96-101 Non defined parameter adjustments
-                # 102-119 undefined
-
-                # 120-127 is channel "mode" messages. No values are used except for CC 122 and 126
-                elif event.control == 120: pass # ===[ All Sound Off ]===
-                                                # Mutes all sound. It does so regardless of release
-                                                # time or sustain. (See MIDI CC 123)
-                elif event.control == 121: pass # ===[ Reset All Controllers ]===
-                                                # It will reset all controllers to their default.
-                elif event.control == 122: pass # ===[ Local on/off Switch ]===
-                                                # Turns internal connection of a MIDI keyboard or
-                                                # workstation, etc. on or off. If you use a computer, you
-                                                # will most likely want local control off to avoid notes
-                                                # being played twice. Once locally and twice when
-                                                # the note is sent back from the computer to your keyboard.
-                                                # 0 = off , 127 = on
-                elif event.control == 123: pass # ===[ All Notes Off ]===
-                                                # Mutes all sounding notes. Release time will still be
-                                                # maintained, and notes held by sustain will not turn
-                                                # off until sustain pedal is depressed.
-                elif event.control == 124: pass # ===[ Omni Mode Off ]===
-                                                # Sets to “Omni Off” mode.
-                elif event.control == 125: pass # ===[ Omni Mode On ]===
-                                                # Sets to “Omni On” mode.
-                elif event.control == 126: pass # ===[ Mono Mode ]===
-                                                # Sets device mode to Monophonic. The value equals the
-                                                # number of channels, or 0 if the number of channels
-                                                # equals the number of voices in the receiver.
-                elif event.control == 127: pass # ===[ Poly Mode ]===
-                                                # Sets device mode to Polyphonic.
-                
-            if ((event.type == "note_on") and (event.channel in args.channels)): # filter undesired instruments
-
-                if event.channel not in channels:
-                    channels.add(event.channel)
-
-                # NB: looks like some use "note on (vel 0)" as equivalent to note off, so check for vel=0 here and treat it as a note-off.
-                # Comment: note_on (vel 0) is indeed used as note_off, but it is to keep the status flag set to running, thus
-                # making the MIDI communication more efficient
-
-                if event.velocity > 0:
-                    noteEventList.append([absolute_time, 1, event.note, event.velocity])
-                    if args.verbose:
-                        print("Note on  (time, channel, note, velocity) : %6i %6i %6i %6i" % (absolute_time, event.channel, event.note, event.velocity) )
-                else:
-                    noteEventList.append([absolute_time, 0, event.note, event.velocity])
-                    if args.verbose:
-                        print("Note off (time, channel, note, velocity) : %6i %6i %6i %6i" % (absolute_time, event.channel, event.note, event.velocity) )
-            if (event.type == "note_off") and (event.channel in args.channels):
-
-                if event.channel not in channels:
-                    channels.add(event.channel)
-
-                noteEventList.append([absolute_time, 0, event.note, event.velocity])
-                if args.verbose:
-                    print("Note off (time, channel, note, velocity) : %6i %6i %6i %6i" % (absolute_time, event.channel, event.note, event.velocity) )
-
-        # Finished with this track
-        if len(channels) > 0:
-            msg=', ' . join(['%2d' % ch for ch in sorted(channels)])
-            print('Processed track %d, containing channels numbered: [%s ]' % (track_num, msg))
-            all_channels = all_channels.union(channels)
-        track_num += 1
-
-    # List all channels encountered
-    if len(all_channels) > 0:
-        msg=', ' . join(['%2d' % ch for ch in sorted(all_channels)])
-        print('The file as a whole contains channels numbered: [%s ]' % msg)
-
-    # We now have entire file's notes with abs time from all channels
-    # We don't care which channel/voice is which, but we do care about having all the notes in order
-    # so sort event list by abstime to dechannelify
-
-    noteEventList.sort()
-    # print noteEventList
-    # print len(noteEventList)
-
-    last_time=-0
-    active_notes={} # make this a dict so we can add and remove notes by name
-
-    # Start the output to file...
-    # It would be nice to add some metadata here, such as who/what generated the output, what the input file was,
-    # and important playback parameters (such as steps/in assumed and machine envelope).
-    # Unfortunately G-code comments are not 100% standardized...
-
-    if suppress_comments == 0:
-        args.outfile.write ("( Input file was " + os.path.basename(args.infile.name) + " )\n")
-        
-    # Code for everyone
-    if args.units == 'imperial':
-        args.outfile.write ("G20 (Imperial Hegemony Forevah!)\n")
-    elif args.units == 'metric':
-        args.outfile.write ("G21 (Metric FTW)\n")
-    else:
-        print("\nWARNING: Gcode metric/imperial setting undefined!\n")
-
-    args.outfile.write ("G90 (Absolute posiitioning)\n")
-    args.outfile.write ("G92 X0 Y0 Z0 (set origin to current position)\n")
-    args.outfile.write ("G94 (set feed to mm/min)\n")
-    args.outfile.write ("G0 X0 Y0 Z0 F2000.0 (Pointless move to origin to reset feed rate to a sane value)\n")
-
-    # Handle the prefix Gcode, if present
-    if args.prefix != None:
-        # Read file and dump to outfile
-        for line in args.prefix:
-            args.outfile.write (line) 
-
-    for note in noteEventList:
-        # note[abs-time, 1=on 0=off, note, velocity]
-        # Issue that next is that the length of the note isn't calculated from ON to OFF,
-        # just from last time any note went on/off happened.
-        # The first note will not work, since it's duration here will be "time since zero-time"
-        # Duration should always look ahead to the turn-off message for the note
-        # A list of "ON" notes should be kept, and track/channel should determin what axis it should
-        # be played on. If a channel/track has multiple notes, user should be able to set
-        # the "critical" notes to be played.
-        # After running trough the entire song, the axis should be evaluated for MIN and MAX feedrate
-        # since VERY low feedrates might need an octave transposing up, likewise for very high transpose down.
-        # Possible options are to input a range of feedrates that the axis "plays best", and the
-        # program can try and transpose all axis up or down by just one semitone.
-        # Any song will be "OK" if ALL axis are transposed semitonal, and still OK if just one axis is transposed
-        # a full octave.
-        if last_time < note[0]:
-        
-            freq_xyz=[0,0,0]
-            feed_xyz=[0,0,0]
-            distance_xyz=[0,0,0]
-            duration=0.0
-
-            # "i" ranges from 0 to "the number of active notes *or* the number of active axes, 
-            # whichever is LOWER". Note that the range operator stops
-            # short of the maximum, so this means 0 to 2 at most for a 3-axis machine.
-            # E.g. only look for the first few active notes to play despite what
-            # is going on in the actual score.
-
-            for i in range(0, min(len(active_notes.values()), active_axes)): 
-
-                # Which axis are should we be writing to?
-                # 
-                j = axes_dict.get(args.axes)[i]
-
-                # Debug
-                # print"Axes %s: item %d is %d" % (axes_dict.get(args.axes), i, j)
-
-                # Sound higher pitched notes first by sorting by pitch then indexing by axis
-                #
-                nownote=sorted(active_notes.values(), reverse=True)[i]
-
-                # MIDI note 69     = A4(440Hz)
-                # 2 to the power (69-69) / 12 * 440 = A4 440Hz
-                # 2 to the power (64-69) / 12 * 440 = E4 329.627Hz
-                #
-                freq_xyz[j] = pow(2.0, (nownote-69 + int(args.transpose[j]))/12.0)*440.0
-
-                # Here is where we need smart per-axis feed conversions
-                # to enable use of X/Y *and* Z on a Makerbot
-                #
-                # feed_xyz[0] = X; feed_xyz[1] = Y; feed_xyz[2] = Z;
-                #
-                # Feed rate is expressed in feedrate_factor times
-                # scaling factor is required.
-                
-                feed_xyz[j] = ( freq_xyz[j] * feedrate_factor ) / args.ppu[j]
-
-                # Get the duration in seconds from the MIDI values in divisions, at the given tempo
-                duration = mido.tick2second(note[0] - last_time, midi.ticks_per_beat, tempo)
-                #duration = ( ( ( note[0] - last_time ) + 0.0 ) / ( midi.ticks_per_beat + 0.0 ) * ( tempo / 1000000.0 ) )
-
-                # Get the actual relative distance travelled per axis in mm
-                distance_xyz[j] = ( feed_xyz[j] * duration ) / feedrate_factor
-
-            # Now that axes can be addressed in any order, need to make sure
-            # that all of them are silent before declaring a rest is due.
-            if distance_xyz[0] + distance_xyz[1] + distance_xyz[2] > 0.0: 
-                # At least one axis is playing, so process the note into
-                # movements
-                #
-                combined_feedrate = math.sqrt(feed_xyz[0]**2 + feed_xyz[1]**2 + feed_xyz[2]**2)
-                
-                if args.verbose:
-                    print("Chord: [%7.3f, %7.3f, %7.3f] in Hz for %5.2f seconds at timestamp %i" % (freq_xyz[0], freq_xyz[1], freq_xyz[2], duration, note[0]))
-                    print(" Feed: [%7.3f, %7.3f, %7.3f] XYZ %s/min and %8.2f combined" % (feed_xyz[0], feed_xyz[1], feed_xyz[2], scheme[1], combined_feedrate ))
-                    print("Moves: [%7.3f, %7.3f, %7.3f] XYZ relative %s" % (distance_xyz[0], distance_xyz[1], distance_xyz[2], scheme[0] ))
-
-                # Turn around BEFORE crossing the limits of the 
-                # safe working envelope
-                #
-                if reached_limit( x, distance_xyz[0], x_dir, args.safemin[0], args.safemax[0] ):
-                    x_dir = x_dir * -1
-                x = (x + (distance_xyz[0] * x_dir))
-               
-                if reached_limit( y, distance_xyz[1], y_dir, args.safemin[1], args.safemax[1] ):
-                    y_dir = y_dir * -1
-                y = (y + (distance_xyz[1] * y_dir))
-               
-                if reached_limit( z, distance_xyz[2], z_dir, args.safemin[2], args.safemax[2] ):
-                    z_dir = z_dir * -1
-                z = (z + (distance_xyz[2] * z_dir))
-               
-                if args.verbose:
-                    print("G01 X%.10f Y%.10f Z%.10f F%.10f\n" % (x, y, z, combined_feedrate))
-                args.outfile.write("G01 X%.10f Y%.10f Z%.10f F%.10f\n" % (x, y, z, combined_feedrate))
-
-            else:
-                if duration > 0:
-                    # This will never happen.
-                    # When all distance_xyz are set to zero, the duration will also be zero
-                    # But the above else statement will trigger when all notes go off.
-                    # 
-                    # Pauses need to be handeled differently.
-                    # A solution would be to get the most quiet and most sensitive axis
-                    # and set it to the lowest feedrate possible for that machine
-                    # and let it travel a distance that results in the "pause" time being satisfied
-                    # with a very quiet movement of the most silent axis.
-
-                    # Handle 'rests' in addition to notes.
-                    # How standard is this pause gcode, anyway?
-                    args.outfile.write("G04 P%0.4f\n" % duration )
-                    if args.verbose:
-                        print("Pause for %.2f seconds" % duration)
-                        print("G04 P%0.4f\n" % duration)
-
-            # finally, set this absolute time as the new starting time
-            last_time = note[0]
-
-        if note[1]==1: # Note on
-            if note[2] in active_notes:
-                if args.verbose:
-                    print("Warning: tried to turn on note already on!")
-            else:
-                # key and value are the same, but we don't really care.
-                active_notes[note[2]]=note[2]
-        elif note[1]==0: # Note off
-            if note[2] in active_notes:
-                active_notes.pop(note[2])
-            else:
-                if args.verbose:
-                    print("Warning: tried to turn off note that wasn't on!")
-
-    # Handle the postfix Gcode, if present
-    if args.postfix != None:
-        # Read file and dump to outfile
-        for line in args.postfix:
-            args.outfile.write (line) 
-    
+    parser = build_parser()
+    args = parser.parse_args(argv[1:])
+
+    if args.cachestats:
+        if not args.cache:
+            print("-cachestats needs the -cache directory")
+            return 1
+        print_cache_stats(args)
+        return 0
+
+    if args.batch:
+        return batch_main(args)
+
+    if args.stream:
+        return stream_main(args)
+
+    if args.serve:
+        return serve_main(args)
+
+    if args.health:
+        return print_health(args)
+
+    # Everything from here on reads the input file
+    if args.infile is None:
+        args.infile = default_infile
+    if not os.path.isfile(args.infile):
+        parser.error("argument -infile: can't open '%s'" % args.infile)
+
+    if args.request:
+        return request_main(args)
+
+    if os.path.getsize(args.infile) == 0:
+        msg="Input file %s is empty! Aborting." % os.path.basename(args.infile)
+        raise argparse.ArgumentTypeError(msg)
+
+    if args.info:
+        print_info(args.infile)
+        return 0
+
+    if args.parity:
+        return print_parity(args.infile, args.channels)
+
+    # From here on it's a conversion, with the converter needed
+    import cProfile
+    from lib.converter import resolve_options, option_defaults
+    from lib.parsers import available
+    from lib.profiler import Profiler
+
+    if not available(args.parser):
+        print("The %s parser needs python-midi, install it from https://github.com/vishnubob/python-midi" % args.parser)
+        return 1
+
+    # Everything that affects the output goes to the converter, the
+    # machine profile fills in whatever wasn't given
+    options = resolve_options(args.machine, {name: getattr(args, name) for name in option_defaults if hasattr(args, name)})
+    options.comments = suppress_comments == 0
+    options.compact = not args.nocompact
+    if args.drift:
+        return print_drift(args, options)
+    if args.preview:
+        return write_preview(args, options)
+    print_settings(args, options)
+
+    if args.tune:
+        return tune_main(parser, args)
+
+    profiler = Profiler() if args.profile else None
+    if args.cprofile:
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+
+    # Only open the output now, so that e.g. --info never truncates it
+    try:
+        if args.port or args.simulate:
+            return stream_output(args, options, profiler)
+        return write_output(args, options, profiler)
+    finally:
+        if args.cprofile:
+            cprofile.disable()
+            cprofile.dump_stats(args.cprofile)
+            print("Profile statistics written to:\n    %s" % args.cprofile)
+        if profiler is not None:
+            write_profile(args, profiler)
+
 if __name__ == "__main__":
-    main(sys.argv)
+    sys.exit(main(sys.argv))
@@ -0,0 +1,42 @@
+# The modes of mid2cnc.py that don't read -infile must run from any
+# working directory, not only from the repository
+
+import os
+import subprocess
+import sys
+
+from lib.synthmidi import synthetic_midi
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+script = os.path.join(root, 'mid2cnc.py')
+
+
+def run(cwd, *args, **kwargs):
+    return subprocess.run([sys.executable, script] + list(args), cwd=cwd,
+                          capture_output=True, **kwargs)
+
+
+def without_comments(text):
+    return [line for line in text.splitlines() if not line.startswith('(')]
+
+
+def test_batch_outside_the_repository(tmp_path):
+    (tmp_path / 'in').mkdir()
+    (tmp_path / 'in' / 'song.mid').write_bytes(synthetic_midi(300, tracks=2))
+    result = run(tmp_path, '-batch', 'in', '-outdir', 'out', text=True)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert (tmp_path / 'out' / 'song.gcode').stat().st_size > 0
+
+
+def test_stream_outside_the_repository(tmp_path):
+    # The track of a one track file, played through -stream, gives the
+    # moves of the file conversion
+    midi = synthetic_midi(300, tracks=1, ticks_per_beat=240)
+    (tmp_path / 'song.mid').write_bytes(midi)
+    track = midi[14 + 8:]
+    result = run(tmp_path, '-stream', '-division', '240', '-outfile', '-', input=track)
+    assert result.returncode == 0, result.stderr.decode()
+
+    converted = run(tmp_path, '-infile', 'song.mid', '-outfile', 'song.gcode', '-nocompact', text=True)
+    assert converted.returncode == 0, converted.stdout + converted.stderr
+    assert without_comments(result.stdout.decode()) == without_comments((tmp_path / 'song.gcode').read_text())
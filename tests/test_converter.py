@@ -0,0 +1,24 @@
+# Tests for the envelope checks of lib/converter.py
+
+import os
+
+import pytest
+
+from lib.converter import convert, EnvelopeError
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+song = os.path.join(root, 'midi_files', 'Imperial_March.mid')
+
+
+# A 1 wide envelope is narrower than some moves, which both settings
+# reject. In a 3 wide one reverse can't make a move from where an axis
+# happens to be. Either way no line comes out.
+@pytest.mark.parametrize('positions, safemax', [
+    ('fold',    (1, 1, 1)),
+    ('reverse', (1, 1, 1)),
+    ('reverse', (3, 3, 3)),
+])
+def test_envelope_checked_before_the_first_line(positions, safemax):
+    lines = convert(song, 'multicam_custom', {'positions': positions, 'safemin': (0, 0, 0), 'safemax': safemax})
+    with pytest.raises(EnvelopeError):
+        next(lines)
@@ -0,0 +1,76 @@
+# Tests for the note decoder of lib/midiparser.py
+
+from itertools import chain
+
+import pytest
+
+from lib.midiparser import File, MidiError, meta, readNotes, voice
+from lib.notetable import NoteTable
+from lib.stream import sorted_by_tick, table_events, TEMPO
+from lib.synthmidi import synthetic_midi
+
+
+def test_read_notes_fills_blocks():
+    midi = File(synthetic_midi(500, tracks=1, tempo_every=8))
+    data = midi.track_chunks[0].data
+    blocks = list(readNotes(data, 0, block_size=64))
+    assert all(isinstance(block, NoteTable) for block in blocks)
+    assert all(len(block) <= 64 for block in blocks)
+    assert sum(len(block) for block in blocks) == 500
+    assert sum(len(block.tempos) for block in blocks) > 1
+
+    # However the track is cut into blocks, the events are the same
+    whole = list(readNotes(data, 0, block_size=1000))
+    assert len(whole) == 1
+    events = list(sorted_by_tick(chain.from_iterable(table_events(block, 0) for block in blocks)))
+    assert events == list(sorted_by_tick(table_events(whole[0], 0)))
+    assert len([event for event in events if event[1] == TEMPO]) == len(whole[0].tempos)
+
+
+def test_truncated_file():
+    midi = synthetic_midi(100, tracks=2)
+    for size in (len(midi) - 10, 14 + 8 + 20):
+        with pytest.raises(MidiError):
+            File(midi[:size])
+
+
+def test_file_closed_after_the_tracks(tmp_path):
+    path = tmp_path / 'song.mid'
+    path.write_bytes(synthetic_midi(100, tracks=2))
+    midi = File(str(path))
+    tracks = midi.track_events()
+    for track in tracks:
+        assert not midi.map.closed
+        for event in track:
+            pass
+    assert midi.map.closed
+
+
+def track_chunk(events):
+    data = bytes(events) + bytes([0, meta.FileMetaEvent, meta.EndTrack, 0])
+    return b'MTrk' + len(data).to_bytes(4, byteorder='big') + data
+
+
+def test_meta_events_cancel_running_status():
+    # A note on, a tempo change, then a note off leaning on the running
+    # status of the note on. The meta event in between cancels it.
+    header = b'MThd' + bytes([0, 0, 0, 6, 0, 0, 0, 1, 0, 96])
+    note_on = [0, voice.NoteOn, 60, 100]
+    tempo = [0, meta.FileMetaEvent, meta.SetTempo, 3, 7, 161, 32]
+    with pytest.raises(MidiError):
+        File(header + track_chunk(note_on + tempo + [96, 60, 0])).check()
+
+    # With the status byte written again the note off is read
+    midi = File(header + track_chunk(note_on + tempo + [96, voice.NoteOn, 60, 0]))
+    blocks = list(readNotes(midi.track_chunks[0].data, 0))
+    assert list(blocks[0].tick) == [0, 96]
+    assert blocks[0].tempos == [(0, 500000)]
+
+
+def test_synthetic_files_follow_the_same_rule():
+    # synthmidi writes a status byte after every tempo change, so its
+    # files read to the end here
+    midi = File(synthetic_midi(500, tracks=2, tempo_every=1))
+    midi.check()
+    for chunk in midi.track_chunks:
+        assert sum(len(block) for block in readNotes(chunk.data, 0)) == 250
@@ -0,0 +1,46 @@
+# Tests for the parser selection of lib/parsers.py
+
+import argparse
+
+import pytest
+
+from lib.parsers import ParseError, parse
+from lib.stream import merge_tracks
+from lib.synthmidi import synthetic_midi
+
+
+def options(parser):
+    return argparse.Namespace(parser=parser, channels=list(range(16)), verbose=False)
+
+
+def with_tune_request(midi):
+    # The file with a tune request (a system common message midiparser
+    # doesn't know, mido skips it) just before the end of the last track
+    data = bytearray(midi)
+    end = len(data) - 4
+    data[end:end] = b'\x00\xf6'
+    start = data.rindex(b'MTrk')
+    length = int.from_bytes(data[start+4:start+8], byteorder='big')
+    data[start+4:start+8] = (length + 2).to_bytes(4, byteorder='big')
+    return bytes(data)
+
+
+def test_auto_falls_back_halfway_through_a_track():
+    midi = with_tune_request(synthetic_midi(300, tracks=2))
+    parsed = parse(midi, options('auto'), print, set())
+    assert parsed.parser == 'mido'
+    assert list(merge_tracks(parsed.tracks)) == list(merge_tracks(parse(midi, options('mido'), print, set()).tracks))
+
+
+def test_midiparser_error_halfway_through_a_track():
+    midi = with_tune_request(synthetic_midi(300, tracks=2))
+    parsed = parse(midi, options('midiparser'), print, set())
+    with pytest.raises(ParseError):
+        list(merge_tracks(parsed.tracks))
+
+
+@pytest.mark.parametrize('parser', ['auto', 'midiparser', 'mido'])
+def test_truncated_file(parser):
+    midi = synthetic_midi(300, tracks=2)
+    with pytest.raises(ParseError):
+        list(merge_tracks(parse(midi[:-100], options(parser), print, set()).tracks))
@@ -0,0 +1,29 @@
+# Streams songs through lib/sender.py to the simulated controller of
+# lib/grblsim.py, far faster than they play
+
+import os
+
+import pytest
+
+from lib.converter import convert
+from lib.grblsim import GrblSimulator
+from lib.sender import stream_to
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# With receive buffers of 107 and 112 bytes the lines of these songs
+# fill them to the last byte now and then, which a ring buffer can't hold
+@pytest.mark.parametrize('rx_buffer', [128, 107, 112])
+@pytest.mark.parametrize('song', ['tuning.mid', 'Imperial_March.mid'])
+def test_stream_to_simulator(song, rx_buffer):
+    lines = list(convert(os.path.join(root, 'midi_files', song), 'multicam_custom', {'feedrate': 'minutes'}))
+    with GrblSimulator(rx_buffer, speed=500.0) as controller:
+        # A line lost to an overflow is never answered, don't wait long
+        stats = stream_to(controller.port, iter(lines), rx_buffer=rx_buffer, timeout=2.0)
+        simulated = controller.stats()
+    sent = [line for line in lines if line.strip() and not line.startswith('(')]
+    assert stats['lines'] == len(sent)
+    assert stats['errors'] == 0
+    assert simulated['lines'] == len(sent)
+    assert simulated['overflows'] == 0
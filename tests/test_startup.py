@@ -0,0 +1,60 @@
+# Startup budget of mid2cnc.py: answering -h or -info must not import
+# the converter or the heavy libraries only a conversion needs, checked
+# with "python -X importtime", which lists every module imported.
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Total import time allowed, in seconds. -h and -info take about 30 ms
+# of imports (the interpreter's own included), with mido and the
+# converter imported as well they took 55 ms or more.
+import_budget = 0.045
+
+heavy_modules = ['mido', 'numpy', 'lib.converter', 'lib.parsers', 'lib.daemon']
+
+
+def imports(*args):
+    # {module: cumulative import time in seconds} of the top level
+    # imports, and the set of every module imported
+    result = subprocess.run([sys.executable, '-X', 'importtime', 'mid2cnc.py'] + list(args),
+                            cwd=root, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    top = {}
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.add(name.strip())
+        if not name[1:].startswith(' '):
+            top[name.strip()] = int(cumulative) / 1e6
+    return top, modules
+
+
+@pytest.mark.parametrize('args', [
+    ['-h'],
+    ['-info', '-infile', 'midi_files/tuning.mid'],
+])
+def test_no_heavy_imports(args):
+    top, modules = imports(*args)
+    assert not modules & set(heavy_modules)
+
+
+def test_help_skips_the_midi_parser():
+    top, modules = imports('-h')
+    assert 'lib.midiparser' not in modules
+
+
+@pytest.mark.parametrize('args', [
+    ['-h'],
+    ['-info', '-infile', 'midi_files/tuning.mid'],
+])
+def test_import_budget(args):
+    # Best of three, so a busy machine doesn't fail it
+    total = min(sum(imports(*args)[0].values()) for _ in range(3))
+    assert total < import_budget, "imports took %.1f ms" % (total * 1000.0)
@@ -0,0 +1,122 @@
+# Tests for lib/voices.py, run with "python -m pytest tests"
+
+import pytest
+
+from lib.voices import VoiceAllocator
+
+
+def test_note_on_and_off():
+    voices = VoiceAllocator()
+    assert voices.note_on(60)
+    assert voices.note_on(64)
+    assert 60 in voices and 64 in voices
+    assert len(voices) == 2
+
+    assert voices.note_off(60)
+    assert 60 not in voices
+    assert list(voices) == [64]
+
+
+def test_repeated_note_on():
+    voices = VoiceAllocator()
+    assert voices.note_on(60)
+    assert not voices.note_on(60)
+    assert len(voices) == 1
+    assert voices.repeated_on == 1
+
+    # One note off is enough, however often the note was turned on
+    assert voices.note_off(60)
+    assert len(voices) == 0
+
+
+def test_note_off_for_silent_note():
+    voices = VoiceAllocator()
+    voices.note_on(60)
+    assert not voices.note_off(61)
+    assert voices.unmatched_off == 1
+    assert list(voices) == [60]
+
+
+def test_extreme_notes():
+    voices = VoiceAllocator()
+    voices.note_on(0)
+    voices.note_on(127)
+    assert voices.top(3) == [127, 0]
+    assert list(voices) == [0, 127]
+
+
+def test_top_is_highest_first():
+    voices = VoiceAllocator()
+    for note in (50, 72, 61, 40, 67):
+        voices.note_on(note)
+    assert voices.top(3) == [72, 67, 61]
+    assert voices.top(10) == [72, 67, 61, 50, 40]
+    assert voices.top(0) == []
+    # top() leaves the notes sounding
+    assert len(voices) == 5
+
+
+def test_top_of_nothing():
+    assert VoiceAllocator().top(3) == []
+
+
+def test_assign_follows_axis_order():
+    voices = VoiceAllocator()
+    voices.note_on(60)
+    voices.note_on(67)
+    assert voices.assign([0, 1, 2]) == [67, 60, -1]
+    assert voices.assign([2, 0]) == [60, -1, 67]
+    assert voices.assign([1]) == [-1, 67, -1]
+
+
+def test_assign_is_stable():
+    voices = VoiceAllocator()
+    voices.note_on(72)
+    voices.note_on(60)
+    first = voices.assign([0, 1, 2])
+
+    # The same notes give the same axes, however often they are asked
+    # for, and asking changes nothing
+    assert voices.assign([0, 1, 2]) == first
+    assert list(voices) == [60, 72]
+
+    # A held note keeps its axis while lower notes come and go
+    voices.note_on(55)
+    assert voices.assign([0, 1, 2])[0] == 72
+    voices.note_off(60)
+    assert voices.assign([0, 1, 2]) == [72, 55, -1]
+
+
+def test_assign_counts_unvoiced_notes():
+    voices = VoiceAllocator()
+    for note in (60, 62, 64, 65, 67):
+        voices.note_on(note)
+    assert voices.assign([0, 1, 2]) == [67, 65, 64]
+    assert voices.unvoiced == 2
+    assert voices.overfull_chords == 1
+
+    voices.assign([0])
+    assert voices.unvoiced == 6
+    assert voices.overfull_chords == 2
+
+    # A chord that fits counts nothing
+    voices.note_off(60)
+    voices.note_off(62)
+    voices.assign([0, 1, 2])
+    assert voices.unvoiced == 6
+    assert voices.overfull_chords == 2
+
+
+def test_counters_start_at_zero():
+    voices = VoiceAllocator()
+    assert (voices.unvoiced, voices.overfull_chords, voices.repeated_on, voices.unmatched_off) == (0, 0, 0, 0)
+
+
+def test_dict_interface():
+    voices = VoiceAllocator()
+    voices[64] = 64
+    voices[60] = 60
+    assert voices.values() == [60, 64]
+    assert voices.pop(64) == 64
+    with pytest.raises(KeyError):
+        voices.pop(64)